@@ -0,0 +1,149 @@
+"""
+latency of /user/me/stats/volume for a user with many exercise-sessions
+
+Seeds a throwaway SQLite database with one user whose workouts add up to
+--sessions exercise-sessions (exercise x workout date) and times
+db_functions.get_volume_stats per period, split into the fetch and the NumPy
+aggregation, next to fetching every exercise-session and summing it in a Python
+loop for reference.
+
+    python -m benchmarks.volume_stats --sessions 100000
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from fitness_api.core import database, db_functions, models, schemas
+
+EXERCISES_PER_WORKOUT = 5
+DATES_PER_WORKOUT = 20
+
+
+def seed(db: Session, sessions: int):
+    db.add(
+        models.User(
+            user_id=1, name="benchmark", email="benchmark@example.com", height=180, weight=80,
+            gender="OTHER", friend_code="benchmark", password_hash="x", account_type="USER",
+        )
+    )
+    workouts = max(sessions // (EXERCISES_PER_WORKOUT * DATES_PER_WORKOUT), 1)
+    first_day = date(2020, 1, 1)
+    db.execute(
+        sa.insert(models.Workout),
+        [{"workout_id": i, "name": f"workout {i}", "user_id": 1} for i in range(1, workouts + 1)],
+    )
+    db.execute(
+        sa.insert(models.WorkoutDate),
+        [
+            {
+                "workout_id": i,
+                "date": first_day + timedelta(days=random.randrange(1500)),
+                "completed": random.random() < 0.8,
+            }
+            for i in range(1, workouts + 1)
+            for _ in range(DATES_PER_WORKOUT)
+        ],
+    )
+    db.execute(
+        sa.insert(models.Exercise),
+        [
+            {
+                "name": f"exercise {j}", "workout_id": i, "user_id": 1, "set": random.randint(1, 5),
+                "repetition": random.randint(1, 12), "duration": random.choice((0, 30, 60)),
+                "weight": random.choice((None, 20.0, 60.0, 100.0)), "rpe": random.choice((None, 7, 8, 9)),
+            }
+            for i in range(1, workouts + 1)
+            for j in range(EXERCISES_PER_WORKOUT)
+        ],
+    )
+    db.commit()
+    return workouts * EXERCISES_PER_WORKOUT * DATES_PER_WORKOUT
+
+
+def exercise_sessions(db: Session, user_id: int):
+    # the straightforward way: one row per exercise-session, summed in Python
+    return db.execute(
+        sa.select(
+            models.WorkoutDate.date,
+            models.Exercise.set,
+            models.Exercise.repetition,
+            models.Exercise.weight,
+            models.Exercise.duration,
+            models.Exercise.rpe,
+        )
+        .select_from(models.Workout)
+        .join(models.WorkoutDate, models.WorkoutDate.workout_id == models.Workout.workout_id)
+        .join(models.Exercise, models.Exercise.workout_id == models.Workout.workout_id)
+        .where(models.Workout.user_id == user_id)
+    ).all()
+
+
+def python_loop(db: Session, user_id: int, period: schemas.VolumePeriod):
+    buckets = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+    for day, sets, repetitions, weight, duration, rpe in exercise_sessions(db, user_id):
+        if period == schemas.VolumePeriod.WEEK:
+            day = day - timedelta(days=day.weekday())
+        elif period == schemas.VolumePeriod.MONTH:
+            day = day.replace(day=1)
+        tonnage = sets * repetitions * (weight or 0)
+        bucket = buckets[day]
+        bucket[0] += 1
+        bucket[1] += tonnage
+        bucket[2] += sets * duration
+        bucket[3] += tonnage * (rpe or 0) / 10
+    return sorted(buckets.items())
+
+
+def timed(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = sa.create_engine(f"sqlite:///{Path(directory) / 'volume.db'}")
+        database.Base.metadata.create_all(engine)
+        with Session(engine) as db:
+            sessions = seed(db, args.sessions)
+            exercises, dates = db_functions.volume_statements(1, None, None, completed_only=False)
+            exercise_rows, date_rows = db.execute(exercises).all(), db.execute(dates).all()
+            print(
+                f"{sessions} exercise-sessions ({len(exercise_rows)} exercises, {len(date_rows)} workout dates), "
+                f"median of {args.repeat} runs"
+            )
+            print(f"{'period':<8}{'endpoint':>12}{'fetch':>12}{'numpy':>12}{'python loop':>14}")
+            for period in schemas.VolumePeriod:
+                total = timed(
+                    lambda: db_functions.get_volume_stats(db, 1, period, completed_only=False), args.repeat
+                )
+                fetch = timed(lambda: (db.execute(exercises).all(), db.execute(dates).all()), args.repeat)
+                vectorized = timed(
+                    lambda: db_functions.volume_stats(exercise_rows, date_rows, period), args.repeat
+                )
+                loop = timed(lambda: python_loop(db, 1, period), args.repeat)
+                print(
+                    f"{period.value:<8}{total:>10.1f}ms{fetch:>10.1f}ms{vectorized:>10.1f}ms{loop:>12.1f}ms"
+                )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+per-user training calendars as bitmaps
+
+A calendar keeps two bitmaps over consecutive days starting at ``start``: the days
+that have at least one workout date scheduled and the days on which at least one
+of them was completed. Bit i stands for ``start + i days``. Python ints serve as
+the bitmaps, so streaks and weekly counts are a handful of shifts, masks and
+popcounts however long the user's history is.
+"""
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+
+def _mask(width: int) -> int:
+    return (1 << width) - 1 if width > 0 else 0
+
+
+def _with_bit(bits: int, index: int, value: bool) -> int:
+    return bits | (1 << index) if value else bits & ~(1 << index)
+
+
+def longest_run(bits: int) -> int:
+    """
+    length of the longest run of set bits: every ``bits & (bits >> 1)`` shortens
+    all runs by one, so the number of steps until nothing is left is the answer
+    """
+    length = 0
+    while bits:
+        bits &= bits >> 1
+        length += 1
+    return length
+
+
+def run_ending_at(bits: int, index: int) -> int:
+    """
+    length of the run of set bits that ends at ``index`` and extends towards bit 0
+    """
+    if index < 0:
+        return 0
+    gaps = ~bits & _mask(index + 1)
+    return index + 1 - gaps.bit_length()
+
+
+@dataclass
+class AdherenceCalendar:
+    start: date
+    scheduled: int = 0
+    completed: int = 0
+
+    def index(self, day: date) -> int:
+        return (day - self.start).days
+
+    def set_day(self, day: date, scheduled: bool, completed: bool):
+        offset = self.index(day)
+        if offset < 0:
+            # rebase so the new day becomes bit 0
+            if not scheduled and not completed:
+                return
+            self.scheduled <<= -offset
+            self.completed <<= -offset
+            self.start = day
+            offset = 0
+        self.scheduled = _with_bit(self.scheduled, offset, scheduled)
+        self.completed = _with_bit(self.completed, offset, completed)
+
+    def stats(self, today: date) -> dict:
+        today_index = self.index(today)
+        # today's workout may still be ahead, so a streak that ended yesterday
+        # is still current
+        current_streak = max(
+            run_ending_at(self.completed, today_index),
+            run_ending_at(self.completed, today_index - 1),
+        )
+        week_start = max(today_index - 6, 0)
+        week = _mask(today_index + 1 - week_start) << week_start if today_index >= 0 else 0
+        scheduled_this_week = (self.scheduled & week).bit_count()
+        completed_this_week = (self.scheduled & self.completed & week).bit_count()
+        return {
+            "current_streak": current_streak,
+            "longest_streak": longest_run(self.completed),
+            "scheduled_this_week": scheduled_this_week,
+            "completed_this_week": completed_this_week,
+            "weekly_completion_rate": (
+                completed_this_week / scheduled_this_week if scheduled_this_week else None
+            ),
+            "week_start": today - timedelta(days=6),
+        }
+
+    @staticmethod
+    def to_bytes(bits: int) -> bytes:
+        return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+    @staticmethod
+    def from_bytes(data: bytes | None) -> int:
+        return int.from_bytes(data or b"", "little")
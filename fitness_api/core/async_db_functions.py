@@ -0,0 +1,894 @@
+"""
+asyncio counterparts of the CRUD functions in db_functions
+
+Every function takes an AsyncSession and awaits the database instead of blocking
+a threadpool worker. Relationships are loaded eagerly because the response models
+walk them after the handler has returned, where async lazy loading is not possible.
+"""
+import random
+import string
+from datetime import date
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, db_functions, models, schemas
+from .auth_executor import run_auth_task
+from .db_functions import (
+    EXERCISE_RESPONSE_OPTIONS,
+    USER_RESPONSE_OPTIONS,
+    WORKOUT_RESPONSE_OPTIONS,
+    VersionConflict,
+    bump_versions,
+    claim_version,
+    clamp_page_size,
+    delete_similarity,
+    drop_adherence_calendars,
+    friends_statement,
+    friendship_edges,
+    get_password_hash,
+    index_exercises,
+    index_new_exercises,
+    keyset_page,
+    keyset_page_statement,
+    keyset_search_page,
+    mark_changed,
+    mark_exercises_changed,
+    personal_record_key,
+    rating_aggregate_updates,
+    record_changes,
+    record_new_changes,
+    record_personal_bests,
+    record_workout_changes,
+    refresh_adherence_days,
+    resolve_tags,
+    retire_personal_record,
+    search_exercises_statement,
+    set_exercise_tags,
+    set_lang_locales,
+    tagged_exercise_ids,
+    top_rated_exercises_statement,
+    update_friend_graph,
+    verify_password,
+    volume_statements,
+    volume_stats,
+)
+from .lang_catalog import CatalogSnapshot, lang_catalog
+from .logging import logger
+from .search import search_document, search_terms
+from .tag_cache import tag_cache
+from .tag_index import tag_index
+from .similarity import similarity_refresher
+from .token_cache import token_cache
+
+
+async def get_database():
+    if database.AsyncSessionLocal is None:
+        raise RuntimeError("Async database mode is not enabled (FITNESS_API_DB_ASYNC)")
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+
+async def paginate(
+    db: AsyncSession, statement, key_column, cursor: str | None, limit: int | None
+) -> dict:
+    limit = clamp_page_size(limit)
+    statement = keyset_page_statement(statement, key_column, cursor, limit)
+    result = await db.execute(statement)
+    return keyset_page(result.scalars().all(), key_column, limit)
+
+
+async def create_database():
+    try:
+        async with database.async_engine.begin() as conn:
+            await conn.run_sync(database.Base.metadata.create_all)
+    except Exception as e:
+        logger.error(f"Error creating database: {e}")
+        raise e
+
+
+async def get_many(db: AsyncSession, model, ids: list[int], expand: dict) -> dict:
+    return await db.run_sync(db_functions.get_many, model, ids, expand)
+
+
+async def get_user(
+    db: AsyncSession,
+    user_email: str | None = None,
+    user_id: int | None = None,
+    options: tuple = USER_RESPONSE_OPTIONS,
+):
+    try:
+        if user_email:
+            condition = models.User.email == user_email
+        elif user_id:
+            condition = models.User.user_id == user_id
+        else:
+            raise Exception("Must provide either user_email or user_id")
+        result = await db.execute(
+            select(models.User)
+            .options(*options)
+            .where(condition)
+            .execution_options(populate_existing=True)
+        )
+        return result.scalars().first()
+    except Exception as e:
+        logger.error(f"Error fetching user: {e}")
+        raise e
+
+
+async def authenticate_user(db: AsyncSession, user_email: str, password: str):
+    user = await get_user(db, user_email=user_email, options=())
+    if not user:
+        logger.debug(f"User {user_email} attempted to log in but does not exist")
+        return False
+    if not await run_auth_task(verify_password, password, user.password_hash):
+        logger.debug(
+            f"User {user_email} attempted to log in with an incorrect password"
+        )
+        return False
+
+    logger.debug(f"User {user_email} successfully logged in")
+    return user
+
+
+async def generate_friend_code(db: AsyncSession):
+    friend_code = ""
+    while True:
+        friend_code = "".join(
+            random.choices(string.ascii_uppercase + string.digits, k=6)
+        )
+        result = await db.execute(
+            select(models.User.user_id).where(models.User.friend_code == friend_code)
+        )
+        if result.first() is None:
+            logger.debug(f"Generated friend code {friend_code}")
+            break
+        logger.debug(f"Friend code {friend_code} already exists, generating another")
+    return friend_code
+
+
+async def create_user(db: AsyncSession, user_data: schemas.UserCreate):
+    db_user = models.User(
+        name=user_data.name,
+        email=user_data.email,
+        height=user_data.height,
+        weight=user_data.weight,
+        birth_date=user_data.birth_date,
+        gender=user_data.gender,
+        friend_code=await generate_friend_code(db),
+        password_hash=await run_auth_task(get_password_hash, user_data.password),
+        account_type="USER",
+    )
+
+    try:
+        db.add(db_user)
+        await db.commit()
+        logger.debug(f"Created user {user_data.email}")
+    except Exception as e:
+        logger.error(f"Error creating user: {e}")
+        await db.rollback()
+        raise e
+
+    return await get_user(db, user_id=db_user.user_id)
+
+
+async def get_user_version(db: AsyncSession, user_id: int) -> int | None:
+    return await db.run_sync(db_functions.get_user_version, user_id)
+
+
+async def update_user(
+    db: AsyncSession, user_id: int, user: schemas.UserUpdate, versions: list[int] | None = None
+):
+    db_user = await get_user(db, user_id=user_id)
+    try:
+        await db.run_sync(claim_version, models.User, user_id, versions)
+        for key, value in user.model_dump().items():
+            if value is not None:
+                setattr(db_user, key, value)
+        await db.run_sync(mark_changed, user_ids=[user_id])
+        await db.commit()
+        token_cache.invalidate_user(user_id)
+        logger.debug(f"Updated user {user_id}")
+    except VersionConflict:
+        await db.rollback()
+        raise
+    except Exception as e:
+        logger.error(f"Error updating user {user_id}: {e}")
+        await db.rollback()
+        raise e
+    return db_user
+
+
+async def delete_user(db: AsyncSession, user_id: int):
+    db_user = await get_user(db, user_id=user_id)
+    try:
+        await db.delete(db_user)
+        await db.commit()
+        token_cache.invalidate_user(user_id)
+        logger.debug(f"Deleted user {user_id}")
+    except Exception as e:
+        logger.error(f"Error deleting user {user_id}: {e}")
+        await db.rollback()
+        raise e
+    return db_user
+
+
+async def get_user_id_from_friend_code(db: AsyncSession, friend_code: str):
+    result = await db.execute(
+        select(models.User.user_id).where(models.User.friend_code == friend_code)
+    )
+    return result.scalar()
+
+
+async def create_friendship_status(
+    db: AsyncSession, status: schemas.FriendshipStatusCreate
+) -> models.FriendshipStatus:
+    db_status = models.FriendshipStatus(name=status.name)
+    db.add(db_status)
+    await db.run_sync(mark_changed, lists=("statuses",))
+    await db.commit()
+    return db_status
+
+
+async def get_friendship_status(db: AsyncSession, status_id: int):
+    return await db.get(models.FriendshipStatus, status_id)
+
+
+async def get_all_friendship_statuses(
+    db: AsyncSession, cursor: str | None = None, limit: int | None = None
+):
+    return await paginate(
+        db,
+        select(models.FriendshipStatus),
+        models.FriendshipStatus.status_id,
+        cursor,
+        limit,
+    )
+
+
+async def update_friendship_status(
+    db: AsyncSession, status_id: int, new_status: schemas.FriendshipStatusCreate
+) -> models.FriendshipStatus:
+    db_status = await get_friendship_status(db, status_id)
+    if not db_status:
+        return None
+    db_status.name = new_status.name
+    await db.run_sync(mark_changed, lists=("statuses",))
+    await db.commit()
+    return db_status
+
+
+async def delete_friendship_status(db: AsyncSession, status_id: int):
+    status = await get_friendship_status(db, status_id)
+    await db.delete(status)
+    await db.run_sync(mark_changed, lists=("statuses",))
+    await db.commit()
+
+
+async def create_friendship(
+    db: AsyncSession, friendship: schemas.FriendshipCreate
+) -> models.Friendship:
+    db_friendship = models.Friendship(
+        user_id=friendship.user_id,
+        friend_id=friendship.friend_id,
+        status_id=friendship.status_id,
+        edges=friendship_edges(friendship.user_id, friendship.friend_id),
+    )
+    try:
+        db.add(db_friendship)
+        await db.flush()
+        await db.run_sync(record_new_changes, schemas.ChangeKind.FRIENDSHIP, [db_friendship.friendship_id])
+        await db.commit()
+    except Exception as e:
+        logger.error(f"Error creating friendship: {e}")
+        await db.rollback()
+        raise e
+    status = await get_friendship_status(db, db_friendship.status_id)
+    update_friend_graph(db_friendship, status.name)
+    return db_friendship
+
+
+async def get_friendship(db: AsyncSession, friendship_id: int):
+    return await db.get(models.Friendship, friendship_id)
+
+
+async def get_all_friendships(
+    db: AsyncSession, cursor: str | None = None, limit: int | None = None
+):
+    return await paginate(
+        db, select(models.Friendship), models.Friendship.friendship_id, cursor, limit
+    )
+
+
+async def get_all_friendships_for_user(
+    db: AsyncSession, user_id: int, cursor: str | None = None, limit: int | None = None
+):
+    return await paginate(
+        db,
+        select(models.Friendship)
+        .join(models.Friendship.edges)
+        .where(models.FriendshipEdge.user_id == user_id),
+        models.Friendship.friendship_id,
+        cursor,
+        limit,
+    )
+
+
+async def get_friendship_version(db: AsyncSession, friendship_id: int) -> int | None:
+    return await db.run_sync(db_functions.get_friendship_version, friendship_id)
+
+
+async def get_friendship_page_versions(
+    db: AsyncSession, user_id: int, cursor: str | None = None, limit: int | None = None
+) -> list[tuple[int, int]]:
+    return await db.run_sync(db_functions.get_friendship_page_versions, user_id, cursor, limit)
+
+
+async def get_friends(
+    db: AsyncSession,
+    user_id: int,
+    status: schemas.StatusEnum | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+):
+    limit = clamp_page_size(limit)
+    statement = keyset_page_statement(
+        friends_statement(user_id, status), models.FriendshipEdge.friend_id, cursor, limit
+    )
+    result = await db.execute(statement)
+    return keyset_page(result.all(), models.FriendshipEdge.friend_id, limit)
+
+
+async def update_friendships_status(
+    db: AsyncSession, friendship_id: int, status_id: int, versions: list[int] | None = None
+) -> models.Friendship:
+    try:
+        await db.run_sync(claim_version, models.Friendship, friendship_id, versions)
+    except VersionConflict:
+        await db.rollback()
+        raise
+    db_friendship = await get_friendship(db, friendship_id)
+    if not db_friendship:
+        return None
+    db_friendship.status_id = status_id
+    await db.run_sync(bump_versions, models.Friendship, [friendship_id])
+    await db.run_sync(record_changes, schemas.ChangeKind.FRIENDSHIP, [friendship_id])
+    await db.commit()
+    status = await get_friendship_status(db, status_id)
+    update_friend_graph(db_friendship, status.name)
+    return db_friendship
+
+
+async def delete_friendship(db: AsyncSession, friendship_id: int):
+    friendship = await get_friendship(db, friendship_id)
+    if not friendship:
+        return None
+    await db.run_sync(record_changes, schemas.ChangeKind.FRIENDSHIP, [friendship_id], deleted=True)
+    await db.delete(friendship)
+    await db.commit()
+    update_friend_graph(friendship, None)
+    return friendship
+
+
+async def get_friend_suggestions(db: AsyncSession, user_id: int, limit: int) -> list[dict]:
+    return await db.run_sync(db_functions.get_friend_suggestions, user_id, limit)
+
+
+async def get_mutual_friend_count(db: AsyncSession, user_id: int, other_user_id: int) -> dict:
+    return await db.run_sync(db_functions.get_mutual_friend_count, user_id, other_user_id)
+
+
+async def create_workout(db: AsyncSession, workout: schemas.WorkoutCreate):
+    db_workout = models.Workout(user_id=workout.user_id, name=workout.name)
+    try:
+        db.add(db_workout)
+        await db.flush()
+        if workout.dates:
+            db.add_all(
+                models.WorkoutDate(
+                    workout_id=db_workout.workout_id, date=workout_date.date
+                )
+                for workout_date in workout.dates
+            )
+            await db.run_sync(
+                refresh_adherence_days,
+                workout.user_id,
+                [workout_date.date for workout_date in workout.dates],
+            )
+        await db.run_sync(record_workout_changes, [db_workout.workout_id], new=True)
+        await db.run_sync(mark_changed, user_ids=[workout.user_id])
+        await db.commit()
+        logger.debug(f"Created workout {db_workout.workout_id}")
+    except Exception as e:
+        logger.error(f"Error creating workout: {e}")
+        await db.rollback()
+        raise e
+    return await get_workout(db, db_workout.workout_id)
+
+
+async def get_workout(
+    db: AsyncSession, workout_id: int, options: tuple = WORKOUT_RESPONSE_OPTIONS
+):
+    try:
+        result = await db.execute(
+            select(models.Workout)
+            .options(*options)
+            .where(models.Workout.workout_id == workout_id)
+            .execution_options(populate_existing=True)
+        )
+        return result.scalars().first()
+    except Exception as e:
+        logger.error(f"Error fetching workout with id {workout_id}: {e}")
+        raise e
+
+
+async def get_workout_version(db: AsyncSession, workout_id: int) -> int | None:
+    return await db.run_sync(db_functions.get_workout_version, workout_id)
+
+
+async def update_workout(
+    db: AsyncSession, workout_id: int, workout: schemas.WorkoutUpdate, versions: list[int] | None = None
+):
+    db_workout = await get_workout(db, workout_id)
+    try:
+        await db.run_sync(claim_version, models.Workout, workout_id, versions)
+        # the previous owner loses the workout, the new one is found by mark_changed
+        # and record_workout_changes once the new user_id is flushed
+        previous_user_id = db_workout.user_id
+        moved = workout.user_id is not None and workout.user_id != db_workout.user_id
+        if moved:
+            await db.run_sync(
+                drop_adherence_calendars, [db_workout.user_id, workout.user_id]
+            )
+            await db.run_sync(record_workout_changes, [workout_id], deleted=True)
+        for key, value in workout.model_dump().items():
+            if value is not None:
+                setattr(db_workout, key, value)
+        # sessions do not autoflush, the owner lookups below have to see the new user_id
+        await db.flush()
+        if moved:
+            await db.run_sync(record_workout_changes, [workout_id])
+        else:
+            await db.run_sync(record_changes, schemas.ChangeKind.WORKOUT, [workout_id])
+        await db.run_sync(mark_changed, workout_ids=[workout_id], user_ids=[previous_user_id])
+        await db.commit()
+        logger.debug(f"Updated workout {workout_id}")
+    except VersionConflict:
+        await db.rollback()
+        raise
+    except Exception as e:
+        logger.error(f"Error updating workout {workout_id}: {e}")
+        await db.rollback()
+        raise e
+    return db_workout
+
+
+async def delete_workout(db: AsyncSession, workout_id: int):
+    db_workout = await get_workout(db, workout_id)
+    try:
+        await db.run_sync(drop_adherence_calendars, [db_workout.user_id])
+        # its exercises lose their workout_id
+        exercise_ids = [exercise.exercise_id for exercise in db_workout.exercises]
+        await db.run_sync(mark_changed, exercise_ids, [workout_id])
+        await db.run_sync(record_workout_changes, [workout_id], deleted=True)
+        await db.delete(db_workout)
+        await db.flush()
+        # the exercises stay with their authors
+        await db.run_sync(record_changes, schemas.ChangeKind.EXERCISE, exercise_ids)
+        await db.commit()
+        logger.debug(f"Deleted workout {workout_id}")
+    except Exception as e:
+        logger.error(f"Error deleting workout {workout_id}: {e}")
+        await db.rollback()
+        raise e
+    return db_workout
+
+
+async def get_workout_owner(db: AsyncSession, workout_id: int) -> int:
+    return (await db.get(models.Workout, workout_id)).user_id
+
+
+async def get_adherence_stats(db: AsyncSession, user_id: int, today: date | None = None) -> dict:
+    return await db.run_sync(db_functions.get_adherence_stats, user_id, today)
+
+
+async def get_volume_stats(
+    db: AsyncSession,
+    user_id: int,
+    period: schemas.VolumePeriod = schemas.VolumePeriod.WEEK,
+    since: date | None = None,
+    until: date | None = None,
+    completed_only: bool = True,
+) -> dict:
+    exercises, dates = volume_statements(user_id, since, until, completed_only)
+    exercise_rows = (await db.execute(exercises)).all()
+    date_rows = (await db.execute(dates)).all()
+    return volume_stats(exercise_rows, date_rows, period)
+
+
+async def create_workout_date(
+    db: AsyncSession, workout_date: schemas.WorkoutDateCreate
+):
+    db_date = models.WorkoutDate(
+        workout_id=workout_date.workout_id,
+        date=workout_date.date,
+        completed=workout_date.completed,
+    )
+    try:
+        db.add(db_date)
+        await db.flush()
+        user_id = await get_workout_owner(db, db_date.workout_id)
+        await db.run_sync(refresh_adherence_days, user_id, [db_date.date])
+        await db.run_sync(record_new_changes, schemas.ChangeKind.WORKOUT_DATE, [db_date.id])
+        await db.run_sync(mark_changed, workout_ids=[db_date.workout_id])
+        await db.commit()
+        logger.debug(f"Created workout date {db_date.id}")
+    except Exception as e:
+        logger.error(f"Error creating workout date: {e}")
+        await db.rollback()
+        raise e
+    return db_date
+
+
+async def update_workout_date(
+    db: AsyncSession, workout_date_id: int, workout_date: schemas.WorkoutDateUpdate
+):
+    db_date = await db.get(models.WorkoutDate, workout_date_id)
+    try:
+        old_day = db_date.date
+        for key, value in workout_date.model_dump().items():
+            setattr(db_date, key, value)
+        user_id = await get_workout_owner(db, db_date.workout_id)
+        await db.run_sync(refresh_adherence_days, user_id, [old_day, db_date.date])
+        await db.run_sync(record_changes, schemas.ChangeKind.WORKOUT_DATE, [workout_date_id])
+        await db.run_sync(mark_changed, workout_ids=[db_date.workout_id])
+        await db.commit()
+        logger.debug(f"Updated workout date {workout_date_id}")
+    except Exception as e:
+        logger.error(f"Error updating workout date {workout_date_id}: {e}")
+        await db.rollback()
+        raise e
+    return db_date
+
+
+async def delete_workout_date(db: AsyncSession, workout_date_id: int):
+    db_date = await db.get(models.WorkoutDate, workout_date_id)
+    try:
+        user_id = await get_workout_owner(db, db_date.workout_id)
+        await db.run_sync(record_changes, schemas.ChangeKind.WORKOUT_DATE, [workout_date_id], deleted=True)
+        await db.delete(db_date)
+        await db.run_sync(refresh_adherence_days, user_id, [db_date.date])
+        await db.run_sync(mark_changed, workout_ids=[db_date.workout_id])
+        await db.commit()
+        logger.debug(f"Deleted workout date {workout_date_id}")
+    except Exception as e:
+        logger.error(f"Error deleting workout date {workout_date_id}: {e}")
+        await db.rollback()
+        raise e
+    return db_date
+
+
+async def create_exercise(
+    db: AsyncSession, exercise: schemas.ExerciseCreate
+) -> models.Exercise:
+    exercise_data = exercise.model_dump()
+    tag_names = exercise_data.pop("tags", [])
+
+    for attempt in range(2):
+        try:
+            tag_ids = await db.run_sync(resolve_tags, tag_names)
+            new_exercise = models.Exercise(**exercise_data)
+            db.add(new_exercise)
+            await db.flush()
+            exercise_id = new_exercise.exercise_id
+            await db.run_sync(set_exercise_tags, exercise_id, tag_ids.values())
+            await db.run_sync(record_personal_bests, [new_exercise])
+            await db.run_sync(
+                index_new_exercises,
+                [search_document(exercise_id, new_exercise.name, new_exercise.description, tag_names)],
+            )
+            await db.run_sync(record_new_changes, schemas.ChangeKind.EXERCISE, [exercise_id])
+            await db.run_sync(mark_changed, workout_ids=[new_exercise.workout_id])
+            await db.commit()
+            break
+        except IntegrityError as e:
+            await db.rollback()
+            # a cached tag id may be stale if the tag was deleted by another worker
+            tag_cache.clear()
+            if attempt:
+                logger.error(f"Error creating exercise: {e}")
+                raise e
+        except Exception as e:
+            logger.error(f"Error creating exercise: {e}")
+            await db.rollback()
+            raise e
+
+    tag_index.set_exercise_tags(exercise_id, tag_ids.values())
+    if tag_ids:
+        similarity_refresher.mark_dirty([exercise_id])
+    logger.debug(f"Created exercise {exercise_id}")
+    return await get_exercise(db, exercise_id)
+
+
+async def get_exercise(
+    db: AsyncSession, exercise_id: int, options: tuple = EXERCISE_RESPONSE_OPTIONS
+):
+    try:
+        result = await db.execute(
+            select(models.Exercise)
+            .options(*options)
+            .where(models.Exercise.exercise_id == exercise_id)
+            .execution_options(populate_existing=True)
+        )
+        return result.scalars().first()
+    except Exception as e:
+        logger.error(f"Error fetching exercise with id {exercise_id}: {e}")
+        raise e
+
+
+async def search_exercises(
+    db: AsyncSession,
+    query: str,
+    tags: list[str] | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+) -> dict:
+    if not search_terms(query):
+        return {"items": [], "next_cursor": None}
+    limit = clamp_page_size(limit)
+    statement = search_exercises_statement(
+        db.bind.dialect.name, query, tags or [], cursor, limit
+    )
+    result = await db.execute(statement.execution_options(populate_existing=True))
+    return keyset_search_page(result.all(), limit)
+
+
+async def get_exercises_by_tags(
+    db: AsyncSession,
+    tags: list[str] = (),
+    any_tags: list[str] = (),
+    exclude_tags: list[str] = (),
+    cursor: str | None = None,
+    limit: int | None = None,
+) -> dict:
+    return await db.run_sync(
+        db_functions.get_exercises_by_tags, tags, any_tags, exclude_tags, cursor, limit
+    )
+
+
+async def get_similar_exercises(db: AsyncSession, exercise_id: int, limit: int) -> list[dict]:
+    return await db.run_sync(db_functions.get_similar_exercises, exercise_id, limit)
+
+
+async def get_top_rated_exercises(
+    db: AsyncSession, tag: str | None = None, min_ratings: int = 1, limit: int | None = None
+):
+    statement = top_rated_exercises_statement(tag, min_ratings, clamp_page_size(limit))
+    result = await db.execute(statement.execution_options(populate_existing=True))
+    return result.scalars().all()
+
+
+async def update_exercise(
+    db: AsyncSession, exercise_id: int, exercise: schemas.ExerciseUpdate
+):
+    db_exercise = await get_exercise(db, exercise_id)
+    try:
+        await db.run_sync(
+            retire_personal_record, exercise_id, personal_record_key(db_exercise)
+        )
+        old_workout_id = db_exercise.workout_id
+        # it may move to another author or workout owner
+        await db.run_sync(record_changes, schemas.ChangeKind.EXERCISE, [exercise_id], deleted=True)
+        for key, value in exercise.model_dump(exclude={"tags"}).items():
+            setattr(db_exercise, key, value)
+        if exercise.tags is not None:
+            tag_ids = await db.run_sync(resolve_tags, exercise.tags)
+            await db.run_sync(
+                set_exercise_tags, exercise_id, tag_ids.values(), replace=True
+            )
+        await db.flush()
+        await db.run_sync(record_personal_bests, [db_exercise])
+        await db.run_sync(index_exercises, [exercise_id])
+        await db.run_sync(record_changes, schemas.ChangeKind.EXERCISE, [exercise_id])
+        await db.run_sync(mark_changed, [exercise_id], [old_workout_id, db_exercise.workout_id])
+        await db.commit()
+        logger.debug(f"Updated exercise {exercise_id}")
+    except IntegrityError as e:
+        logger.error(f"Error updating exercise {exercise_id}: {e}")
+        await db.rollback()
+        # a cached tag id may be stale if the tag was deleted by another worker
+        tag_cache.clear()
+        raise e
+    except Exception as e:
+        logger.error(f"Error updating exercise {exercise_id}: {e}")
+        await db.rollback()
+        raise e
+    if exercise.tags is not None:
+        tag_index.set_exercise_tags(exercise_id, tag_ids.values())
+        similarity_refresher.mark_dirty([exercise_id])
+    return await get_exercise(db, exercise_id)
+
+
+async def delete_exercise(db: AsyncSession, exercise_id: int):
+    db_exercise = await get_exercise(db, exercise_id)
+    try:
+        await db.run_sync(
+            retire_personal_record, exercise_id, personal_record_key(db_exercise)
+        )
+        await db.execute(delete_similarity(exercise_id))
+        await db.run_sync(mark_changed, [exercise_id], [db_exercise.workout_id])
+        await db.run_sync(record_changes, schemas.ChangeKind.EXERCISE, [exercise_id], deleted=True)
+        await db.delete(db_exercise)
+        await db.run_sync(index_exercises, [exercise_id])
+        await db.commit()
+        logger.debug(f"Deleted exercise {exercise_id}")
+    except Exception as e:
+        logger.error(f"Error deleting exercise {exercise_id}: {e}")
+        await db.rollback()
+        raise e
+    tag_index.remove_exercise(exercise_id)
+    return db_exercise
+
+
+async def get_personal_records(db: AsyncSession, user_id: int) -> list[dict]:
+    return await db.run_sync(db_functions.get_personal_records, user_id)
+
+
+async def create_rating(db: AsyncSession, rating: schemas.RatingCreate):
+    db_rating = models.Rating(**rating.model_dump())
+    try:
+        db.add(db_rating)
+        for statement in rating_aggregate_updates(None, rating):
+            await db.execute(statement)
+        await db.run_sync(mark_exercises_changed, [rating.exercise_id])
+        await db.flush()
+        await db.run_sync(record_new_changes, schemas.ChangeKind.RATING, [db_rating.rating_id])
+        await db.commit()
+        logger.debug(f"Created rating {db_rating.rating_id}")
+    except Exception as e:
+        logger.error(f"Error creating rating: {e}")
+        await db.rollback()
+        raise e
+    return db_rating
+
+
+async def get_rating(db: AsyncSession, rating_id: int):
+    try:
+        return await db.get(models.Rating, rating_id)
+    except Exception as e:
+        logger.error(f"Error fetching rating with id {rating_id}: {e}")
+        raise e
+
+
+async def update_rating(db: AsyncSession, rating_id: int, rating: schemas.RatingCreate):
+    db_rating = await get_rating(db, rating_id)
+    try:
+        for statement in rating_aggregate_updates(db_rating, rating):
+            await db.execute(statement)
+        await db.run_sync(mark_exercises_changed, [db_rating.exercise_id, rating.exercise_id])
+        # it may move to another user
+        await db.run_sync(record_changes, schemas.ChangeKind.RATING, [rating_id], deleted=True)
+        for key, value in rating.model_dump().items():
+            setattr(db_rating, key, value)
+        # flushed so the owner lookup sees the new user_id
+        await db.flush()
+        await db.run_sync(record_changes, schemas.ChangeKind.RATING, [rating_id])
+        await db.commit()
+        logger.debug(f"Updated rating {rating_id}")
+    except Exception as e:
+        logger.error(f"Error updating rating {rating_id}: {e}")
+        await db.rollback()
+        raise e
+    return db_rating
+
+
+async def delete_rating(db: AsyncSession, rating_id: int):
+    db_rating = await get_rating(db, rating_id)
+    try:
+        for statement in rating_aggregate_updates(db_rating, None):
+            await db.execute(statement)
+        await db.run_sync(mark_exercises_changed, [db_rating.exercise_id])
+        await db.run_sync(record_changes, schemas.ChangeKind.RATING, [rating_id], deleted=True)
+        await db.delete(db_rating)
+        await db.commit()
+        logger.debug(f"Deleted rating {rating_id}")
+    except Exception as e:
+        logger.error(f"Error deleting rating {rating_id}: {e}")
+        await db.rollback()
+        raise e
+    return db_rating
+
+
+async def create_tag(db: AsyncSession, tag: schemas.TagCreate):
+    new_tag = models.Tag(**tag.model_dump())
+    db.add(new_tag)
+    await db.run_sync(mark_changed, lists=("tags",))
+    await db.commit()
+    return new_tag
+
+
+async def get_tag(db: AsyncSession, tag_id: int):
+    return await db.get(models.Tag, tag_id)
+
+
+async def get_tags(db: AsyncSession, cursor: str | None = None, limit: int | None = None):
+    return await paginate(db, select(models.Tag), models.Tag.tag_id, cursor, limit)
+
+
+async def update_tag(db: AsyncSession, tag_id: int, tag: schemas.TagUpdate):
+    existing_tag = await get_tag(db, tag_id)
+    if not existing_tag:
+        return None
+    old_name = existing_tag.name
+    for key, value in tag.model_dump().items():
+        if value is not None:
+            setattr(existing_tag, key, value)
+    await db.run_sync(mark_changed, tag_ids=[tag_id], lists=("tags",))
+    if existing_tag.name != old_name:
+        exercise_ids = await db.run_sync(tagged_exercise_ids, tag_id)
+        await db.run_sync(index_exercises, exercise_ids)
+        # exercises embed the names of their tags
+        await db.run_sync(mark_exercises_changed, exercise_ids)
+    await db.commit()
+    tag_cache.invalidate(old_name)
+    return existing_tag
+
+
+async def delete_tag(db: AsyncSession, tag_id: int):
+    tag = await get_tag(db, tag_id)
+    if not tag:
+        return None
+    exercise_ids = await db.run_sync(tagged_exercise_ids, tag_id)
+    await db.run_sync(mark_exercises_changed, exercise_ids)
+    await db.run_sync(mark_changed, tag_ids=[tag_id], lists=("tags",))
+    await db.delete(tag)
+    await db.run_sync(index_exercises, exercise_ids)
+    await db.commit()
+    tag_index.remove_tag(tag_id)
+    similarity_refresher.mark_dirty(exercise_ids)
+    tag_cache.invalidate(tag.name)
+    return tag
+
+
+async def create_lang(db: AsyncSession, lang: schemas.LangCreate):
+    new_lang = models.Lang()
+    set_lang_locales(new_lang, lang.locales())
+    db.add(new_lang)
+    await db.commit()
+    lang_catalog.invalidate()
+    return new_lang
+
+
+async def get_lang(db: AsyncSession, lang_id: int):
+    return await db.get(models.Lang, lang_id)
+
+
+async def update_lang(db: AsyncSession, lang_id: int, lang: schemas.LangUpdate):
+    existing_lang = await get_lang(db, lang_id)
+    if not existing_lang:
+        return None
+    set_lang_locales(existing_lang, lang.locales())
+    await db.commit()
+    lang_catalog.invalidate()
+    return existing_lang
+
+
+async def delete_lang(db: AsyncSession, lang_id: int):
+    lang = await get_lang(db, lang_id)
+    if not lang:
+        return None
+    await db.delete(lang)
+    await db.commit()
+    lang_catalog.invalidate()
+    return lang
+
+
+async def get_lang_catalog(db: AsyncSession) -> CatalogSnapshot:
+    return await db.run_sync(db_functions.get_lang_catalog)
+
+
+async def get_changes(
+    db: AsyncSession, user_id: int, since: str | None = None, limit: int | None = None
+) -> dict:
+    return await db.run_sync(db_functions.get_changes, user_id, since, limit)
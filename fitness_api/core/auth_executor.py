@@ -0,0 +1,90 @@
+"""
+bounded thread pool for the blocking parts of authentication
+
+bcrypt hashing/verification and the user lookups that go with them are CPU and IO
+bound work that must not run on the event loop. They are funnelled through a small
+dedicated pool so a login burst queues here instead of stalling other requests,
+and the queue is capped so a burst is rejected instead of growing without bound.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fitness_api.settings import SETTINGS
+
+from .logging import logger
+
+
+class AuthExecutorSaturated(Exception):
+    pass
+
+
+class BoundedExecutor:
+    def __init__(self, max_workers: int, max_queue: int, name: str):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.peak_queue_depth = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _call(self, fn, *args, **kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                logger.warning(f"Auth executor queue full ({self.queued} waiting)")
+                raise AuthExecutorSaturated("Too many authentication requests")
+            self.queued += 1
+            self.peak_queue_depth = max(self.peak_queue_depth, self.queued)
+        future = self._executor.submit(functools.partial(self._call, fn, *args, **kwargs))
+        future.add_done_callback(self._dequeue_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _dequeue_cancelled(self, future):
+        # a request dropped while waiting cancels its task before _call ever runs
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queued": self.queued,
+                "running": self.running,
+                "peak_queue_depth": self.peak_queue_depth,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+auth_executor = BoundedExecutor(
+    max_workers=SETTINGS.auth_executor_workers,
+    max_queue=SETTINGS.auth_executor_max_queue,
+    name="auth",
+)
+
+
+async def run_auth_task(fn, *args, **kwargs):
+    return await auth_executor.run(fn, *args, **kwargs)
@@ -1,13 +1,130 @@
+import os
+
 import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_asyncio
 import sqlalchemy.ext.declarative as declarative
 import sqlalchemy.orm as orm
 
 from ..settings import SETTINGS
+from .pool_metrics import (
+    InstrumentedAsyncAdaptedQueuePool,
+    InstrumentedQueuePool,
+    instrument_engine,
+)
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def get_async_database_url(url: str) -> str:
+    """
+    maps a sync connection string onto the asyncio driver for the same database
+    """
+    db_url = sa.engine.make_url(url)
+    driver = ASYNC_DRIVERS.get(db_url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No asyncio driver known for {db_url.drivername}")
+    return db_url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def get_engine_options(url: str, poolclass: type[sa.pool.Pool]) -> dict:
+    """
+    pool configuration from the settings; in-memory sqlite keeps its own
+    single-connection pool because a queue of separate connections would each
+    see a different empty database
+    """
+    db_url = sa.engine.make_url(url)
+    if db_url.get_backend_name() == "sqlite" and db_url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": SETTINGS.db_pool_size,
+        "max_overflow": SETTINGS.db_max_overflow,
+        "pool_timeout": SETTINGS.db_pool_timeout,
+        "pool_recycle": SETTINGS.db_pool_recycle,
+        "pool_pre_ping": SETTINGS.db_pool_pre_ping,
+    }
+
 
 SQLALCHEMY_DATABASE_URL = SETTINGS.db_connection_string
+SQLALCHEMY_ASYNC_DATABASE_URL = (
+    SETTINGS.db_async_connection_string
+    or get_async_database_url(SQLALCHEMY_DATABASE_URL)
+)
+
+SessionLocal = orm.sessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = None
+
+engine = None
+async_engine = None
+pool_metrics = {}
+
 
-engine = sa.create_engine(SQLALCHEMY_DATABASE_URL)
+def init_engines():
+    """
+    builds the engines (and their pools) for the current process and binds the
+    session factories to them. Called at import time and again in every forked
+    worker, so no process ever checks out a connection opened by its parent.
+    """
+    global engine, async_engine, AsyncSessionLocal
 
-SessionLocal = orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine = sa.create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        **get_engine_options(SQLALCHEMY_DATABASE_URL, InstrumentedQueuePool),
+    )
+    pool_metrics["sync"] = instrument_engine(engine)
+    SessionLocal.configure(bind=engine)
+
+    # The async engine is only built when async mode is switched on, so the asyncio
+    # driver does not have to be installed for the default sync deployment.
+    if SETTINGS.db_async:
+        async_engine = sa_asyncio.create_async_engine(
+            SQLALCHEMY_ASYNC_DATABASE_URL,
+            **get_engine_options(
+                SQLALCHEMY_ASYNC_DATABASE_URL, InstrumentedAsyncAdaptedQueuePool
+            ),
+        )
+        pool_metrics["async"] = instrument_engine(async_engine.sync_engine)
+        AsyncSessionLocal = sa_asyncio.async_sessionmaker(
+            bind=async_engine, autoflush=False, expire_on_commit=False
+        )
+
+
+def reinit_engines_after_fork():
+    """
+    drops the pools inherited over fork without closing them (the connections
+    still belong to the parent) and gives this process fresh engines
+    """
+    if engine is not None:
+        engine.dispose(close=False)
+    if async_engine is not None:
+        async_engine.sync_engine.dispose(close=False)
+    init_engines()
+
+
+init_engines()
+os.register_at_fork(after_in_child=reinit_engines_after_fork)
 
 Base = declarative.declarative_base()
+
+
+def get_pool_stats() -> dict:
+    engines = {"sync": engine}
+    if async_engine is not None:
+        engines["async"] = async_engine.sync_engine
+    return {
+        name: pool_metrics[name].snapshot(db_engine.pool)
+        for name, db_engine in engines.items()
+    }
+
+
+async def dispose_engines():
+    """
+    closes the pooled connections; asyncio drivers such as aiosqlite keep a
+    thread per open connection that would otherwise block interpreter exit
+    """
+    if async_engine is not None:
+        await async_engine.dispose()
+    engine.dispose()
@@ -1,6 +1,15 @@
-from datetime import datetime, timedelta
-
-from sqlalchemy.orm import Session, joinedload
+import base64
+import json
+import math
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from itertools import islice
+from types import SimpleNamespace
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.orm import Session, aliased, selectinload
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
 from jose import jwt
 from passlib.context import CryptContext
@@ -8,13 +17,177 @@ from passlib.context import CryptContext
 from fitness_api.settings import SETTINGS
 
 from . import database, models, schemas
+from .adherence import AdherenceCalendar
+from .volume import aggregate_volume, workout_totals
+from .friend_graph import friend_graph
+from .lang_catalog import CatalogSnapshot, lang_catalog
+from .search import (
+    insert_documents,
+    search_document,
+    search_index,
+    search_terms,
+    write_documents,
+)
 from .logging import logger
+from .response_cache import entity_keys, forget_on_commit
+from .tag_cache import put_on_commit, put_read, tag_cache
+from .tag_index import tag_index
+from .similarity import similarity_refresher, unpack
+from .token_cache import token_cache
 
 import random
 import string
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Relationship paths the read routes accept in ?expand=. Expanding all of them
+# gives the full response tree the routes have always returned.
+USER_EXPANSIONS = (
+    "workouts",
+    "workouts.exercises",
+    "workouts.exercises.tags",
+    "workouts.dates",
+)
+WORKOUT_EXPANSIONS = ("exercises", "exercises.tags", "dates")
+EXERCISE_EXPANSIONS = ("tags",)
+
+
+def parse_expand(expand: str | None, allowed: tuple[str, ...]) -> dict:
+    """
+    turns "workouts.dates,workouts.exercises" into a nested dict of relationship
+    names; None expands every allowed path, "" or "none" expands nothing
+    """
+    if expand is None:
+        paths = allowed
+    else:
+        paths = [path.strip() for path in expand.split(",")]
+        paths = [path for path in paths if path and path != "none"]
+    tree = {}
+    for path in paths:
+        if path not in allowed:
+            raise ValueError(
+                f"Cannot expand '{path}', expected any of: {', '.join(allowed)}"
+            )
+        node = tree
+        for name in path.split("."):
+            node = node.setdefault(name, {})
+    return tree
+
+
+def expand_options(model, tree: dict) -> tuple:
+    """
+    loader options for an expand tree. Every expanded relationship is loaded with
+    one SELECT ... IN per level, so serializing the response costs a fixed number
+    of queries no matter how many rows hang off it.
+    """
+    options = []
+    for name, subtree in tree.items():
+        attribute = getattr(model, name)
+        loader = selectinload(attribute)
+        if subtree:
+            target = attribute.property.mapper.class_
+            loader = loader.options(*expand_options(target, subtree))
+        options.append(loader)
+    return tuple(options)
+
+
+def to_expanded_dict(obj, tree: dict) -> dict:
+    """
+    column values of obj plus only the relationships named in the expand tree, so
+    unexpanded relationships are neither lazy loaded nor serialized
+    """
+    data = {
+        attribute.key: getattr(obj, attribute.key)
+        for attribute in sa.inspect(obj).mapper.column_attrs
+    }
+    for name, subtree in tree.items():
+        value = getattr(obj, name)
+        if isinstance(value, list):
+            data[name] = [to_expanded_dict(item, subtree) for item in value]
+        elif value is not None:
+            data[name] = to_expanded_dict(value, subtree)
+        else:
+            data[name] = None
+    return data
+
+
+EXERCISE_RESPONSE_OPTIONS = expand_options(
+    models.Exercise, parse_expand(None, EXERCISE_EXPANSIONS)
+)
+WORKOUT_RESPONSE_OPTIONS = expand_options(
+    models.Workout, parse_expand(None, WORKOUT_EXPANSIONS)
+)
+USER_RESPONSE_OPTIONS = expand_options(
+    models.User, parse_expand(None, USER_EXPANSIONS)
+)
+
+
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, (int, str)):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def keyset_page_statement(statement, key_column, cursor: str | None, limit: int):
+    """
+    restricts a select to the page after the cursor. Rows are ordered by a unique
+    key and the page starts with a range condition on it, so every page is an
+    index range scan no matter how deep into the table it is.
+    """
+    if cursor is not None:
+        statement = statement.where(key_column > decode_cursor(cursor))
+    # one extra row tells whether there is a next page
+    return statement.order_by(key_column).limit(limit + 1)
+
+
+def keyset_page(rows: list, key_column, limit: int) -> dict:
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], key_column.key))
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+def clamp_page_size(limit: int | None) -> int:
+    if limit is None:
+        return SETTINGS.default_page_size
+    return max(1, min(limit, SETTINGS.max_page_size))
+
+
+def paginate(
+    db: Session, statement, key_column, cursor: str | None, limit: int | None
+) -> dict:
+    limit = clamp_page_size(limit)
+    statement = keyset_page_statement(statement, key_column, cursor, limit)
+    return keyset_page(db.execute(statement).scalars().all(), key_column, limit)
+
+
+def get_many(db: Session, model, ids: list[int], expand: dict) -> dict:
+    """
+    the rows of ``ids`` as expanded dicts, in the order asked, from one IN query
+    plus one per expanded relationship level, and the ids that have no row
+    """
+    key = sa.inspect(model).primary_key[0]
+    rows = {
+        getattr(row, key.key): row
+        for row in db.scalars(
+            sa.select(model).options(*expand_options(model, expand)).where(key.in_(ids))
+        )
+    }
+    return {
+        "items": [to_expanded_dict(rows[i], expand) for i in ids if i in rows],
+        "missing": [i for i in ids if i not in rows],
+    }
+
 
 def drop_database():
     try:
@@ -49,12 +222,27 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
-def get_user(db: Session, user_email: str | None = None, user_id: int | None = None):
+def get_user(
+    db: Session,
+    user_email: str | None = None,
+    user_id: int | None = None,
+    options: tuple = USER_RESPONSE_OPTIONS,
+):
     try:
         if user_email:
-            return db.query(models.User).filter(models.User.email == user_email).first()
+            return (
+                db.query(models.User)
+                .options(*options)
+                .filter(models.User.email == user_email)
+                .first()
+            )
         elif user_id:
-            return db.query(models.User).filter(models.User.user_id == user_id).first()
+            return (
+                db.query(models.User)
+                .options(*options)
+                .filter(models.User.user_id == user_id)
+                .first()
+            )
         else:
             raise Exception("Must provide either user_email or user_id")
     except Exception as e:
@@ -62,8 +250,12 @@ def get_user(db: Session, user_email: str | None = None, user_id: int | None = N
         raise e
 
 
+def get_user_version(db: Session, user_id: int) -> int | None:
+    return db.scalar(sa.select(models.User.version).where(models.User.user_id == user_id))
+
+
 def authenticate_user(db: Session, user_email: str, password: str):
-    user = get_user(db, user_email=user_email)
+    user = get_user(db, user_email=user_email, options=())
     if not user:
         logger.debug(f"User {user_email} attempted to log in but does not exist")
         return False
@@ -107,7 +299,11 @@ def generate_friend_code(db: Session):
     return friend_code
 
 
-def create_user(db: Session, user_data: schemas.UserCreate):
+def create_user(
+    db: Session, user_data: schemas.UserCreate, password_hash: str | None = None
+):
+    if password_hash is None:
+        password_hash = get_password_hash(user_data.password)
     db_user = models.User(
         name=user_data.name,
         email=user_data.email,
@@ -116,7 +312,7 @@ def create_user(db: Session, user_data: schemas.UserCreate):
         birth_date=user_data.birth_date,
         gender=user_data.gender,
         friend_code=generate_friend_code(db),
-        password_hash=get_password_hash(user_data.password),
+        password_hash=password_hash,
         account_type="USER",
     )
 
@@ -134,15 +330,23 @@ def create_user(db: Session, user_data: schemas.UserCreate):
     return db_user
 
 
-def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
+def update_user(
+    db: Session, user_id: int, user: schemas.UserUpdate, versions: list[int] | None = None
+):
     db_user = get_user(db, user_id=user_id)
     try:
+        claim_version(db, models.User, user_id, versions)
         for key, value in user.model_dump().items():
             if value is not None:
                 setattr(db_user, key, value)
+        mark_changed(db, user_ids=[user_id])
         db.commit()
+        token_cache.invalidate_user(user_id)
         db.refresh(db_user)
         logger.debug(f"Updated user {user_id}")
+    except VersionConflict:
+        db.rollback()
+        raise
     except Exception as e:
         logger.error(f"Error updating user {user_id}: {e}")
         db.rollback()
@@ -155,6 +359,7 @@ def delete_user(db: Session, user_id: int):
     try:
         db.delete(db_user)
         db.commit()
+        token_cache.invalidate_user(user_id)
         logger.debug(f"Deleted user {user_id}")
     except Exception as e:
         logger.error(f"Error deleting user {user_id}: {e}")
@@ -177,6 +382,7 @@ def create_friendship_status(
 ) -> models.FriendshipStatus:
     db_status = models.FriendshipStatus(name=status.name)
     db.add(db_status)
+    mark_changed(db, lists=("statuses",))
     db.commit()
     db.refresh(db_status)
     return db_status
@@ -193,6 +399,7 @@ def update_friendship_status(
     if not db_status:
         return None  # Or raise an appropriate exception
     db_status.name = new_status.name
+    mark_changed(db, lists=("statuses",))
     db.commit()
     db.refresh(db_status)
     return db_status
@@ -206,8 +413,16 @@ def get_friendship_status(db: Session, status_id: int):
     )
 
 
-def get_all_friendship_statuses(db: Session):
-    return db.query(models.FriendshipStatus).all()
+def get_all_friendship_statuses(
+    db: Session, cursor: str | None = None, limit: int | None = None
+):
+    return paginate(
+        db,
+        sa.select(models.FriendshipStatus),
+        models.FriendshipStatus.status_id,
+        cursor,
+        limit,
+    )
 
 
 def delete_friendship_status(db: Session, status_id: int):
@@ -217,9 +432,65 @@ def delete_friendship_status(db: Session, status_id: int):
         .first()
     )
     db.delete(status)
+    mark_changed(db, lists=("statuses",))
     db.commit()
 
 
+def friendship_edges(user_id: int, friend_id: int) -> list[models.FriendshipEdge]:
+    return [
+        models.FriendshipEdge(user_id=a, friend_id=b)
+        for a, b in {(user_id, friend_id), (friend_id, user_id)}
+    ]
+
+
+@sa.event.listens_for(database.Base.metadata, "after_create")
+def add_missing_columns(target, connection, **kw):
+    """
+    create_all only creates missing tables, so columns and indexes added to tables
+    that already exist are added here, and the rating aggregates of exercises rated
+    before they existed are filled in. Idempotent, like the other create_all hooks.
+    """
+    inspector = sa.inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table in target.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                # existing rows take the column's server default
+                ddl = sa.schema.CreateColumn(column).compile(dialect=connection.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}")
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+
+    exercise, rating = models.Exercise, models.Rating
+    rated = rating.exercise_id == exercise.exercise_id
+    count = sa.select(sa.func.count(rating.rating_id)).where(rated).scalar_subquery()
+    total = sa.select(sa.func.sum(rating.rating)).where(rated).scalar_subquery()
+    connection.execute(
+        sa.update(exercise)
+        .where(exercise.rating_count == 0, sa.exists().where(rated))
+        .values(rating_count=count, rating_sum=total, rating_mean=total / count)
+    )
+
+
+@sa.event.listens_for(database.Base.metadata, "after_create")
+def backfill_friendship_edges(target, connection, **kw):
+    # friendships made before friendship_edge existed get their edges on the next create_all
+    friendship = models.Friendship
+    missing = ~sa.exists().where(models.FriendshipEdge.friendship_id == friendship.friendship_id)
+    connection.execute(
+        insert_ignoring_conflicts(connection, models.FriendshipEdge, ["user_id", "friend_id"]).from_select(
+            ["user_id", "friend_id", "friendship_id"],
+            sa.union(
+                sa.select(friendship.user_id, friendship.friend_id, friendship.friendship_id).where(missing),
+                sa.select(friendship.friend_id, friendship.user_id, friendship.friendship_id).where(missing),
+            ),
+        )
+    )
+
+
 def create_friendship(
     db: Session, friendship: schemas.FriendshipCreate
 ) -> models.Friendship:
@@ -227,11 +498,28 @@ def create_friendship(
         user_id=friendship.user_id,
         friend_id=friendship.friend_id,
         status_id=friendship.status_id,
+        edges=friendship_edges(friendship.user_id, friendship.friend_id),
+    )
+    try:
+        db.add(db_friendship)
+        db.flush()
+        record_new_changes(db, schemas.ChangeKind.FRIENDSHIP, [db_friendship.friendship_id])
+        db.commit()
+    except Exception as e:
+        logger.error(f"Error creating friendship: {e}")
+        db.rollback()
+        raise e
+    db.refresh(db_friendship)
+    update_friend_graph(db_friendship, db_friendship.status.name)
+    return db_friendship
+
+
+def update_friend_graph(db_friendship: models.Friendship, status_name: str):
+    friend_graph.set_friendship(
+        db_friendship.user_id,
+        db_friendship.friend_id,
+        status_name == schemas.StatusEnum.ACCEPTED,
     )
-    db.add(db_friendship)
-    db.commit()
-    db.refresh(friendship)
-    return friendship
 
 
 def get_friendship(db: Session, friendship_id: int):
@@ -242,24 +530,98 @@ def get_friendship(db: Session, friendship_id: int):
     )
 
 
-def get_all_friendships(db: Session):
-    return db.query(models.Friendship).all()
+def get_friendship_version(db: Session, friendship_id: int) -> int | None:
+    return db.scalar(
+        sa.select(models.Friendship.version).where(models.Friendship.friendship_id == friendship_id)
+    )
 
 
-def get_all_friendships_for_user(db: Session, user_id: int):
-    return (
-        db.query(models.Friendship)
-        .filter(
-            (models.Friendship.user_id == user_id)
-            | (models.Friendship.friend_id == user_id)
+def get_all_friendships(
+    db: Session, cursor: str | None = None, limit: int | None = None
+):
+    return paginate(
+        db,
+        sa.select(models.Friendship),
+        models.Friendship.friendship_id,
+        cursor,
+        limit,
+    )
+
+
+def get_all_friendships_for_user(
+    db: Session, user_id: int, cursor: str | None = None, limit: int | None = None
+):
+    return paginate(
+        db,
+        sa.select(models.Friendship)
+        .join(models.Friendship.edges)
+        .where(models.FriendshipEdge.user_id == user_id),
+        models.Friendship.friendship_id,
+        cursor,
+        limit,
+    )
+
+
+def get_friendship_page_versions(
+    db: Session, user_id: int, cursor: str | None = None, limit: int | None = None
+) -> list[tuple[int, int]]:
+    """the (friendship_id, version) of every row on a page of get_all_friendships_for_user"""
+    statement = keyset_page_statement(
+        sa.select(models.Friendship.friendship_id, models.Friendship.version)
+        .join(models.Friendship.edges)
+        .where(models.FriendshipEdge.user_id == user_id),
+        models.Friendship.friendship_id,
+        cursor,
+        clamp_page_size(limit),
+    )
+    return [tuple(row) for row in db.execute(statement)]
+
+
+def friends_statement(user_id: int, status: schemas.StatusEnum | None = None):
+    """
+    the friends of a user with their profile and the friendship status as one
+    joined select, keyed on friend_id for keyset pagination
+    """
+    friend = aliased(models.User, name="friend")
+    statement = (
+        sa.select(
+            models.FriendshipEdge.friend_id,
+            models.FriendshipEdge.friendship_id,
+            models.FriendshipStatus.name.label("status"),
+            friend,
         )
-        .all()
+        .join(friend, friend.user_id == models.FriendshipEdge.friend_id)
+        .join(models.FriendshipEdge.friendship)
+        .join(models.Friendship.status)
+        .where(models.FriendshipEdge.user_id == user_id)
     )
+    if status is not None:
+        statement = statement.where(models.FriendshipStatus.name == status.value)
+    return statement
+
+
+def get_friends(
+    db: Session,
+    user_id: int,
+    status: schemas.StatusEnum | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+):
+    limit = clamp_page_size(limit)
+    statement = keyset_page_statement(
+        friends_statement(user_id, status), models.FriendshipEdge.friend_id, cursor, limit
+    )
+    return keyset_page(db.execute(statement).all(), models.FriendshipEdge.friend_id, limit)
 
 
 def update_friendships_status(
-    db: Session, friendship_id: int, status_id: int
+    db: Session, friendship_id: int, status_id: int, versions: list[int] | None = None
 ) -> models.Friendship:
+    try:
+        claim_version(db, models.Friendship, friendship_id, versions)
+    except VersionConflict:
+        db.rollback()
+        raise
     db_friendship = (
         db.query(models.Friendship)
         .filter(models.Friendship.friendship_id == friendship_id)
@@ -270,8 +632,11 @@ def update_friendships_status(
         return None
 
     db_friendship.status_id = status_id
+    bump_versions(db, models.Friendship, [friendship_id])
+    record_changes(db, schemas.ChangeKind.FRIENDSHIP, [friendship_id])
     db.commit()
     db.refresh(db_friendship)
+    update_friend_graph(db_friendship, db_friendship.status.name)
     return db_friendship
 
 
@@ -281,26 +646,63 @@ def delete_friendship(db: Session, friendship_id: int):
         .filter(models.Friendship.friendship_id == friendship_id)
         .first()
     )
+    if not friendship:
+        return None
+    record_changes(db, schemas.ChangeKind.FRIENDSHIP, [friendship_id], deleted=True)
     db.delete(friendship)
     db.commit()
+    update_friend_graph(friendship, None)
+    return friendship
+
+
+def get_friend_suggestions(db: Session, user_id: int, limit: int) -> list[dict]:
+    friend_graph.ensure_loaded(db)
+    suggestions = friend_graph.suggestions(user_id, limit)
+    users = {
+        user.user_id: user
+        for user in db.scalars(
+            sa.select(models.User).where(
+                models.User.user_id.in_([suggested for suggested, _ in suggestions])
+            )
+        )
+    }
+    return [
+        {"user": users[suggested], "mutual_friends": mutual_friends}
+        for suggested, mutual_friends in suggestions
+        if suggested in users
+    ]
+
+
+def get_mutual_friend_count(db: Session, user_id: int, other_user_id: int) -> dict:
+    friend_graph.ensure_loaded(db)
+    return {
+        "user_id": user_id,
+        "other_user_id": other_user_id,
+        "count": len(friend_graph.mutual_friends(user_id, other_user_id)),
+    }
 
 
 def create_workout(db: Session, workout: schemas.WorkoutCreate):
     db_workout = models.Workout(user_id=workout.user_id, name=workout.name)
     try:
         db.add(db_workout)
-        db.commit()
-        db.refresh(db_workout)
-        logger.debug(f"Created workout {db_workout.workout_id}")
+        db.flush()
 
         if workout.dates:
-            for workout_date in workout.dates:
-                db_date = models.WorkoutDate(
+            db.add_all(
+                models.WorkoutDate(
                     workout_id=db_workout.workout_id, date=workout_date.date
                 )
-                db.add(db_date)
-            db.commit()
-            logger.debug(f"Added dates to workout {db_workout.workout_id}")
+                for workout_date in workout.dates
+            )
+            refresh_adherence_days(
+                db, workout.user_id, [workout_date.date for workout_date in workout.dates]
+            )
+        record_workout_changes(db, [db_workout.workout_id], new=True)
+        mark_changed(db, user_ids=[workout.user_id])
+        db.commit()
+        db.refresh(db_workout)
+        logger.debug(f"Created workout {db_workout.workout_id}")
     except Exception as e:
         logger.error(f"Error creating workout: {e}")
         db.rollback()
@@ -308,11 +710,523 @@ def create_workout(db: Session, workout: schemas.WorkoutCreate):
     return db_workout
 
 
-def get_workout(db: Session, workout_id: int):
+def insert_ignoring_conflicts(db: Session, model, index_elements: list[str]):
+    """
+    INSERT that skips rows clashing with a unique constraint instead of failing
+    (ON CONFLICT DO NOTHING on Postgres and SQLite); ``db`` may also be a Connection
+    """
+    dialect = (db.get_bind() if isinstance(db, Session) else db).dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing(
+            index_elements=index_elements
+        )
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing(
+            index_elements=index_elements
+        )
+    return sa.insert(model)
+
+
+def resolve_tags(db: Session, tag_names) -> dict[str, int]:
+    """
+    maps tag names to tag ids, creating the missing tags. Names not in the tag
+    cache cost one conflict-tolerant bulk insert and one lookup in total, so
+    concurrent writers creating the same tag do not fail each other.
+    """
+    tag_names = set(tag_names)
+    tag_ids = tag_cache.get_many(tag_names)
+    missing = tag_names - tag_ids.keys()
+    if missing:
+        db.execute(
+            insert_ignoring_conflicts(db, models.Tag, ["name"]),
+            [{"name": name} for name in sorted(missing)],
+        )
+        found = dict(
+            db.execute(
+                sa.select(models.Tag.name, models.Tag.tag_id).where(
+                    models.Tag.name.in_(missing)
+                )
+            ).all()
+        )
+        # the ids may belong to tags this transaction inserted
+        put_on_commit(db, found)
+        tag_ids.update(found)
+        mark_changed(db, lists=("tags",))
+    return tag_ids
+
+
+def index_exercises(db: Session, exercise_ids):
+    """
+    rewrites the search documents of exercises whose rows or tags were just
+    written (or deleted) in this transaction
+    """
+    db.flush()
+    write_documents(db, search_index(db.get_bind().dialect.name), list(set(exercise_ids)))
+
+
+def index_new_exercises(db: Session, documents: list[dict]):
+    # new exercises have no document to replace, so this is a single insert
+    insert_documents(db, search_index(db.get_bind().dialect.name), documents)
+
+
+def tagged_exercise_ids(db: Session, tag_id: int) -> list[int]:
+    return db.scalars(
+        sa.select(models.ExerciseTag.exercise_id).where(models.ExerciseTag.tag_id == tag_id)
+    ).all()
+
+
+def exercise_workout_ids(db: Session, exercise_ids) -> list[int]:
+    return db.scalars(
+        sa.select(models.Exercise.workout_id)
+        .where(models.Exercise.exercise_id.in_(list(set(exercise_ids))))
+        .where(models.Exercise.workout_id.is_not(None))
+        .distinct()
+    ).all()
+
+
+def bump_versions(db: Session, model, ids):
+    ids = list({i for i in ids if i is not None})
+    if ids:
+        key = sa.inspect(model).primary_key[0]
+        db.execute(
+            sa.update(model)
+            .where(key.in_(ids))
+            .values(version=model.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+class VersionConflict(Exception):
+    """the row is no longer at any version an If-Match named"""
+
+
+def claim_version(db: Session, model, entity_id: int, versions: list[int] | None):
+    """
+    raises VersionConflict unless the row is still at one of ``versions`` (None
+    skips the check). The check is itself an UPDATE, so the row stays locked
+    until the write commits: a concurrent writer holding the same version waits
+    for it and then finds the version moved on.
+    """
+    if versions is None:
+        return
+    key = sa.inspect(model).primary_key[0]
+    result = db.execute(
+        sa.update(model)
+        .where(key == entity_id, model.version.in_(versions))
+        .values(version=model.version)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        raise VersionConflict(f"{model.__tablename__} {entity_id} is not at version {versions}")
+
+
+def mark_changed(
+    db: Session, exercise_ids=(), workout_ids=(), tag_ids=(), user_ids=(), lists=()
+):
+    """
+    records what the write in progress changes: the version counters (ETags) of
+    the workouts and of the users owning them move now, the cached responses
+    are dropped when it commits. Workouts embed their exercises, so callers name
+    the workouts of the exercises they change too.
+    """
+    workout_ids = [i for i in workout_ids if i is not None]
+    bump_versions(db, models.Workout, workout_ids)
+    if workout_ids:
+        user_ids = set(user_ids).union(
+            db.scalars(
+                sa.select(models.Workout.user_id).where(models.Workout.workout_id.in_(set(workout_ids)))
+            )
+        )
+    bump_versions(db, models.User, user_ids)
+    forget_on_commit(
+        db,
+        entity_keys("exercise", exercise_ids, EXERCISE_EXPANSIONS)
+        + entity_keys("workout", workout_ids, WORKOUT_EXPANSIONS)
+        + entity_keys("tag", tag_ids),
+        lists,
+    )
+
+
+def mark_exercises_changed(db: Session, exercise_ids):
+    """for writes that change what exercises show (ratings, tags) but not where they belong"""
+    mark_changed(db, exercise_ids, exercise_workout_ids(db, exercise_ids))
+    record_changes(db, schemas.ChangeKind.EXERCISE, exercise_ids)
+
+
+def change_owners_statement(kind: schemas.ChangeKind, entity_ids: list[int]):
+    """(user_id, entity_id) of every user who syncs the given entities"""
+    if kind == schemas.ChangeKind.WORKOUT:
+        return sa.select(models.Workout.user_id, models.Workout.workout_id).where(
+            models.Workout.workout_id.in_(entity_ids)
+        )
+    if kind == schemas.ChangeKind.WORKOUT_DATE:
+        return (
+            sa.select(models.Workout.user_id, models.WorkoutDate.id)
+            .join(models.WorkoutDate.workout)
+            .where(models.WorkoutDate.id.in_(entity_ids))
+        )
+    if kind == schemas.ChangeKind.EXERCISE:
+        # the exercise's author and the owner of the workout it is in
+        return sa.union(
+            sa.select(models.Exercise.user_id, models.Exercise.exercise_id).where(
+                models.Exercise.exercise_id.in_(entity_ids), models.Exercise.user_id.is_not(None)
+            ),
+            sa.select(models.Workout.user_id, models.Exercise.exercise_id)
+            .join(models.Exercise.workout)
+            .where(models.Exercise.exercise_id.in_(entity_ids)),
+        )
+    if kind == schemas.ChangeKind.RATING:
+        return sa.select(models.Rating.user_id, models.Rating.rating_id).where(
+            models.Rating.rating_id.in_(entity_ids)
+        )
+    # both sides of a friendship, one edge each
+    return sa.select(models.FriendshipEdge.user_id, models.FriendshipEdge.friendship_id).where(
+        models.FriendshipEdge.friendship_id.in_(entity_ids)
+    )
+
+
+def record_changes(db: Session, kind: schemas.ChangeKind, entity_ids, deleted: bool = False):
+    """
+    logs a write to the given entities for /sync, for the users they belong to at
+    this point of the transaction: after creating or changing them, before deleting
+    them. A write that moves entities to other users records them as deleted before
+    the move and as changed after it, so only the users losing them keep the tombstone.
+    """
+    entity_ids = list({i for i in entity_ids if i is not None})
+    if not entity_ids:
+        return
+    # the previous entry of each entity is replaced, so the log grows with the
+    # number of synced entities rather than with the number of writes
+    db.execute(
+        sa.delete(models.ChangeLog)
+        .where(
+            models.ChangeLog.kind == kind.value,
+            models.ChangeLog.entity_id.in_(entity_ids),
+            sa.tuple_(models.ChangeLog.user_id, models.ChangeLog.entity_id).in_(
+                change_owners_statement(kind, entity_ids)
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    record_new_changes(db, kind, entity_ids, deleted)
+
+
+def record_new_changes(db: Session, kind: schemas.ChangeKind, entity_ids, deleted: bool = False):
+    # entities created in this transaction have no entry to replace, so this is a single insert
+    entity_ids = list({i for i in entity_ids if i is not None})
+    if not entity_ids:
+        return
+    owners = change_owners_statement(kind, entity_ids).subquery()
+    seqs = db.scalars(
+        sa.insert(models.ChangeLog)
+        .from_select(
+            ["user_id", "entity_id", "kind", "deleted"],
+            sa.select(*owners.c, sa.literal(kind.value), sa.literal(deleted)),
+        )
+        .returning(models.ChangeLog.seq)
+    ).all()
+    db.info.setdefault(_CHANGE_LOG_SEQS, set()).update(seqs)
+
+
+# seqs of the change_log rows a transaction wrote, handed out again when it commits
+_CHANGE_LOG_SEQS = "change_log_seqs"
+# pg_advisory_xact_lock key of the commits writing change_log
+CHANGE_LOG_COMMIT_LOCK = 0x6368616E67656C6F
+
+
+def renumber_changes(db: Session, seqs):
+    """
+    moves the given change_log rows after every other row; on PostgreSQL from the
+    seq sequence under a lock held until commit, so no other transaction draws a
+    seq between this one drawing and committing
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(sa.select(sa.func.pg_advisory_xact_lock(CHANGE_LOG_COMMIT_LOCK)))
+        new_seq = sa.func.nextval(sa.func.pg_get_serial_sequence(models.ChangeLog.__tablename__, "seq"))
+    else:
+        new_seq = models.ChangeLog.seq + sa.select(sa.func.max(models.ChangeLog.seq)).scalar_subquery()
+    db.execute(
+        sa.update(models.ChangeLog)
+        .where(models.ChangeLog.seq.in_(seqs))
+        .values(seq=new_seq)
+        .execution_options(synchronize_session=False)
+    )
+
+
+@sa.event.listens_for(Session, "before_commit")
+def _renumber_committed_changes(session):
+    seqs = session.info.pop(_CHANGE_LOG_SEQS, None)
+    # SQLite already serializes writers from their first write to their commit
+    if seqs and session.get_bind().dialect.name != "sqlite":
+        renumber_changes(session, seqs)
+
+
+@sa.event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_changes(session):
+    session.info.pop(_CHANGE_LOG_SEQS, None)
+
+
+def record_workout_changes(db: Session, workout_ids, deleted: bool = False, new: bool = False):
+    """record_changes (record_new_changes for ``new`` ones) of workouts with their dates and exercises"""
+    workout_ids = list(workout_ids)
+    if not workout_ids:
+        return
+    date_ids = db.scalars(
+        sa.select(models.WorkoutDate.id).where(models.WorkoutDate.workout_id.in_(workout_ids))
+    ).all()
+    exercise_ids = db.scalars(
+        sa.select(models.Exercise.exercise_id).where(models.Exercise.workout_id.in_(workout_ids))
+    ).all()
+    record = record_new_changes if new else record_changes
+    record(db, schemas.ChangeKind.WORKOUT, workout_ids, deleted)
+    record(db, schemas.ChangeKind.WORKOUT_DATE, date_ids, deleted)
+    record(db, schemas.ChangeKind.EXERCISE, exercise_ids, deleted)
+
+
+def find_tag_ids(db: Session, tag_names) -> dict[str, int]:
+    """
+    maps the names of existing tags to their ids; unlike resolve_tags, missing
+    tags are left out instead of created
+    """
+    tag_names = set(tag_names)
+    tag_ids = tag_cache.get_many(tag_names)
+    missing = tag_names - tag_ids.keys()
+    if missing:
+        found = dict(
+            db.execute(
+                sa.select(models.Tag.name, models.Tag.tag_id).where(models.Tag.name.in_(missing))
+            ).all()
+        )
+        put_read(db, found)
+        tag_ids.update(found)
+    return tag_ids
+
+
+def set_exercise_tags(db: Session, exercise_id: int, tag_ids, replace: bool = False):
+    if replace:
+        db.execute(
+            sa.delete(models.ExerciseTag).where(
+                models.ExerciseTag.exercise_id == exercise_id
+            )
+        )
+    rows = [
+        {"exercise_id": exercise_id, "tag_id": tag_id} for tag_id in set(tag_ids)
+    ]
+    if rows:
+        db.execute(sa.insert(models.ExerciseTag), rows)
+
+
+# INTEGER on Postgres; SQLite would store more but the schema is meant for both
+INTEGER_RANGE = (-(2**31), 2**31 - 1)
+
+
+def column_error(model, values: dict) -> str | None:
+    """
+    what keeps ``values`` out of the columns of ``model``: a string longer than its
+    String column, a number outside its Integer column or a float that is not
+    finite. None when every value fits.
+    """
+    columns = sa.inspect(model).columns
+    for key, value in values.items():
+        column = columns.get(key)
+        if column is None or value is None:
+            continue
+        column_type = column.type
+        if isinstance(column_type, sa.String) and column_type.length and len(value) > column_type.length:
+            return f"{key} is longer than {column_type.length} characters"
+        if isinstance(column_type, sa.Integer) and not INTEGER_RANGE[0] <= value <= INTEGER_RANGE[1]:
+            return f"{key} is out of range"
+        if isinstance(column_type, sa.Float) and not math.isfinite(value):
+            return f"{key} must be a finite number"
+    return None
+
+
+def bulk_item_error(workout: schemas.WorkoutBulkItem) -> str | None:
+    error = column_error(models.Workout, workout.model_dump(exclude={"dates", "exercises"}))
+    if error:
+        return f"Workout {error}"
+    for exercise in workout.exercises:
+        error = column_error(models.Exercise, exercise.model_dump(exclude={"tags"}))
+        if error:
+            return f"Exercise '{exercise.name[:50]}': {error}"
+        for tag in exercise.tags:
+            error = column_error(models.Tag, {"name": tag})
+            if error:
+                return f"Tag of exercise '{exercise.name[:50]}': {error}"
+    return None
+
+
+def validate_bulk_workouts(
+    db: Session, workouts: list[schemas.WorkoutBulkItem]
+) -> dict[int, str]:
+    """
+    checks every item against the columns it is written to, then its references
+    with one query, and returns an error message per rejected item index, so a
+    bad item is reported instead of failing the batch's insert
+    """
+    errors = {}
+    for index, workout in enumerate(workouts):
+        error = bulk_item_error(workout)
+        if error:
+            errors[index] = error
+    checked = [(index, workout) for index, workout in enumerate(workouts) if index not in errors]
+    user_ids = {workout.user_id for _, workout in checked}
+    user_ids.update(
+        exercise.user_id
+        for _, workout in checked
+        for exercise in workout.exercises
+        if exercise.user_id is not None
+    )
+    existing = set(
+        db.execute(
+            sa.select(models.User.user_id).where(models.User.user_id.in_(user_ids))
+        ).scalars()
+    )
+    for index, workout in checked:
+        if workout.user_id not in existing:
+            errors[index] = f"User {workout.user_id} does not exist"
+            continue
+        for exercise in workout.exercises:
+            if exercise.user_id is not None and exercise.user_id not in existing:
+                errors[index] = (
+                    f"Exercise '{exercise.name}' references user "
+                    f"{exercise.user_id} which does not exist"
+                )
+                break
+    return errors
+
+
+def create_workouts_bulk(
+    db: Session, workouts: list[schemas.WorkoutBulkItem]
+) -> schemas.WorkoutBulkResult:
+    """
+    creates the valid workouts with their dates and exercises in one transaction.
+    Each table gets a single batched INSERT (RETURNING the new ids in parameter
+    order), invalid items are reported back instead of failing the batch.
+    """
+    errors = validate_bulk_workouts(db, workouts)
+    rejected = [
+        schemas.WorkoutBulkError(index=index, detail=detail)
+        for index, detail in sorted(errors.items())
+    ]
+    accepted = [
+        (index, workout)
+        for index, workout in enumerate(workouts)
+        if index not in errors
+    ]
+    if not accepted:
+        return schemas.WorkoutBulkResult(created=[], errors=rejected)
+
+    try:
+        workout_ids = db.execute(
+            sa.insert(models.Workout).returning(
+                models.Workout.workout_id, sort_by_parameter_order=True
+            ),
+            [
+                {"name": workout.name, "user_id": workout.user_id}
+                for _, workout in accepted
+            ],
+        ).scalars().all()
+
+        date_rows = [
+            {
+                "workout_id": workout_id,
+                "date": workout_date.date,
+                "completed": workout_date.completed,
+            }
+            for workout_id, (_, workout) in zip(workout_ids, accepted)
+            for workout_date in workout.dates
+        ]
+        if date_rows:
+            db.execute(sa.insert(models.WorkoutDate), date_rows)
+            days_by_user = defaultdict(list)
+            for _, workout in accepted:
+                days_by_user[workout.user_id].extend(d.date for d in workout.dates)
+            # in user order, like every other holder of several calendar owners' locks
+            for user_id, days in sorted(days_by_user.items()):
+                refresh_adherence_days(db, user_id, days)
+
+        exercises = [
+            (workout_id, exercise)
+            for workout_id, (_, workout) in zip(workout_ids, accepted)
+            for exercise in workout.exercises
+        ]
+        exercise_ids = []
+        tag_ids = {}
+        if exercises:
+            exercise_ids = db.execute(
+                sa.insert(models.Exercise).returning(
+                    models.Exercise.exercise_id, sort_by_parameter_order=True
+                ),
+                [
+                    {**exercise.model_dump(exclude={"tags"}), "workout_id": workout_id}
+                    for workout_id, exercise in exercises
+                ],
+            ).scalars().all()
+            tag_ids = resolve_tags(
+                db, (name for _, exercise in exercises for name in exercise.tags)
+            )
+            tag_rows = [
+                {"exercise_id": exercise_id, "tag_id": tag_ids[name]}
+                for exercise_id, (_, exercise) in zip(exercise_ids, exercises)
+                for name in set(exercise.tags)
+            ]
+            if tag_rows:
+                db.execute(sa.insert(models.ExerciseTag), tag_rows)
+            record_personal_bests(
+                db,
+                (
+                    SimpleNamespace(exercise_id=exercise_id, **exercise.model_dump(exclude={"tags"}))
+                    for exercise_id, (_, exercise) in zip(exercise_ids, exercises)
+                ),
+            )
+            index_new_exercises(
+                db,
+                [
+                    search_document(exercise_id, exercise.name, exercise.description, exercise.tags)
+                    for exercise_id, (_, exercise) in zip(exercise_ids, exercises)
+                ],
+            )
+
+        record_workout_changes(db, workout_ids, new=True)
+        mark_changed(db, user_ids=[workout.user_id for _, workout in accepted])
+        db.commit()
+        logger.debug(f"Created {len(workout_ids)} workouts in bulk")
+    except IntegrityError as e:
+        logger.error(f"Error creating workouts in bulk: {e}")
+        db.rollback()
+        # a cached tag id may be stale if the tag was deleted by another worker
+        tag_cache.clear()
+        raise e
+    except Exception as e:
+        logger.error(f"Error creating workouts in bulk: {e}")
+        db.rollback()
+        raise e
+    for exercise_id, (_, exercise) in zip(exercise_ids, exercises):
+        tag_index.set_exercise_tags(exercise_id, (tag_ids[name] for name in exercise.tags))
+    similarity_refresher.mark_dirty(
+        exercise_id for exercise_id, (_, exercise) in zip(exercise_ids, exercises) if exercise.tags
+    )
+
+    remaining_exercise_ids = iter(exercise_ids)
+    created = [
+        schemas.WorkoutBulkCreated(
+            index=index,
+            workout_id=workout_id,
+            exercise_ids=[next(remaining_exercise_ids) for _ in workout.exercises],
+        )
+        for workout_id, (index, workout) in zip(workout_ids, accepted)
+    ]
+    return schemas.WorkoutBulkResult(created=created, errors=rejected)
+
+
+def get_workout(
+    db: Session, workout_id: int, options: tuple = WORKOUT_RESPONSE_OPTIONS
+):
     try:
         return (
             db.query(models.Workout)
-            .options(joinedload(models.Workout.dates))
+            .options(*options)
             .filter(models.Workout.workout_id == workout_id)
             .first()
         )
@@ -321,15 +1235,39 @@ def get_workout(db: Session, workout_id: int):
         raise e
 
 
-def update_workout(db: Session, workout_id: int, workout: schemas.WorkoutUpdate):
+def get_workout_version(db: Session, workout_id: int) -> int | None:
+    return db.scalar(sa.select(models.Workout.version).where(models.Workout.workout_id == workout_id))
+
+
+def update_workout(
+    db: Session, workout_id: int, workout: schemas.WorkoutUpdate, versions: list[int] | None = None
+):
     db_workout = get_workout(db, workout_id)
     try:
+        claim_version(db, models.Workout, workout_id, versions)
+        # the previous owner loses the workout, the new one is found by mark_changed
+        # and record_workout_changes once the new user_id is flushed
+        previous_user_id = db_workout.user_id
+        moved = workout.user_id is not None and workout.user_id != db_workout.user_id
+        if moved:
+            drop_adherence_calendars(db, [db_workout.user_id, workout.user_id])
+            record_workout_changes(db, [workout_id], deleted=True)
         for key, value in workout.model_dump().items():
             if value is not None:
                 setattr(db_workout, key, value)
+        # sessions do not autoflush, the owner lookups below have to see the new user_id
+        db.flush()
+        if moved:
+            record_workout_changes(db, [workout_id])
+        else:
+            record_changes(db, schemas.ChangeKind.WORKOUT, [workout_id])
+        mark_changed(db, workout_ids=[workout_id], user_ids=[previous_user_id])
         db.commit()
         db.refresh(db_workout)
         logger.debug(f"Updated workout {workout_id}")
+    except VersionConflict:
+        db.rollback()
+        raise
     except Exception as e:
         logger.error(f"Error updating workout {workout_id}: {e}")
         db.rollback()
@@ -340,7 +1278,15 @@ def update_workout(db: Session, workout_id: int, workout: schemas.WorkoutUpdate)
 def delete_workout(db: Session, workout_id: int):
     db_workout = get_workout(db, workout_id)
     try:
+        drop_adherence_calendars(db, [db_workout.user_id])
+        # its exercises lose their workout_id
+        exercise_ids = [exercise.exercise_id for exercise in db_workout.exercises]
+        mark_changed(db, exercise_ids, [workout_id])
+        record_workout_changes(db, [workout_id], deleted=True)
         db.delete(db_workout)
+        db.flush()
+        # the exercises stay with their authors
+        record_changes(db, schemas.ChangeKind.EXERCISE, exercise_ids)
         db.commit()
         logger.debug(f"Deleted workout {workout_id}")
     except Exception as e:
@@ -350,12 +1296,197 @@ def delete_workout(db: Session, workout_id: int):
     return db_workout
 
 
+def workout_day_state(db: Session, user_id: int, day: date) -> tuple[bool, bool]:
+    scheduled, completed = db.execute(
+        sa.select(
+            sa.func.count(models.WorkoutDate.id),
+            sa.func.count(models.WorkoutDate.id).filter(
+                models.WorkoutDate.completed.is_(True)
+            ),
+        )
+        .join(models.WorkoutDate.workout)
+        .where(models.Workout.user_id == user_id, models.WorkoutDate.date == day)
+    ).one()
+    return scheduled > 0, completed > 0
+
+
+def build_adherence_calendar(db: Session, user_id: int) -> AdherenceCalendar:
+    rows = db.execute(
+        sa.select(
+            models.WorkoutDate.date,
+            sa.func.count(models.WorkoutDate.id).filter(
+                models.WorkoutDate.completed.is_(True)
+            ),
+        )
+        .join(models.WorkoutDate.workout)
+        .where(models.Workout.user_id == user_id)
+        .group_by(models.WorkoutDate.date)
+    ).all()
+    calendar = AdherenceCalendar(start=min((day for day, _ in rows), default=date.today()))
+    for day, completed in rows:
+        calendar.set_day(day, scheduled=True, completed=completed > 0)
+    return calendar
+
+
+def stored_adherence_calendar(db_calendar: models.UserCalendar) -> AdherenceCalendar:
+    return AdherenceCalendar(
+        start=db_calendar.start_date,
+        scheduled=AdherenceCalendar.from_bytes(db_calendar.scheduled_days),
+        completed=AdherenceCalendar.from_bytes(db_calendar.completed_days),
+    )
+
+
+def lock_calendar_owners(db: Session, user_ids):
+    """
+    SELECT ... FOR UPDATE on the user rows, which every builder, refresher and
+    dropper of a user's calendar holds, so a calendar built from dates that a
+    concurrent writer is changing is never stored after that writer looked for it
+    """
+    db.execute(
+        sa.select(models.User.user_id)
+        .where(models.User.user_id.in_(sorted(set(user_ids))))
+        .order_by(models.User.user_id)
+        .with_for_update()
+    )
+
+
+def refresh_adherence_days(db: Session, user_id: int, days):
+    """
+    recomputes the calendar bits of the given days from the user's workout dates.
+    Runs inside the writer's transaction, after the change and before the commit.
+    Users without a stored calendar are skipped, it is built on first read.
+    """
+    db.flush()
+    lock_calendar_owners(db, [user_id])
+    # a calendar stored by a reader this writer waited for is only visible when read again
+    db_calendar = db.get(models.UserCalendar, user_id, populate_existing=True)
+    if db_calendar is None:
+        return
+    calendar = stored_adherence_calendar(db_calendar)
+    for day in set(days):
+        scheduled, completed = workout_day_state(db, user_id, day)
+        calendar.set_day(day, scheduled, completed)
+    db_calendar.start_date = calendar.start
+    db_calendar.scheduled_days = AdherenceCalendar.to_bytes(calendar.scheduled)
+    db_calendar.completed_days = AdherenceCalendar.to_bytes(calendar.completed)
+
+
+def drop_adherence_calendars(db: Session, user_ids):
+    # for writes that move many dates at once, the next read rebuilds them
+    lock_calendar_owners(db, user_ids)
+    db.execute(
+        sa.delete(models.UserCalendar).where(models.UserCalendar.user_id.in_(user_ids))
+    )
+
+
+def get_adherence_stats(db: Session, user_id: int, today: date | None = None) -> dict:
+    db_calendar = db.get(models.UserCalendar, user_id)
+    if db_calendar is not None:
+        return stored_adherence_calendar(db_calendar).stats(today or date.today())
+    try:
+        # built under the owner's lock, so no writer changes the dates in between
+        lock_calendar_owners(db, [user_id])
+        db_calendar = db.get(models.UserCalendar, user_id, populate_existing=True)
+        if db_calendar is None:
+            calendar = build_adherence_calendar(db, user_id)
+            db.execute(
+                insert_ignoring_conflicts(db, models.UserCalendar, ["user_id"]),
+                {
+                    "user_id": user_id,
+                    "start_date": calendar.start,
+                    "scheduled_days": AdherenceCalendar.to_bytes(calendar.scheduled),
+                    "completed_days": AdherenceCalendar.to_bytes(calendar.completed),
+                },
+            )
+        else:
+            calendar = stored_adherence_calendar(db_calendar)
+        db.commit()
+    except Exception as e:
+        logger.error(f"Error building the adherence calendar of user {user_id}: {e}")
+        db.rollback()
+        raise e
+    return calendar.stats(today or date.today())
+
+
+def volume_statements(
+    user_id: int, since: date | None, until: date | None, completed_only: bool
+):
+    """
+    the user's exercises and workout dates, the two column sets volume stats are
+    computed from. Dates are fetched as ISO strings, NumPy parses those in bulk.
+    """
+    exercises = (
+        sa.select(
+            models.Exercise.workout_id,
+            models.Exercise.set,
+            models.Exercise.repetition,
+            models.Exercise.weight,
+            models.Exercise.duration,
+            models.Exercise.rpe,
+        )
+        .join(models.Exercise.workout)
+        .where(models.Workout.user_id == user_id)
+    )
+    dates = (
+        sa.select(models.WorkoutDate.workout_id, sa.cast(models.WorkoutDate.date, sa.String))
+        .join(models.WorkoutDate.workout)
+        .where(models.Workout.user_id == user_id)
+    )
+    if since is not None:
+        dates = dates.where(models.WorkoutDate.date >= since)
+    if until is not None:
+        dates = dates.where(models.WorkoutDate.date <= until)
+    if completed_only:
+        dates = dates.where(models.WorkoutDate.completed.is_(True))
+    return exercises, dates
+
+
+def volume_stats(exercise_rows, date_rows, period: schemas.VolumePeriod) -> dict:
+    workout_ids, sets, repetitions, weights, durations, rpes = (
+        zip(*exercise_rows) if exercise_rows else ([],) * 6
+    )
+    date_workout_ids, days = zip(*date_rows) if date_rows else ([],) * 2
+    workout_ids, totals = workout_totals(
+        np.array(workout_ids, dtype=np.int64),
+        np.array(sets, dtype=np.float64),
+        np.array(repetitions, dtype=np.float64),
+        # None becomes NaN
+        np.array(weights, dtype=np.float64),
+        np.array(durations, dtype=np.float64),
+        np.array(rpes, dtype=np.float64),
+    )
+    buckets = aggregate_volume(
+        workout_ids,
+        totals,
+        np.array(date_workout_ids, dtype=np.int64),
+        np.array(days, dtype="datetime64[D]"),
+        period,
+    )
+    return {"period": period, "buckets": buckets}
+
+
+def get_volume_stats(
+    db: Session,
+    user_id: int,
+    period: schemas.VolumePeriod = schemas.VolumePeriod.WEEK,
+    since: date | None = None,
+    until: date | None = None,
+    completed_only: bool = True,
+) -> dict:
+    exercises, dates = volume_statements(user_id, since, until, completed_only)
+    return volume_stats(db.execute(exercises).all(), db.execute(dates).all(), period)
+
+
 def create_workout_date(db: Session, workout_date: schemas.WorkoutDateCreate):
     db_date = models.WorkoutDate(
         workout_id=workout_date.workout_id, date=workout_date.date, completed = workout_date.completed
     )
     try:
         db.add(db_date)
+        db.flush()
+        refresh_adherence_days(db, db_date.workout.user_id, [db_date.date])
+        record_new_changes(db, schemas.ChangeKind.WORKOUT_DATE, [db_date.id])
+        mark_changed(db, workout_ids=[db_date.workout_id])
         db.commit()
         db.refresh(db_date)
         logger.debug(f"Created workout date {db_date.id}")
@@ -374,8 +1505,12 @@ def update_workout_date(db: Session, workout_date_id: int, workout_date: schemas
         .first()
     )
     try:
+        old_day = db_date.date
         for key, value in workout_date.model_dump().items():
             setattr(db_date, key, value)
+        refresh_adherence_days(db, db_date.workout.user_id, [old_day, db_date.date])
+        record_changes(db, schemas.ChangeKind.WORKOUT_DATE, [workout_date_id])
+        mark_changed(db, workout_ids=[db_date.workout_id])
         db.commit()
         db.refresh(db_date)
         logger.debug(f"Updated workout date {workout_date_id}")
@@ -393,7 +1528,11 @@ def delete_workout_date(db: Session, workout_date_id: int):
         .first()
     )
     try:
+        user_id = db_date.workout.user_id
+        record_changes(db, schemas.ChangeKind.WORKOUT_DATE, [workout_date_id], deleted=True)
         db.delete(db_date)
+        refresh_adherence_days(db, user_id, [db_date.date])
+        mark_changed(db, workout_ids=[db_date.workout_id])
         db.commit()
         logger.debug(f"Deleted workout date {workout_date_id}")
     except Exception as e:
@@ -403,39 +1542,164 @@ def delete_workout_date(db: Session, workout_date_id: int):
     return db_date
 
 
+def personal_record_key(exercise) -> tuple | None:
+    # exercises without an owner or without repetitions set no records
+    if exercise.user_id is None or not exercise.repetition or exercise.repetition < 1:
+        return None
+    return exercise.user_id, exercise.name, exercise.weight or 0.0
+
+
+def record_personal_bests(db: Session, exercises):
+    """
+    raises the personal records the given (already flushed) exercises beat,
+    with one lookup for all of them
+    """
+    candidates = {}
+    for exercise in exercises:
+        key = personal_record_key(exercise)
+        if key is not None and exercise.repetition > candidates.get(key, (0, None))[0]:
+            candidates[key] = (exercise.repetition, exercise.exercise_id)
+    if not candidates:
+        return
+    records = {
+        (record.user_id, record.exercise_name, record.weight): record
+        for record in db.scalars(
+            sa.select(models.PersonalRecord).where(
+                sa.tuple_(
+                    models.PersonalRecord.user_id,
+                    models.PersonalRecord.exercise_name,
+                    models.PersonalRecord.weight,
+                ).in_(list(candidates))
+            )
+        )
+    }
+    for (user_id, name, weight), (repetition, exercise_id) in candidates.items():
+        record = records.get((user_id, name, weight))
+        if record is None:
+            db.add(
+                models.PersonalRecord(
+                    user_id=user_id,
+                    exercise_name=name,
+                    weight=weight,
+                    repetition=repetition,
+                    exercise_id=exercise_id,
+                )
+            )
+        elif repetition > record.repetition:
+            record.repetition = repetition
+            record.exercise_id = exercise_id
+
+
+def retire_personal_record(db: Session, exercise_id: int, key: tuple | None):
+    """
+    called before an exercise stops counting towards ``key`` (its old values on
+    update, or on delete). Only when it holds that record is the record
+    recomputed from the user's other exercises.
+    """
+    if key is None:
+        return
+    record = db.get(models.PersonalRecord, key)
+    if record is None or record.exercise_id != exercise_id:
+        return
+    user_id, name, weight = key
+    weight_matches = (
+        models.Exercise.weight == weight
+        if weight
+        else sa.or_(models.Exercise.weight.is_(None), models.Exercise.weight == 0)
+    )
+    runner_up = db.execute(
+        sa.select(models.Exercise.exercise_id, models.Exercise.repetition)
+        .where(
+            models.Exercise.user_id == user_id,
+            models.Exercise.name == name,
+            weight_matches,
+            models.Exercise.exercise_id != exercise_id,
+            models.Exercise.repetition >= 1,
+        )
+        .order_by(models.Exercise.repetition.desc(), models.Exercise.exercise_id)
+        .limit(1)
+    ).first()
+    if runner_up is None:
+        db.delete(record)
+    else:
+        record.exercise_id, record.repetition = runner_up
+    db.flush()
+
+
+def estimated_one_rep_max(weight: float, repetition: int) -> float:
+    # Epley formula
+    return weight if repetition == 1 else weight * (1 + repetition / 30)
+
+
+def get_personal_records(db: Session, user_id: int) -> list[dict]:
+    records = db.scalars(
+        sa.select(models.PersonalRecord)
+        .where(models.PersonalRecord.user_id == user_id)
+        .order_by(models.PersonalRecord.exercise_name, models.PersonalRecord.weight)
+    ).all()
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record.exercise_name, []).append(record)
+    return [
+        {
+            "exercise_name": name,
+            "best_weight": records[-1].weight,
+            "estimated_1rm": max(
+                estimated_one_rep_max(record.weight, record.repetition) for record in records
+            ),
+            "reps_by_weight": records,
+        }
+        for name, records in by_name.items()
+    ]
+
+
 def create_exercise(db: Session, exercise: schemas.ExerciseCreate) -> models.Exercise:
     exercise_data = exercise.model_dump()
-
     tag_names = exercise_data.pop("tags", [])
-    tag_objects = []
-
-    # Check and fetch or create Tag objects
-    for tag_name in tag_names:
-        tag = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
-        if not tag:
-            tag = models.Tag(name=tag_name)
-            db.add(tag)
-            try:
-                db.commit()
-            except IntegrityError:
-                db.rollback()
-                tag = db.query(models.Tag).filter(models.Tag.name == tag_name).first()
-        tag_objects.append(tag)
-
-    new_exercise = models.Exercise(**exercise_data)
-    new_exercise.tags = tag_objects
-
-    db.add(new_exercise)
-    db.commit()
-    db.refresh(new_exercise)
 
-    return new_exercise
-
-
-def get_exercise(db: Session, exercise_id: int):
+    for attempt in range(2):
+        try:
+            tag_ids = resolve_tags(db, tag_names)
+            new_exercise = models.Exercise(**exercise_data)
+            db.add(new_exercise)
+            db.flush()
+            exercise_id = new_exercise.exercise_id
+            set_exercise_tags(db, exercise_id, tag_ids.values())
+            record_personal_bests(db, [new_exercise])
+            index_new_exercises(
+                db,
+                [search_document(exercise_id, new_exercise.name, new_exercise.description, tag_names)],
+            )
+            record_new_changes(db, schemas.ChangeKind.EXERCISE, [exercise_id])
+            mark_changed(db, workout_ids=[new_exercise.workout_id])
+            db.commit()
+            break
+        except IntegrityError as e:
+            db.rollback()
+            # a cached tag id may be stale if the tag was deleted by another worker
+            tag_cache.clear()
+            if attempt:
+                logger.error(f"Error creating exercise: {e}")
+                raise e
+        except Exception as e:
+            logger.error(f"Error creating exercise: {e}")
+            db.rollback()
+            raise e
+
+    tag_index.set_exercise_tags(exercise_id, tag_ids.values())
+    if tag_ids:
+        similarity_refresher.mark_dirty([exercise_id])
+    logger.debug(f"Created exercise {exercise_id}")
+    return get_exercise(db, exercise_id)
+
+
+def get_exercise(
+    db: Session, exercise_id: int, options: tuple = EXERCISE_RESPONSE_OPTIONS
+):
     try:
         return (
             db.query(models.Exercise)
+            .options(*options)
             .filter(models.Exercise.exercise_id == exercise_id)
             .first()
         )
@@ -444,38 +1708,285 @@ def get_exercise(db: Session, exercise_id: int):
         raise e
 
 
-def update_exercise(db: Session, exercise_id: int, exercise: schemas.ExerciseCreate):
+def top_rated_exercises_statement(tag: str | None, min_ratings: int, limit: int):
+    """
+    walks ix_exercise_rating_mean_exercise_id from the top, so the cost depends on
+    the limit rather than on the number of exercises or ratings
+    """
+    statement = sa.select(models.Exercise).where(
+        models.Exercise.rating_mean.is_not(None),
+        models.Exercise.rating_count >= min_ratings,
+    )
+    if tag is not None:
+        statement = statement.where(
+            models.Exercise.exercise_id.in_(
+                sa.select(models.ExerciseTag.exercise_id)
+                .join(models.Tag)
+                .where(models.Tag.name == tag)
+            )
+        )
+    return (
+        statement.options(*EXERCISE_RESPONSE_OPTIONS)
+        .order_by(models.Exercise.rating_mean.desc(), models.Exercise.exercise_id.desc())
+        .limit(limit)
+    )
+
+
+def search_cursor(score: float, exercise_id: int) -> str:
+    return encode_cursor(f"{score!r}:{exercise_id}")
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, int]:
+    key = decode_cursor(cursor)
+    try:
+        score, exercise_id = str(key).split(":")
+        return float(score), int(exercise_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def search_exercises_statement(
+    dialect_name: str, query: str, tags: list[str], cursor: str | None, limit: int
+):
+    """
+    ranked full-text matches, best first. Like keyset_page_statement, a page
+    starts right after the (score, exercise_id) of the previous page's last row
+    and one extra row tells whether there is a next page.
+    """
+    index = search_index(dialect_name)
+    terms = search_terms(query)
+    hits = (
+        sa.select(index.id_column.label("exercise_id"), index.score(terms).label("score"))
+        .where(index.match(terms))
+        .subquery()
+    )
+    statement = sa.select(models.Exercise, hits.c.score).join(
+        hits, hits.c.exercise_id == models.Exercise.exercise_id
+    )
+    for tag in set(tags):
+        statement = statement.where(
+            models.Exercise.exercise_id.in_(
+                sa.select(models.ExerciseTag.exercise_id)
+                .join(models.Tag)
+                .where(models.Tag.name == tag)
+            )
+        )
+    if cursor is not None:
+        score, exercise_id = decode_search_cursor(cursor)
+        statement = statement.where(
+            sa.or_(
+                hits.c.score > score,
+                sa.and_(hits.c.score == score, models.Exercise.exercise_id > exercise_id),
+            )
+        )
+    return (
+        statement.options(*EXERCISE_RESPONSE_OPTIONS)
+        .order_by(hits.c.score, models.Exercise.exercise_id)
+        .limit(limit + 1)
+    )
+
+
+def keyset_search_page(rows: list, limit: int) -> dict:
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = search_cursor(rows[-1].score, rows[-1].Exercise.exercise_id)
+    return {"items": [row.Exercise for row in rows], "next_cursor": next_cursor}
+
+
+def search_exercises(
+    db: Session,
+    query: str,
+    tags: list[str] | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+) -> dict:
+    if not search_terms(query):
+        return {"items": [], "next_cursor": None}
+    limit = clamp_page_size(limit)
+    statement = search_exercises_statement(
+        db.get_bind().dialect.name, query, tags or [], cursor, limit
+    )
+    return keyset_search_page(db.execute(statement).all(), limit)
+
+
+def load_tag_index():
+    with database.SessionLocal() as db:
+        tag_index.ensure_loaded(db)
+
+
+def get_exercises_by_tags(
+    db: Session,
+    tags: list[str] = (),
+    any_tags: list[str] = (),
+    exclude_tags: list[str] = (),
+    cursor: str | None = None,
+    limit: int | None = None,
+) -> dict:
+    """
+    the exercises carrying all of ``tags``, at least one of ``any_tags`` (when
+    given) and none of ``exclude_tags``, in exercise id pages. The tag filter is
+    resolved on the in-process bitmaps, so the only query is for the page itself.
+    """
+    limit = clamp_page_size(limit)
+    after = 0
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        if not isinstance(after, int):
+            raise ValueError("Invalid cursor")
+    tag_index.ensure_loaded(db)
+    tag_ids = find_tag_ids(db, [*tags, *any_tags, *exclude_tags])
+    unknown_any = any_tags and not any(name in tag_ids for name in any_tags)
+    if unknown_any or any(name not in tag_ids for name in tags):
+        return {"items": [], "next_cursor": None}
+    matches = tag_index.matching(
+        [tag_ids[name] for name in tags],
+        [tag_ids[name] for name in any_tags if name in tag_ids],
+        [tag_ids[name] for name in exclude_tags if name in tag_ids],
+    )
+    exercise_ids = list(islice(matches.ids_after(after), limit + 1))
+    rows = db.scalars(
+        sa.select(models.Exercise)
+        .options(*EXERCISE_RESPONSE_OPTIONS)
+        .where(models.Exercise.exercise_id.in_(exercise_ids))
+        .order_by(models.Exercise.exercise_id)
+    ).all()
+    return keyset_page(rows, models.Exercise.exercise_id, limit)
+
+
+def delete_similarity(exercise_id: int):
+    return sa.delete(models.ExerciseSimilarity).where(
+        models.ExerciseSimilarity.exercise_id == exercise_id
+    )
+
+
+def get_similar_exercises(db: Session, exercise_id: int, limit: int) -> list[dict]:
+    """
+    the precomputed neighbours of an exercise, best first; neighbours deleted
+    since the last computation are left out
+    """
+    row = db.get(models.ExerciseSimilarity, exercise_id)
+    if row is None:
+        return []
+    neighbour_ids, scores = unpack(row)
+    exercises = {
+        exercise.exercise_id: exercise
+        for exercise in db.scalars(
+            sa.select(models.Exercise)
+            .options(*EXERCISE_RESPONSE_OPTIONS)
+            .where(models.Exercise.exercise_id.in_(neighbour_ids.tolist()))
+        )
+    }
+    similar = [
+        {"similarity": score, "exercise": exercises[neighbour_id]}
+        for neighbour_id, score in zip(neighbour_ids.tolist(), scores.tolist())
+        if neighbour_id in exercises
+    ]
+    return similar[:limit]
+
+
+def get_top_rated_exercises(
+    db: Session, tag: str | None = None, min_ratings: int = 1, limit: int | None = None
+):
+    statement = top_rated_exercises_statement(tag, min_ratings, clamp_page_size(limit))
+    return db.execute(statement).scalars().all()
+
+
+def update_exercise(db: Session, exercise_id: int, exercise: schemas.ExerciseUpdate):
     db_exercise = get_exercise(db, exercise_id)
     try:
-        for key, value in exercise.model_dump().items():
+        retire_personal_record(db, exercise_id, personal_record_key(db_exercise))
+        old_workout_id = db_exercise.workout_id
+        # it may move to another author or workout owner
+        record_changes(db, schemas.ChangeKind.EXERCISE, [exercise_id], deleted=True)
+        for key, value in exercise.model_dump(exclude={"tags"}).items():
             setattr(db_exercise, key, value)
+        if exercise.tags is not None:
+            tag_ids = resolve_tags(db, exercise.tags)
+            set_exercise_tags(db, exercise_id, tag_ids.values(), replace=True)
+        db.flush()
+        record_personal_bests(db, [db_exercise])
+        index_exercises(db, [exercise_id])
+        record_changes(db, schemas.ChangeKind.EXERCISE, [exercise_id])
+        mark_changed(db, [exercise_id], [old_workout_id, db_exercise.workout_id])
         db.commit()
         db.refresh(db_exercise)
         logger.debug(f"Updated exercise {exercise_id}")
+    except IntegrityError as e:
+        logger.error(f"Error updating exercise {exercise_id}: {e}")
+        db.rollback()
+        # a cached tag id may be stale if the tag was deleted by another worker
+        tag_cache.clear()
+        raise e
     except Exception as e:
         logger.error(f"Error updating exercise {exercise_id}: {e}")
         db.rollback()
         raise e
+    if exercise.tags is not None:
+        tag_index.set_exercise_tags(exercise_id, tag_ids.values())
+        similarity_refresher.mark_dirty([exercise_id])
     return db_exercise
 
 
 def delete_exercise(db: Session, exercise_id: int):
     db_exercise = get_exercise(db, exercise_id)
     try:
+        retire_personal_record(db, exercise_id, personal_record_key(db_exercise))
+        db.execute(delete_similarity(exercise_id))
+        mark_changed(db, [exercise_id], [db_exercise.workout_id])
+        record_changes(db, schemas.ChangeKind.EXERCISE, [exercise_id], deleted=True)
         db.delete(db_exercise)
+        index_exercises(db, [exercise_id])
         db.commit()
         logger.debug(f"Deleted exercise {exercise_id}")
     except Exception as e:
         logger.error(f"Error deleting exercise {exercise_id}: {e}")
         db.rollback()
         raise e
+    tag_index.remove_exercise(exercise_id)
     return db_exercise
 
 
+def rating_aggregate_update(exercise_id: int, count_delta: int, sum_delta: float):
+    """
+    moves an exercise's rating count, sum and mean by one rating in the database
+    itself, so concurrent writers never overwrite each other's aggregate
+    """
+    count = models.Exercise.rating_count + count_delta
+    total = models.Exercise.rating_sum + sum_delta
+    return (
+        sa.update(models.Exercise)
+        .where(models.Exercise.exercise_id == exercise_id)
+        .values(
+            rating_count=count,
+            # reset instead of keeping float residue once the last rating is gone
+            rating_sum=sa.case((count > 0, total), else_=0.0),
+            rating_mean=sa.case((count > 0, total / count), else_=None),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rating_aggregate_updates(old: models.Rating | None, new: schemas.RatingCreate | None):
+    if old is not None and new is not None and old.exercise_id == new.exercise_id:
+        if old.rating != new.rating:
+            yield rating_aggregate_update(old.exercise_id, 0, new.rating - old.rating)
+        return
+    if old is not None:
+        yield rating_aggregate_update(old.exercise_id, -1, -old.rating)
+    if new is not None:
+        yield rating_aggregate_update(new.exercise_id, 1, new.rating)
+
+
 def create_rating(db: Session, rating: schemas.RatingCreate):
     db_rating = models.Rating(**rating.model_dump())
     try:
         db.add(db_rating)
+        for statement in rating_aggregate_updates(None, rating):
+            db.execute(statement)
+        mark_exercises_changed(db, [rating.exercise_id])
+        db.flush()
+        record_new_changes(db, schemas.ChangeKind.RATING, [db_rating.rating_id])
         db.commit()
         db.refresh(db_rating)
         logger.debug(f"Created rating {db_rating.rating_id}")
@@ -499,8 +2010,16 @@ def get_rating(db: Session, rating_id: int):
 def update_rating(db: Session, rating_id: int, rating: schemas.RatingCreate):
     db_rating = get_rating(db, rating_id)
     try:
+        for statement in rating_aggregate_updates(db_rating, rating):
+            db.execute(statement)
+        mark_exercises_changed(db, [db_rating.exercise_id, rating.exercise_id])
+        # it may move to another user
+        record_changes(db, schemas.ChangeKind.RATING, [rating_id], deleted=True)
         for key, value in rating.model_dump().items():
             setattr(db_rating, key, value)
+        # flushed so the owner lookup sees the new user_id
+        db.flush()
+        record_changes(db, schemas.ChangeKind.RATING, [rating_id])
         db.commit()
         db.refresh(db_rating)
         logger.debug(f"Updated rating {rating_id}")
@@ -514,6 +2033,10 @@ def update_rating(db: Session, rating_id: int, rating: schemas.RatingCreate):
 def delete_rating(db: Session, rating_id: int):
     db_rating = get_rating(db, rating_id)
     try:
+        for statement in rating_aggregate_updates(db_rating, None):
+            db.execute(statement)
+        mark_exercises_changed(db, [db_rating.exercise_id])
+        record_changes(db, schemas.ChangeKind.RATING, [rating_id], deleted=True)
         db.delete(db_rating)
         db.commit()
         logger.debug(f"Deleted rating {rating_id}")
@@ -527,6 +2050,7 @@ def delete_rating(db: Session, rating_id: int):
 def create_tag(db: Session, tag: schemas.TagCreate):
     new_tag = models.Tag(**tag.model_dump())
     db.add(new_tag)
+    mark_changed(db, lists=("tags",))
     db.commit()
     db.refresh(new_tag)
     return new_tag
@@ -536,18 +2060,26 @@ def get_tag(db: Session, tag_id: int):
     return db.query(models.Tag).filter(models.Tag.tag_id == tag_id).first()
 
 
-def get_tags(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.Tag).offset(skip).limit(limit).all()
+def get_tags(db: Session, cursor: str | None = None, limit: int | None = None):
+    return paginate(db, sa.select(models.Tag), models.Tag.tag_id, cursor, limit)
 
 
 def update_tag(db: Session, tag_id: int, tag: schemas.TagUpdate):
     existing_tag = db.query(models.Tag).filter(models.Tag.tag_id == tag_id).first()
     if not existing_tag:
         return None
+    old_name = existing_tag.name
     for key, value in tag.dict().items():
         if value is not None:
             setattr(existing_tag, key, value)
+    mark_changed(db, tag_ids=[tag_id], lists=("tags",))
+    if existing_tag.name != old_name:
+        exercise_ids = tagged_exercise_ids(db, tag_id)
+        index_exercises(db, exercise_ids)
+        # exercises embed the names of their tags
+        mark_exercises_changed(db, exercise_ids)
     db.commit()
+    tag_cache.invalidate(old_name)
     db.refresh(existing_tag)
     return existing_tag
 
@@ -556,16 +2088,40 @@ def delete_tag(db: Session, tag_id: int):
     tag = db.query(models.Tag).filter(models.Tag.tag_id == tag_id).first()
     if not tag:
         return None
+    exercise_ids = tagged_exercise_ids(db, tag_id)
+    mark_exercises_changed(db, exercise_ids)
+    mark_changed(db, tag_ids=[tag_id], lists=("tags",))
     db.delete(tag)
+    index_exercises(db, exercise_ids)
     db.commit()
+    tag_index.remove_tag(tag_id)
+    similarity_refresher.mark_dirty(exercise_ids)
+    tag_cache.invalidate(tag.name)
     return tag
 
 
+# locales stored in columns of lang before lang_bundle; rewriting one moves it to a bundle row
+LEGACY_LOCALE_COLUMNS = ("ru_RU", "tr_TR")
+
+
+def set_lang_locales(lang: models.Lang, locales: dict):
+    bundles = {bundle.locale: bundle for bundle in lang.bundles}
+    for locale, messages in locales.items():
+        if locale in LEGACY_LOCALE_COLUMNS:
+            setattr(lang, locale, None)
+        if locale in bundles:
+            bundles[locale].messages = messages
+        else:
+            lang.bundles.append(models.LangBundle(locale=locale, messages=messages))
+
+
 def create_lang(db: Session, lang: schemas.LangCreate):
-    new_lang = models.Lang(**lang.model_dump())
+    new_lang = models.Lang()
+    set_lang_locales(new_lang, lang.locales())
     db.add(new_lang)
     db.commit()
     db.refresh(new_lang)
+    lang_catalog.invalidate()
     return new_lang
 
 
@@ -577,11 +2133,10 @@ def update_lang(db: Session, lang_id: int, lang: schemas.LangUpdate):
     existing_lang = db.query(models.Lang).filter(models.Lang.lang_id == lang_id).first()
     if not existing_lang:
         return None
-    for key, value in lang.dict().items():
-        if value is not None:
-            setattr(existing_lang, key, value)
+    set_lang_locales(existing_lang, lang.locales())
     db.commit()
     db.refresh(existing_lang)
+    lang_catalog.invalidate()
     return existing_lang
 
 
@@ -591,4 +2146,67 @@ def delete_lang(db: Session, lang_id: int):
         return None
     db.delete(lang)
     db.commit()
+    lang_catalog.invalidate()
     return lang
+
+
+def get_lang_catalog(db: Session) -> CatalogSnapshot:
+    """the translation catalog, read from the database only when it is not loaded or stale"""
+    return lang_catalog.ensure_loaded(db)
+
+
+# how /sync loads each kind of change: the model, its key, its response field and loader options
+SYNC_KINDS = {
+    schemas.ChangeKind.WORKOUT: (models.Workout, models.Workout.workout_id, "workouts", ()),
+    schemas.ChangeKind.WORKOUT_DATE: (models.WorkoutDate, models.WorkoutDate.id, "workout_dates", ()),
+    schemas.ChangeKind.EXERCISE: (
+        models.Exercise, models.Exercise.exercise_id, "exercises", (selectinload(models.Exercise.tags),)
+    ),
+    schemas.ChangeKind.RATING: (models.Rating, models.Rating.rating_id, "ratings", ()),
+    schemas.ChangeKind.FRIENDSHIP: (models.Friendship, models.Friendship.friendship_id, "friendships", ()),
+}
+
+
+def get_changes(db: Session, user_id: int, since: str | None = None, limit: int | None = None) -> dict:
+    """
+    the entities of a user created, changed or deleted after the ``since`` cursor,
+    in change order: a range of the user's change_log entries and one IN query per
+    kind of entity in it, so the cost follows the number of changes rather than the
+    size of the user's history. Entities deleted since are returned as tombstones.
+    Seqs follow commit order, not write order (see renumber_changes), so a
+    transaction committing late cannot land behind a cursor already handed out.
+    """
+    limit = clamp_page_size(limit)
+    entries = db.scalars(
+        keyset_page_statement(
+            sa.select(models.ChangeLog).where(models.ChangeLog.user_id == user_id),
+            models.ChangeLog.seq,
+            since,
+            limit,
+        )
+    ).all()
+    changes = {field: [] for _, _, field, _ in SYNC_KINDS.values()}
+    changes["has_more"] = len(entries) > limit
+    entries = entries[:limit]
+    # a user without changes yet starts from the beginning of the log next time
+    changes["next_cursor"] = encode_cursor(entries[-1].seq) if entries else since or encode_cursor(0)
+
+    changed = defaultdict(list)
+    deleted = []
+    for entry in entries:
+        kind = schemas.ChangeKind(entry.kind)
+        if entry.deleted:
+            deleted.append({"kind": kind, "id": entry.entity_id})
+        else:
+            changed[kind].append(entry.entity_id)
+    for kind, entity_ids in changed.items():
+        model, key, field, options = SYNC_KINDS[kind]
+        rows = {
+            getattr(row, key.key): row
+            for row in db.scalars(sa.select(model).options(*options).where(key.in_(entity_ids)))
+        }
+        changes[field] = [rows[entity_id] for entity_id in entity_ids if entity_id in rows]
+        # rows gone without a tombstone of their own, e.g. with their user
+        deleted.extend({"kind": kind, "id": entity_id} for entity_id in entity_ids if entity_id not in rows)
+    changes["deleted"] = deleted
+    return changes
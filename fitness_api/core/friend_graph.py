@@ -0,0 +1,120 @@
+"""
+in-process graph of accepted friendships
+
+Every user maps to a sorted array of the ids of their accepted friends. The graph
+is built with one query the first time it is needed, then kept current by the
+friendship writers in db_functions, so friend-of-friend suggestions and mutual
+friend counts are computed in memory instead of with self-joins. Other worker
+processes do not see this process' writes, so the graph is also rebuilt from the
+database once it is older than ``friend_graph_reload_seconds``.
+"""
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from fitness_api.settings import SETTINGS
+
+from . import models, schemas
+
+_EMPTY = array("q")
+
+
+def _set_friendship(adjacency: dict[int, array], user_id: int, friend_id: int, accepted: bool):
+    for a, b in ((user_id, friend_id), (friend_id, user_id)):
+        friends = adjacency.get(a, _EMPTY)
+        i = bisect_left(friends, b)
+        present = i < len(friends) and friends[i] == b
+        if accepted and not present:
+            adjacency[a] = friends[:i] + array("q", [b]) + friends[i:]
+        elif not accepted and present:
+            adjacency[a] = friends[:i] + friends[i + 1:]
+
+
+class FriendGraph:
+    def __init__(self, reload_seconds: float):
+        self.reload_seconds = reload_seconds
+        self._adjacency: dict[int, array] | None = None
+        self._loaded_at = 0.0
+        # the writes recorded while each running load reads, replayed before it is kept
+        self._loads: list[list[tuple[int, int, bool]]] = []
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self, db: Session):
+        if self._adjacency is not None and time.monotonic() - self._loaded_at < self.reload_seconds:
+            return
+        writes = []
+        with self._lock:
+            self._loads.append(writes)
+        try:
+            rows = db.execute(
+                sa.select(models.FriendshipEdge.user_id, models.FriendshipEdge.friend_id)
+                .join(models.FriendshipEdge.friendship)
+                .join(models.Friendship.status)
+                .where(models.FriendshipStatus.name == schemas.StatusEnum.ACCEPTED.value)
+                .order_by(models.FriendshipEdge.user_id, models.FriendshipEdge.friend_id)
+            ).all()
+        except BaseException:
+            with self._lock:
+                self._loads.remove(writes)
+            raise
+        adjacency: dict[int, array] = {}
+        for user_id, friend_id in rows:
+            adjacency.setdefault(user_id, array("q")).append(friend_id)
+        with self._lock:
+            self._loads.remove(writes)
+            # the query may have run before these commits, they set states so replaying is harmless
+            for write in writes:
+                _set_friendship(adjacency, *write)
+            self._adjacency = adjacency
+            self._loaded_at = time.monotonic()
+
+    def set_friendship(self, user_id: int, friend_id: int, accepted: bool):
+        """
+        records the current state of a friendship after it was written. Arrays are
+        replaced rather than modified so readers never see one mid-update.
+        """
+        with self._lock:
+            for writes in self._loads:
+                writes.append((user_id, friend_id, accepted))
+            if self._adjacency is not None:
+                _set_friendship(self._adjacency, user_id, friend_id, accepted)
+
+    def friends(self, user_id: int) -> array:
+        return (self._adjacency or {}).get(user_id, _EMPTY)
+
+    def mutual_friends(self, user_id: int, other_user_id: int) -> list[int]:
+        return sorted(set(self.friends(user_id)).intersection(self.friends(other_user_id)))
+
+    def suggestions(self, user_id: int, limit: int) -> list[tuple[int, int]]:
+        """
+        friends of friends who are not friends yet, as (user_id, mutual friend
+        count) with the most mutual friends first
+        """
+        friends = self.friends(user_id)
+        candidates = Counter(chain.from_iterable(self.friends(friend) for friend in friends))
+        candidates.pop(user_id, None)
+        for friend in friends:
+            candidates.pop(friend, None)
+        return heapq.nsmallest(limit, candidates.items(), key=lambda item: (-item[1], item[0]))
+
+    def clear(self):
+        with self._lock:
+            self._adjacency = None
+
+    def stats(self) -> dict:
+        adjacency = self._adjacency or {}
+        return {
+            "loaded": self._adjacency is not None,
+            "users": len(adjacency),
+            "edges": sum(len(friends) for friends in adjacency.values()),
+        }
+
+
+friend_graph = FriendGraph(reload_seconds=SETTINGS.friend_graph_reload_seconds)
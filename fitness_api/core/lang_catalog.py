@@ -0,0 +1,163 @@
+"""
+in-process translation catalog
+
+The translations of every Lang row are merged per locale (later rows override the
+keys of earlier ones) into one bundle per locale, serialized to JSON once and
+tagged with a hash of that JSON. Serving a bundle is then a dict lookup that hands
+out prebuilt bytes, and the hash doubles as the ETag clients revalidate with, the
+same in every worker for the same translations. Single messages are looked up by
+their dotted key ("home.title") in a flattened copy of each bundle.
+
+Like the friend graph the catalog is built with one query the first time it is
+needed and rebuilt once it is older than ``lang_catalog_reload_seconds`` so other
+workers' writes show up; the lang writers in db_functions mark it stale after every
+write so this worker rebuilds it on the next read. Every load is an immutable
+``CatalogSnapshot`` the routes read from, so a write landing mid-request never
+empties the catalog under them.
+"""
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session, selectinload
+
+from fitness_api.settings import SETTINGS
+
+from . import models
+
+
+@dataclass(frozen=True)
+class LocaleBundle:
+    locale: str
+    body: bytes
+    etag: str
+    messages: dict
+
+
+def merge_messages(target: dict, messages: dict):
+    for key, value in messages.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_messages(target[key], value)
+        else:
+            target[key] = value
+
+
+def flatten_messages(messages: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in messages.items():
+        if isinstance(value, dict):
+            flat.update(flatten_messages(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def etag_of(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def build_bundles(rows) -> dict[str, LocaleBundle]:
+    """the bundle of every locale from Lang rows in the order they override each other"""
+    merged: dict[str, dict] = {}
+    for lang in rows:
+        for locale, messages in lang.locales.items():
+            merge_messages(merged.setdefault(locale, {}), messages)
+    bundles = {}
+    for locale, messages in merged.items():
+        body = json.dumps(messages, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode()
+        bundles[locale] = LocaleBundle(locale, body, etag_of(body), flatten_messages(messages))
+    return bundles
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """the bundles of one load and their version, never changed once built"""
+
+    bundles: dict[str, LocaleBundle]
+    version: str
+    loaded_at: float
+
+    def locales(self) -> dict[str, str]:
+        """the ETag of every locale's bundle by locale code"""
+        return {locale: bundle.etag for locale, bundle in sorted(self.bundles.items())}
+
+    def bundle(self, locale: str) -> LocaleBundle | None:
+        return self.bundles.get(locale)
+
+    def message(self, locale: str, key: str):
+        """the message at the dotted ``key`` of a locale, KeyError when missing"""
+        bundle = self.bundle(locale)
+        if bundle is None:
+            raise KeyError(locale)
+        return bundle.messages[key]
+
+
+class LangCatalog:
+    def __init__(self, reload_seconds: float):
+        self.reload_seconds = reload_seconds
+        self._snapshot: CatalogSnapshot | None = None
+        self._stale = False
+        # moved by every invalidate, so a load that overlapped a write is not kept
+        self._generation = 0
+        self._loads = 0
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self, db: Session) -> CatalogSnapshot:
+        """
+        the current snapshot, loaded first when there is none or it is stale; callers
+        read one snapshot throughout, so a concurrent write cannot change it under them
+        """
+        snapshot = self._snapshot
+        if (
+            snapshot is not None
+            and not self._stale
+            and time.monotonic() - snapshot.loaded_at < self.reload_seconds
+        ):
+            return snapshot
+        generation = self._generation
+        rows = db.scalars(
+            sa.select(models.Lang).options(selectinload(models.Lang.bundles)).order_by(models.Lang.lang_id)
+        ).all()
+        bundles = build_bundles(rows)
+        version = etag_of(
+            "\n".join(f"{locale} {bundles[locale].etag}" for locale in sorted(bundles)).encode()
+        ).strip('"')
+        snapshot = CatalogSnapshot(bundles, version, time.monotonic())
+        with self._lock:
+            self._loads += 1
+            # a load that raced a write may miss it; it serves this request only
+            if self._generation == generation:
+                self._snapshot = snapshot
+                self._stale = False
+        return snapshot
+
+    def invalidate(self):
+        """marks the catalog stale after a write so the next read rebuilds it"""
+        with self._lock:
+            self._stale = True
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+            self._stale = False
+            self._generation += 1
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        bundles = snapshot.bundles if snapshot is not None else {}
+        return {
+            "loaded": snapshot is not None,
+            "stale": self._stale,
+            "version": snapshot.version if snapshot is not None else "",
+            "loads": self._loads,
+            "locales": len(bundles),
+            "messages": sum(len(bundle.messages) for bundle in bundles.values()),
+            "bytes": sum(len(bundle.body) for bundle in bundles.values()),
+        }
+
+
+lang_catalog = LangCatalog(reload_seconds=SETTINGS.lang_catalog_reload_seconds)
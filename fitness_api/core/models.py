@@ -5,7 +5,9 @@ from sqlalchemy import (
     Float,
     ForeignKey,
     Date,
+    LargeBinary,
     Boolean,
+    Index,
     UniqueConstraint,
 )
 from sqlalchemy.orm import relationship
@@ -33,6 +35,8 @@ class User(Base):
     account_type = Column(account_type_enum, nullable=False)
     disabled = Column(Boolean, nullable=False, default=False)
     extra_data = Column(JSON)
+    # moved by every write to the user or the workouts under it, the ETag of /user/me
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     workouts = relationship("Workout", back_populates="user")
 
@@ -52,16 +56,38 @@ class Friendship(Base):
 
     friendship_id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("user.user_id"), nullable=False)
-    friend_id = Column(Integer, ForeignKey("user.user_id"), nullable=False)
+    friend_id = Column(
+        Integer, ForeignKey("user.user_id"), nullable=False, index=True
+    )
     status_id = Column(
         Integer, ForeignKey("friendship_status.status_id"), nullable=False
     )
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     status = relationship("FriendshipStatus", back_populates="friendships")
+    edges = relationship(
+        "FriendshipEdge", back_populates="friendship", cascade="all, delete-orphan"
+    )
 
+    # uq_friendship also serves lookups by user_id
     __table_args__ = (UniqueConstraint("user_id", "friend_id", name="uq_friendship"),)
 
 
+# One row per direction of a friendship, so the friends of a user are a primary key
+# range scan on user_id whichever side of the friendship the user is on. The
+# primary key also rejects a second friendship for the same pair in reverse.
+class FriendshipEdge(Base):
+    __tablename__ = "friendship_edge"
+
+    user_id = Column(Integer, ForeignKey("user.user_id"), primary_key=True)
+    friend_id = Column(Integer, ForeignKey("user.user_id"), primary_key=True)
+    friendship_id = Column(
+        Integer, ForeignKey("friendship.friendship_id"), nullable=False, index=True
+    )
+
+    friendship = relationship("Friendship", back_populates="edges")
+
+
 class WorkoutDate(Base):
     __tablename__ = "workout_date"
 
@@ -72,14 +98,29 @@ class WorkoutDate(Base):
 
     workout = relationship("Workout", back_populates="dates")
 
+    __table_args__ = (Index("ix_workout_date_workout_id_date", "workout_id", "date"),)
+
+
+# Bitmaps of the days a user has workouts scheduled / completed on, see
+# core.adherence. Written by the workout date writers in db_functions.
+class UserCalendar(Base):
+    __tablename__ = "user_calendar"
+
+    user_id = Column(Integer, ForeignKey("user.user_id"), primary_key=True)
+    start_date = Column(Date, nullable=False)
+    scheduled_days = Column(LargeBinary, nullable=False)
+    completed_days = Column(LargeBinary, nullable=False)
+
 
 class Workout(Base):
     __tablename__ = "workout"
 
     workout_id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(50), nullable=False)
-    user_id = Column(Integer, ForeignKey("user.user_id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("user.user_id"), nullable=False, index=True)
     is_private = Column(Boolean, nullable=False, default=True)
+    # moved by every write to the workout, its dates or its exercises
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     user = relationship("User", back_populates="workouts")
     exercises = relationship("Exercise", back_populates="workout")
@@ -98,7 +139,7 @@ class ExerciseTag(Base):
     __tablename__ = "exercise_tag"
 
     exercise_id = Column(Integer, ForeignKey("exercise.exercise_id"), primary_key=True)
-    tag_id = Column(Integer, ForeignKey("tag.tag_id"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tag.tag_id"), primary_key=True, index=True)
 
 
 class Exercise(Base):
@@ -114,12 +155,45 @@ class Exercise(Base):
     duration = Column(Integer, nullable=False)
     weight = Column(Float)
     rpe = Column(Integer)
-    workout_id = Column(Integer, ForeignKey("workout.workout_id"), nullable=True)
+    workout_id = Column(
+        Integer, ForeignKey("workout.workout_id"), nullable=True, index=True
+    )
+    # maintained by the rating writers in db_functions, never by hand
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Float, nullable=False, default=0, server_default="0")
+    rating_mean = Column(Float)
 
     workout = relationship("Workout", back_populates="exercises")
     tags = relationship("Tag", secondary="exercise_tag")
     ratings = relationship("Rating", back_populates="exercise")
 
+    __table_args__ = (
+        Index("ix_exercise_rating_mean_exercise_id", "rating_mean", "exercise_id"),
+        # also serves lookups by user_id alone
+        Index("ix_exercise_user_id_name_weight", "user_id", "name", "weight"),
+    )
+
+
+# Best repetitions per user, exercise name and weight; exercises logged without a
+# weight are recorded at 0. Written by the exercise writers in db_functions.
+class PersonalRecord(Base):
+    __tablename__ = "personal_record"
+
+    user_id = Column(Integer, ForeignKey("user.user_id"), primary_key=True)
+    exercise_name = Column(String(50), primary_key=True)
+    weight = Column(Float, primary_key=True)
+    repetition = Column(Integer, nullable=False)
+    exercise_id = Column(Integer, ForeignKey("exercise.exercise_id"), nullable=False)
+
+
+class ExerciseSimilarity(Base):
+    __tablename__ = "exercise_similarity"
+
+    exercise_id = Column(Integer, ForeignKey("exercise.exercise_id"), primary_key=True)
+    # the top neighbours, best first: packed little-endian int32 ids and float32 scores
+    neighbour_ids = Column(LargeBinary, nullable=False)
+    scores = Column(LargeBinary, nullable=False)
+
 
 class Rating(Base):
     __tablename__ = "rating"
@@ -127,14 +201,62 @@ class Rating(Base):
     rating_id = Column(Integer, primary_key=True, autoincrement=True)
     rating = Column(Float, nullable=False)
     user_id = Column(Integer, ForeignKey("user.user_id"), nullable=False)
-    exercise_id = Column(Integer, ForeignKey("exercise.exercise_id"), nullable=False)
+    exercise_id = Column(
+        Integer, ForeignKey("exercise.exercise_id"), nullable=False, index=True
+    )
 
     exercise = relationship("Exercise", back_populates="ratings")
 
 
+# What each user has to sync: one row per user and synced entity holding its latest
+# change, re-inserted under a new seq by every write to it (see record_changes in
+# db_functions), so a sync since a seq reads only the entities changed after it.
+# Deleted entities keep their row as a tombstone.
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    kind = Column(String(20), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    deleted = Column(Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        Index("ix_change_log_user_id_seq", "user_id", "seq"),
+        UniqueConstraint("kind", "entity_id", "user_id", name="uq_change_log_entity"),
+        # a seq is never handed out twice, even after the newest row was replaced
+        {"sqlite_autoincrement": True},
+    )
+
+
 class Lang(Base):
     __tablename__ = "lang"
 
     lang_id = Column(Integer, primary_key=True, autoincrement=True)
+    # translations written before lang_bundle existed; new ones go to bundles
     ru_RU = Column(JSON)
-    tr_TR = Column(JSON)
\ No newline at end of file
+    tr_TR = Column(JSON)
+
+    bundles = relationship(
+        "LangBundle", cascade="all, delete-orphan", lazy="selectin", order_by="LangBundle.locale"
+    )
+
+    @property
+    def locales(self) -> dict:
+        """the translations of this row by locale code"""
+        locales = {
+            locale: messages
+            for locale, messages in (("ru_RU", self.ru_RU), ("tr_TR", self.tr_TR))
+            if messages is not None
+        }
+        locales.update((bundle.locale, bundle.messages) for bundle in self.bundles)
+        return locales
+
+
+# One row per locale of a Lang, so adding a locale is a row rather than a column.
+class LangBundle(Base):
+    __tablename__ = "lang_bundle"
+
+    lang_id = Column(Integer, ForeignKey("lang.lang_id"), primary_key=True)
+    locale = Column(String(35), primary_key=True)
+    messages = Column(JSON, nullable=False)
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+connection pool telemetry
+
+The instrumented pool classes time every checkout (including the wait for a free
+connection) and the pool events keep counters of connects, checkouts, overflow
+connections and invalidations. ``snapshot`` combines those with the live pool
+state so pool sizes can be checked against the database's max_connections.
+"""
+import threading
+import time
+
+import sqlalchemy as sa
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# upper bounds in milliseconds, the last bucket catches everything slower
+CHECKOUT_WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, float("inf"))
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": {
+                ("+Inf" if bound == float("inf") else str(bound)): count
+                for bound, count in zip(self.buckets, self.counts)
+            },
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+        }
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkout_wait_ms = Histogram(CHECKOUT_WAIT_BUCKETS_MS)
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.overflow_connects = 0
+        self.peak_overflow = 0
+        self.invalidations = 0
+        self.timeouts = 0
+
+    def observe_checkout_wait(self, seconds: float):
+        with self._lock:
+            self.checkout_wait_ms.observe(seconds * 1000)
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self, pool: sa.pool.Pool) -> dict:
+        with self._lock:
+            data = {
+                "pool_class": type(pool).__name__,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "overflow_connects": self.overflow_connects,
+                "peak_overflow": self.peak_overflow,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "checkout_wait_ms": self.checkout_wait_ms.to_dict(),
+            }
+        if isinstance(pool, QueuePool):
+            data.update(
+                pool_size=pool.size(),
+                in_use=pool.checkedout(),
+                idle=pool.checkedin(),
+                overflow=max(pool.overflow(), 0),
+            )
+        return data
+
+
+class _TimedCheckoutMixin:
+    metrics: PoolMetrics | None = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.increment("timeouts")
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe_checkout_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class InstrumentedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_engine(engine: sa.engine.Engine) -> PoolMetrics:
+    """
+    attaches a PoolMetrics to the engine's pool and registers the pool events
+    """
+    metrics = PoolMetrics()
+    engine.pool.metrics = metrics
+
+    @sa.event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.increment("connects")
+        overflow = getattr(engine.pool, "overflow", lambda: 0)()
+        if overflow > 0:
+            metrics.increment("overflow_connects")
+            with metrics._lock:
+                metrics.peak_overflow = max(metrics.peak_overflow, overflow)
+
+    @sa.event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.increment("checkouts")
+
+    @sa.event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        metrics.increment("checkins")
+
+    @sa.event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.increment("invalidations")
+
+    return metrics
@@ -0,0 +1,334 @@
+"""
+read-through cache of serialized responses
+
+The public entity reads (/exercise/{id}, /workout/{id}, /tag/{id}/, /tags/ and
+/statuses/) keep the JSON bytes they produced under a key naming the entity and
+the ?expand= tree, or the list and the page, so a hit skips both the query and the
+Pydantic serialization. Entries live for ``response_cache_ttl_seconds`` at most.
+
+The db_functions writers name the entities a write changes with
+``forget_on_commit``; the keys are dropped once the transaction commits, every
+?expand= variant of an entity at once. Pages of a list cannot be named one by one,
+so list keys carry a generation token of the list that a write replaces, which
+orphans all of its pages. A write also moves the guard of each entity it forgets,
+and a body built on a miss is only kept if the guard it read before building is
+unchanged after the store, so a read racing a write never leaves stale bytes.
+
+Two backends store the bytes: ``LocalCacheBackend``, an LRU per worker bounded by
+entries and bytes (other workers' writes show up after the TTL), and
+``SharedCacheBackend`` on a Redis compatible client, where invalidations reach
+every worker. ``MemoryClient`` stands in for that client in a single process.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import combinations
+
+import sqlalchemy as sa
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
+
+from fitness_api.settings import SETTINGS
+
+_PENDING = "response_cache_forget"
+
+
+class LocalCacheBackend:
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float | None = None, only_if_missing: bool = False):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time.monotonic() + ttl if ttl is not None else float("inf")
+        with self._lock:
+            if key in self._entries:
+                if only_if_missing:
+                    return
+                self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        return {"backend": "local", "entries": len(self._entries), "bytes": self._bytes}
+
+
+class SharedCacheBackend:
+    """
+    a cache shared by all workers on a client with the get/set/delete interface of
+    redis-py; keys are prefixed so several deployments can share a server
+    """
+
+    def __init__(self, client, prefix: str = "fitness_api:response:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float | None = None, only_if_missing: bool = False):
+        self.client.set(
+            self.prefix + key, value, ex=None if ttl is None else max(int(ttl), 1), nx=only_if_missing
+        )
+
+    def delete(self, keys):
+        keys = [self.prefix + key for key in keys]
+        if keys:
+            # one round trip for every key of a write
+            self.client.delete(*keys)
+
+    def clear(self):
+        self.client.flushdb()
+
+    def stats(self) -> dict:
+        # entries and bytes are the server's, shared by every worker
+        return {"backend": "shared", "entries": None, "bytes": None}
+
+
+class MemoryClient:
+    """the part of a redis-py client SharedCacheBackend uses, kept in this process"""
+
+    def __init__(self):
+        self._values: dict[str, tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> bytes | None:
+        with self._lock:
+            value, expires_at = self._values.get(name, (None, 0.0))
+            if value is not None and expires_at <= time.monotonic():
+                del self._values[name]
+                return None
+            return value
+
+    def set(self, name: str, value: bytes, ex: int | None = None, nx: bool = False):
+        with self._lock:
+            if nx and name in self._values and self._values[name][1] > time.monotonic():
+                return None
+            self._values[name] = (value, time.monotonic() + ex if ex is not None else float("inf"))
+            return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(self._values.pop(name, None) is not None for name in names)
+
+    def flushdb(self):
+        with self._lock:
+            self._values.clear()
+
+
+def expand_key(tree: dict) -> str:
+    """every path of an expand tree, sorted, so equal trees give equal keys"""
+    paths = []
+
+    def walk(node: dict, prefix: str):
+        for name, subtree in node.items():
+            paths.append(prefix + name)
+            walk(subtree, f"{prefix}{name}.")
+
+    walk(tree, "")
+    return ",".join(sorted(paths))
+
+
+@lru_cache(maxsize=None)
+def expand_keys(allowed: tuple[str, ...]) -> list[str]:
+    """the expand_key of every tree the allowed paths can make"""
+    keys = set()
+    for size in range(len(allowed) + 1):
+        for paths in combinations(allowed, size):
+            # expanding a.b expands a too
+            closed = {
+                ".".join(path.split(".")[: depth + 1])
+                for path in paths
+                for depth in range(path.count(".") + 1)
+            }
+            keys.add(",".join(sorted(closed)))
+    return sorted(keys)
+
+
+def entity_key(kind: str, entity_id: int, tree: dict | None = None) -> str:
+    return f"{kind}:{entity_id}:{expand_key(tree or {})}"
+
+
+def guard_key(key: str) -> str:
+    """the guard shared by every ?expand= variant of the entity an entity key names"""
+    return "guard:" + key.rsplit(":", 1)[0]
+
+
+def entity_keys(kind: str, entity_ids, allowed: tuple[str, ...] = ()) -> list[str]:
+    variants = expand_keys(allowed)
+    return [f"{kind}:{entity_id}:{variant}" for entity_id in set(entity_ids) for variant in variants]
+
+
+@lru_cache(maxsize=None)
+def _adapter(model) -> TypeAdapter:
+    return TypeAdapter(model)
+
+
+def to_json(model, data, exclude_unset: bool = False) -> bytes:
+    """the response body FastAPI would render for ``data`` as ``model``"""
+    adapter = _adapter(model)
+    return adapter.dump_json(adapter.validate_python(data, from_attributes=True), exclude_unset=exclude_unset)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl_seconds: float):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.raced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def get(self, key: str) -> bytes | None:
+        if self.backend is None:
+            return None
+        body = self.backend.get(key)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_served += len(body)
+        return body
+
+    def guard(self, key: str) -> bytes | None:
+        """read before building the body of a missed ``key``, then handed to ``put``"""
+        if self.backend is None:
+            return None
+        return self.backend.get(guard_key(key))
+
+    def put(self, key: str, body: bytes, guard: bytes | None):
+        if self.backend is None:
+            return
+        self.backend.set(key, body, self.ttl_seconds)
+        # a write committed since the guard was read may have forgotten the key before
+        # this set, so the body can be older than it: drop it. A write forgetting the
+        # key after the set deletes it itself.
+        if self.backend.get(guard_key(key)) != guard:
+            self.backend.delete([key])
+            with self._lock:
+                self.raced += 1
+
+    def list_key(self, kind: str, *params) -> str:
+        """the key of one page of a list, valid until the list's next write"""
+        if self.backend is None:
+            return ""
+        generation_key = f"generation:{kind}"
+        generation = self.backend.get(generation_key)
+        if generation is None:
+            # a fresh token rather than a counter, so a generation lost to eviction
+            # can never bring back pages written under an earlier one
+            self.backend.set(generation_key, os.urandom(8).hex().encode(), only_if_missing=True)
+            generation = self.backend.get(generation_key) or b""
+        return f"{kind}:{generation.decode()}:" + ":".join(str(param) for param in params)
+
+    def forget(self, keys=(), lists=()):
+        if self.backend is None:
+            return
+        keys = list(keys)
+        # guards first, so a racing put either sees the new guard or is deleted below
+        for guard in {guard_key(key) for key in keys}:
+            self.backend.set(guard, os.urandom(8).hex().encode(), self.ttl_seconds)
+        self.backend.delete(keys)
+        for kind in lists:
+            self.backend.set(f"generation:{kind}", os.urandom(8).hex().encode())
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = self.bytes_served = self.raced = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            **(self.backend.stats() if self.backend is not None else {"backend": None}),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "bytes_served": self.bytes_served,
+            "raced": self.raced,
+        }
+
+
+def forget_on_commit(db: Session, keys=(), lists=()):
+    """
+    drops ``keys`` and replaces the generation of ``lists`` once the transaction
+    of ``db`` commits; a rollback forgets nothing
+    """
+    pending_keys, pending_lists = db.info.setdefault(_PENDING, (set(), set()))
+    pending_keys.update(keys)
+    pending_lists.update(lists)
+
+
+@sa.event.listens_for(Session, "after_commit")
+def _forget_committed(session):
+    keys, lists = session.info.pop(_PENDING, ((), ()))
+    if keys or lists:
+        response_cache.forget(keys, lists)
+
+
+@sa.event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING, None)
+
+
+def make_backend(name: str):
+    if name == "none":
+        return None
+    if name == "local":
+        return LocalCacheBackend(SETTINGS.response_cache_max_entries, SETTINGS.response_cache_max_bytes)
+    if name == "shared":
+        if SETTINGS.response_cache_url is None:
+            raise ValueError("FITNESS_API_RESPONSE_CACHE_URL is required for the shared response cache")
+        # only needed for the shared backend
+        import redis
+
+        return SharedCacheBackend(redis.Redis.from_url(SETTINGS.response_cache_url))
+    raise ValueError(f"Unknown response cache backend: {name}")
+
+
+response_cache = ResponseCache(
+    make_backend(SETTINGS.response_cache_backend), ttl_seconds=SETTINGS.response_cache_ttl_seconds
+)
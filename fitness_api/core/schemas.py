@@ -1,7 +1,22 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, model_validator
+from typing import Generic, Optional, List, TypeVar
 from enum import Enum
 from datetime import date
+import re
+
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+
+class Batch(BaseModel, Generic[T]):
+    items: List[T]
+    # the requested ids without a row, in the order they were asked for
+    missing: List[int] = []
 
 
 class GenderEnum(str, Enum):
@@ -20,6 +35,20 @@ class StatusEnum(str, Enum):
     ACCEPTED = "ACCEPTED"
 
 
+class ChangeKind(str, Enum):
+    WORKOUT = "workout"
+    WORKOUT_DATE = "workout_date"
+    EXERCISE = "exercise"
+    RATING = "rating"
+    FRIENDSHIP = "friendship"
+
+
+class VolumePeriod(str, Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+
 class Token(BaseModel):
     access_token: str
     token_type: Optional[str]
@@ -103,11 +132,19 @@ class ExerciseUpdate(ExerciseBase):
 class ExerciseRead(ExerciseBase):
     exercise_id: int
     tags: List[Tag] = []
+    rating_count: int = 0
+    rating_sum: float = 0
+    rating_mean: Optional[float] = None
 
     class Config:
         from_attributes = True
 
 
+class SimilarExercise(BaseModel):
+    similarity: float
+    exercise: ExerciseRead
+
+
 class WorkoutDateBase(BaseModel):
     date: date
     completed: bool
@@ -138,6 +175,27 @@ class WorkoutCreate(WorkoutBase):
     dates: Optional[List[WorkoutDateBase]]
 
 
+class WorkoutBulkItem(WorkoutBase):
+    dates: List[WorkoutDateBase] = []
+    exercises: List[ExerciseCreate] = []
+
+
+class WorkoutBulkCreated(BaseModel):
+    index: int
+    workout_id: int
+    exercise_ids: List[int]
+
+
+class WorkoutBulkError(BaseModel):
+    index: int
+    detail: str
+
+
+class WorkoutBulkResult(BaseModel):
+    created: List[WorkoutBulkCreated]
+    errors: List[WorkoutBulkError]
+
+
 class WorkoutUpdate(BaseModel):
     name: Optional[str]
     user_id: Optional[int]
@@ -145,8 +203,8 @@ class WorkoutUpdate(BaseModel):
 
 class Workout(WorkoutBase):
     workout_id: int
-    exercises: Optional[List["ExerciseRead"]]
-    dates: Optional[List[WorkoutDate]]
+    exercises: Optional[List["ExerciseRead"]] = None
+    dates: Optional[List[WorkoutDate]] = None
 
     class Config:
         from_attributes = True
@@ -168,12 +226,57 @@ class UserBase(BaseModel):
 
 class User(UserBase):
     user_id: int
-    workouts: Optional[List["Workout"]]
+    workouts: Optional[List["Workout"]] = None
+
+    class Config:
+        from_attributes = True
+
+
+class UserProfile(UserBase):
+    user_id: int
+
+    class Config:
+        from_attributes = True
+
+
+class AdherenceStats(BaseModel):
+    current_streak: int
+    longest_streak: int
+    week_start: date
+    scheduled_this_week: int
+    completed_this_week: int
+    weekly_completion_rate: Optional[float]
+
+
+class VolumeBucket(BaseModel):
+    start: date
+    sessions: int
+    tonnage: float
+    total_time: float
+    rpe_load: float
+
+
+class VolumeStats(BaseModel):
+    period: VolumePeriod
+    buckets: List[VolumeBucket]
+
+
+class RepRecord(BaseModel):
+    weight: float
+    repetition: int
+    exercise_id: int
 
     class Config:
         from_attributes = True
 
 
+class PersonalRecords(BaseModel):
+    exercise_name: str
+    best_weight: float
+    estimated_1rm: float
+    reps_by_weight: List[RepRecord]
+
+
 class UserCreate(BaseModel):
     name: str
     email: str
@@ -226,18 +329,124 @@ class FriendshipInDB(FriendshipBase):
         from_attributes = True
 
 
+class Friend(BaseModel):
+    friendship_id: int
+    status: StatusEnum
+    friend: UserProfile
+
+    class Config:
+        from_attributes = True
+
+
+class FriendSuggestion(BaseModel):
+    user: UserProfile
+    mutual_friends: int
+
+    class Config:
+        from_attributes = True
+
+
+class MutualFriends(BaseModel):
+    user_id: int
+    other_user_id: int
+    count: int
+
+
+# ru_RU, tr_TR, en, zh_Hant_TW, pt-BR ...
+LOCALE_CODE = re.compile(r"[a-z]{2,3}(?:[_-][A-Za-z0-9]{2,8}){0,3}")
+
+
+def check_locales(locales: dict, nullable: bool):
+    for locale, messages in locales.items():
+        if len(locale) > 35 or not LOCALE_CODE.fullmatch(locale):
+            raise ValueError(f"Invalid locale code: {locale}")
+        if not isinstance(messages, dict) and not (nullable and messages is None):
+            raise ValueError(f"Translations of {locale} must be an object")
+
+
 class LangCreate(BaseModel):
-    ru_RU: dict
-    tr_TR: dict
+    """
+    translations by locale code, e.g. {"ru_RU": {...}, "tr_TR": {...}}; any locale
+    code is accepted as a field
+    """
+
+    class Config:
+        extra = "allow"
+
+    @model_validator(mode="after")
+    def check_locales(self):
+        if not self.model_extra:
+            raise ValueError("At least one locale is required")
+        check_locales(self.model_extra, nullable=False)
+        return self
+
+    def locales(self) -> dict:
+        return dict(self.model_extra)
+
 
+class LangUpdate(LangCreate):
+    """replaces the translations of the locales given, null leaves one unchanged"""
 
-class LangUpdate(BaseModel):
-    ru_RU: Optional[dict] = None
-    tr_TR: Optional[dict] = None
+    @model_validator(mode="after")
+    def check_locales(self):
+        check_locales(self.model_extra, nullable=True)
+        return self
 
+    def locales(self) -> dict:
+        return {locale: messages for locale, messages in self.model_extra.items() if messages is not None}
 
-class LangRead(LangCreate):
+
+class LangRead(BaseModel):
     lang_id: int
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        extra = "allow"
+        from_attributes = True
+
+    @model_validator(mode="before")
+    @classmethod
+    def from_lang(cls, data):
+        # a models.Lang keeps its locales in columns and lang_bundle rows
+        if hasattr(data, "locales"):
+            return {"lang_id": data.lang_id, **data.locales}
+        return data
+
+
+class LangCatalog(BaseModel):
+    version: str
+    locales: dict[str, str]
+
+
+class Translation(BaseModel):
+    locale: str
+    key: str
+    value: object
+
+
+class SyncWorkout(WorkoutBase):
+    workout_id: int
+    version: int
+
+    class Config:
+        from_attributes = True
+
+
+class SyncWorkoutDate(WorkoutDate):
+    workout_id: int
+
+
+class Tombstone(BaseModel):
+    kind: ChangeKind
+    id: int
+
+
+class SyncChanges(BaseModel):
+    workouts: List[SyncWorkout] = []
+    workout_dates: List[SyncWorkoutDate] = []
+    exercises: List[ExerciseRead] = []
+    ratings: List[Rating] = []
+    friendships: List[FriendshipInDB] = []
+    deleted: List[Tombstone] = []
+    # pass as ?since= next time, unchanged when nothing changed
+    next_cursor: str
+    has_more: bool = False
@@ -0,0 +1,191 @@
+"""
+full-text exercise search
+
+Every exercise has a search document made of its name, description and tag names.
+On SQLite the documents live in an FTS5 table whose rowid is the exercise id; on
+Postgres in a table with a weighted tsvector column generated from the same text
+and a GIN index on it. The table is created alongside the ORM tables by
+``create_all`` and filled from the existing exercises when it is new. After that,
+the exercise and tag writers in db_functions keep it current: new exercises
+insert their document from the data they were created with, and writes to existing
+exercises or tags rewrite the affected documents through ``index_exercises``.
+
+Scores are normalized so that a lower score is a better match on both databases,
+which lets a page of results continue after the (score, exercise_id) of the last
+row of the previous one.
+"""
+import re
+from collections import defaultdict
+
+import sqlalchemy as sa
+
+from . import database, models
+
+TABLE_NAME = "exercise_search"
+
+# relative importance of a term found in the name, the tags or the description
+NAME_WEIGHT = 10.0
+TAGS_WEIGHT = 5.0
+DESCRIPTION_WEIGHT = 1.0
+
+_TERM = re.compile(r"\w+")
+
+
+def search_terms(query: str) -> list[str]:
+    """
+    the words of a user query; every word has to match, the last one as a prefix
+    so results show up while the user is still typing
+    """
+    return _TERM.findall(query.lower())
+
+
+class SqliteSearchIndex:
+    table = sa.table(
+        TABLE_NAME,
+        sa.column("rowid", sa.Integer),
+        sa.column("name", sa.String),
+        sa.column("description", sa.String),
+        sa.column("tags", sa.String),
+    )
+    id_column = table.c.rowid
+
+    def create(self, connection):
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE {TABLE_NAME} USING fts5("
+            "name, description, tags, prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    def match(self, terms: list[str]):
+        expression = " ".join(f'"{term}"' for term in terms[:-1])
+        expression = f'{expression} "{terms[-1]}"*'.strip()
+        return sa.literal_column(TABLE_NAME).op("MATCH")(expression)
+
+    def score(self, terms: list[str]):
+        # bm25 is already negative, the best match lowest; weights follow column order
+        return sa.func.bm25(
+            sa.literal_column(TABLE_NAME), NAME_WEIGHT, DESCRIPTION_WEIGHT, TAGS_WEIGHT
+        )
+
+    def row(self, document: dict) -> dict:
+        row = dict(document)
+        row["rowid"] = row.pop("exercise_id")
+        return row
+
+
+class PostgresSearchIndex:
+    table = sa.table(
+        TABLE_NAME,
+        sa.column("exercise_id", sa.Integer),
+        sa.column("name", sa.String),
+        sa.column("description", sa.String),
+        sa.column("tags", sa.String),
+        sa.column("document"),
+    )
+    id_column = table.c.exercise_id
+
+    def create(self, connection):
+        connection.exec_driver_sql(
+            f"CREATE TABLE {TABLE_NAME} ("
+            "exercise_id INTEGER PRIMARY KEY, name TEXT NOT NULL, "
+            "description TEXT NOT NULL DEFAULT '', tags TEXT NOT NULL DEFAULT '', "
+            "document tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', name), 'A') || "
+            "setweight(to_tsvector('simple', tags), 'B') || "
+            "setweight(to_tsvector('simple', description), 'D')) STORED)"
+        )
+        connection.exec_driver_sql(
+            f"CREATE INDEX ix_{TABLE_NAME}_document ON {TABLE_NAME} USING GIN (document)"
+        )
+
+    def _query(self, terms: list[str]):
+        # the same rule as the FTS5 expression: only the last term is a prefix
+        return sa.func.to_tsquery("simple", " & ".join(terms[:-1] + [f"{terms[-1]}:*"]))
+
+    def match(self, terms: list[str]):
+        return self.table.c.document.op("@@")(self._query(terms))
+
+    def score(self, terms: list[str]):
+        # ts_rank takes a real[] of weights for D, C, B, A (C is not used)
+        weights = sa.literal(
+            [DESCRIPTION_WEIGHT / NAME_WEIGHT, 0.0, TAGS_WEIGHT / NAME_WEIGHT, 1.0],
+            sa.ARRAY(sa.REAL),
+        )
+        return -sa.func.ts_rank(weights, self.table.c.document, self._query(terms))
+
+    def row(self, document: dict) -> dict:
+        return document
+
+
+SEARCH_INDEXES = {
+    "sqlite": SqliteSearchIndex(),
+    "postgresql": PostgresSearchIndex(),
+}
+
+
+def search_index(dialect_name: str):
+    index = SEARCH_INDEXES.get(dialect_name)
+    if index is None:
+        raise ValueError(f"No full-text search index for {dialect_name}")
+    return index
+
+
+def search_documents(bind, exercise_ids=None) -> list[dict]:
+    """
+    the search documents of the given exercises (all of them for None), built with
+    one query for the exercises and one for their tag names
+    """
+    exercises = sa.select(
+        models.Exercise.exercise_id, models.Exercise.name, models.Exercise.description
+    )
+    tags = sa.select(models.ExerciseTag.exercise_id, models.Tag.name).join(
+        models.Tag, models.Tag.tag_id == models.ExerciseTag.tag_id
+    )
+    if exercise_ids is not None:
+        exercises = exercises.where(models.Exercise.exercise_id.in_(exercise_ids))
+        tags = tags.where(models.ExerciseTag.exercise_id.in_(exercise_ids))
+    tag_names = defaultdict(list)
+    for exercise_id, name in bind.execute(tags):
+        tag_names[exercise_id].append(name)
+    return [
+        search_document(exercise_id, name, description, tag_names[exercise_id])
+        for exercise_id, name, description in bind.execute(exercises)
+    ]
+
+
+def search_document(exercise_id: int, name: str, description: str | None, tag_names) -> dict:
+    return {
+        "exercise_id": exercise_id,
+        "name": name,
+        "description": description or "",
+        "tags": " ".join(sorted(set(tag_names))),
+    }
+
+
+def insert_documents(bind, index, documents: list[dict]):
+    if documents:
+        bind.execute(sa.insert(index.table), [index.row(document) for document in documents])
+
+
+def write_documents(bind, index, exercise_ids=None):
+    """
+    replaces the documents of the given exercises from the database; deleted
+    exercises just lose theirs. None writes every exercise into an empty index.
+    """
+    if exercise_ids is not None:
+        bind.execute(sa.delete(index.table).where(index.id_column.in_(exercise_ids)))
+    insert_documents(bind, index, search_documents(bind, exercise_ids))
+
+
+@sa.event.listens_for(database.Base.metadata, "after_create")
+def create_search_index(target, connection, **kw):
+    # existing databases get the index, filled from their exercises, on the next create_all
+    if sa.inspect(connection).has_table(TABLE_NAME):
+        return
+    index = search_index(connection.dialect.name)
+    index.create(connection)
+    write_documents(connection, index)
+
+
+@sa.event.listens_for(database.Base.metadata, "before_drop")
+def drop_search_index(target, connection, **kw):
+    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {TABLE_NAME}")
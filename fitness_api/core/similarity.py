@@ -0,0 +1,303 @@
+"""
+similar exercises from shared tags
+
+Two exercises are similar when they share tags: the cosine of their binary tag
+vectors, |A & B| / sqrt(|A| |B|), times a smoothed mean rating of the candidate
+relative to PRIOR_RATING, so the better rated of two equally similar exercises
+ranks first. The shared-tag counts are the matrix product X Xᵀ of the sparse
+exercise x tag matrix, computed with NumPy a block of exercises at a time over
+just the tags of the block and a chunk of the exercises at a time, keeping the top
+neighbours of each chunk with argpartition.
+
+The top ``similar_exercises_k`` neighbours of every exercise are stored packed in
+exercise_similarity, so serving them is a primary key read. A background thread in
+every worker recomputes the rows of exercises whose tags were written (the writers
+in db_functions mark them) every ``similarity_refresh_seconds`` and all rows every
+``similarity_rebuild_seconds``, which also picks up the exercises that now belong
+in the neighbour lists of others. A worker starting on a filled table waits for
+its first rebuild instead of repeating the one another worker just did.
+"""
+import random
+import threading
+import time
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from fitness_api.settings import SETTINGS
+
+from . import database, models
+from .logging import logger
+
+# ratings are smoothed towards PRIOR_RATING as if every exercise had PRIOR_COUNT
+# extra ratings of it, so a single 5 does not outrank a hundred 4.5s
+PRIOR_RATING = 3.0
+PRIOR_COUNT = 5
+# bound on the cells of each dense matrix of the products
+MAX_BLOCK_CELLS = 4_000_000
+
+NEIGHBOUR_DTYPE = np.dtype("<i4")
+SCORE_DTYPE = np.dtype("<f4")
+
+
+def rating_weights(rating_sums: np.ndarray, rating_counts: np.ndarray) -> np.ndarray:
+    return (rating_sums + PRIOR_RATING * PRIOR_COUNT) / (rating_counts + PRIOR_COUNT) / PRIOR_RATING
+
+
+def best_of(candidates: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    the ``k`` best candidates of every row by score, the lower candidate first among
+    equal scores, so the result does not depend on how the candidates were chunked
+    """
+    if scores.shape[1] <= k:
+        return candidates, scores
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    cut = np.take_along_axis(scores, top, axis=1).min(axis=1)
+    # argpartition splits ties at the cut arbitrarily; zero scores are dropped anyway
+    for i in np.flatnonzero((cut > 0) & ((scores >= cut[:, None]).sum(axis=1) > k)):
+        tied = np.flatnonzero(scores[i] >= cut[i])
+        top[i] = tied[np.lexsort((candidates[i, tied], -scores[i, tied]))[:k]]
+    return np.take_along_axis(candidates, top, axis=1), np.take_along_axis(scores, top, axis=1)
+
+
+def top_neighbours(
+    pair_exercises: np.ndarray,
+    pair_tags: np.ndarray,
+    weights: dict[int, float],
+    targets: np.ndarray,
+    k: int,
+):
+    """
+    yields (exercise_id, neighbour ids, scores) with the best ``k`` neighbours of
+    every target that has tags, from the (exercise_id, tag_id) pairs of the targets
+    and of every exercise sharing a tag with them. Exercises missing from
+    ``weights`` (the rating weight per exercise id) weigh 1.
+    """
+    exercises, exercise_rows = np.unique(pair_exercises, return_inverse=True)
+    tags, tag_columns = np.unique(pair_tags, return_inverse=True)
+    degrees = np.bincount(exercise_rows, minlength=len(exercises)).astype(np.float32)
+    weight = np.array(
+        [weights.get(exercise_id, 1.0) for exercise_id in exercises.tolist()], dtype=np.float32
+    )
+    # the exercise x tag matrix as CSR: the tag columns of every exercise row
+    order = np.argsort(exercise_rows, kind="stable")
+    row_starts = np.searchsorted(exercise_rows[order], np.arange(len(exercises) + 1))
+    row_tags = tag_columns[order]
+    # and by tag: the exercise rows of every tag column, in row order
+    order = np.lexsort((exercise_rows, tag_columns))
+    column_starts = np.searchsorted(tag_columns[order], np.arange(len(tags) + 1))
+    column_rows = exercise_rows[order]
+
+    rows = np.searchsorted(exercises, targets)
+    rows = rows[(rows < len(exercises)) & (exercises[np.minimum(rows, len(exercises) - 1)] == targets)]
+    block_size = max(1, MAX_BLOCK_CELLS // max(len(exercises), 1))
+    for block_start in range(0, len(rows), block_size):
+        block = rows[block_start:block_start + block_size]
+        # only the tags of the block's exercises can be shared, so the product is
+        # X[block, block_tags] @ X[chunk, block_tags].T, over chunks of the exercises
+        # small enough for both dense sides to stay within MAX_BLOCK_CELLS
+        block_tags = np.unique(
+            np.concatenate([row_tags[row_starts[r]:row_starts[r + 1]] for r in block])
+        )
+        left = np.zeros((len(block), len(block_tags)), dtype=np.float32)
+        for i, r in enumerate(block):
+            left[i, np.searchsorted(block_tags, row_tags[row_starts[r]:row_starts[r + 1]])] = 1
+        chunk_size = max(1, MAX_BLOCK_CELLS // max(len(block_tags), len(block)))
+        # the best k candidates so far of every row of the block, as exercise rows
+        best = best_scores = None
+        for chunk_start in range(0, len(exercises), chunk_size):
+            chunk_end = min(chunk_start + chunk_size, len(exercises))
+            right = np.zeros((len(block_tags), chunk_end - chunk_start), dtype=np.float32)
+            for j, tag in enumerate(block_tags):
+                tag_rows = column_rows[column_starts[tag]:column_starts[tag + 1]]
+                lo, hi = np.searchsorted(tag_rows, [chunk_start, chunk_end])
+                right[j, tag_rows[lo:hi] - chunk_start] = 1
+            shared = left @ right
+
+            own = (block >= chunk_start) & (block < chunk_end)
+            shared[np.flatnonzero(own), block[own] - chunk_start] = 0
+            columns = slice(chunk_start, chunk_end)
+            # exercises sharing no tag score 0 and are dropped below
+            scores = shared / np.sqrt(np.outer(degrees[block], degrees[columns])) * weight[columns]
+            candidates = np.broadcast_to(np.arange(chunk_start, chunk_end), scores.shape)
+            if chunk_start:
+                candidates = np.concatenate([best, candidates], axis=1)
+                scores = np.concatenate([best_scores, scores], axis=1)
+            best, best_scores = best_of(candidates, scores, k)
+        for i, r in enumerate(block):
+            keep = best_scores[i] > 0
+            candidates, candidate_scores = best[i][keep], best_scores[i][keep]
+            ranked = np.lexsort((candidates, -candidate_scores))
+            yield int(exercises[r]), exercises[candidates[ranked]], candidate_scores[ranked]
+
+
+def pack(neighbours: np.ndarray, scores: np.ndarray) -> tuple[bytes, bytes]:
+    return neighbours.astype(NEIGHBOUR_DTYPE).tobytes(), scores.astype(SCORE_DTYPE).tobytes()
+
+
+def unpack(row: models.ExerciseSimilarity) -> tuple[np.ndarray, np.ndarray]:
+    return (
+        np.frombuffer(row.neighbour_ids, dtype=NEIGHBOUR_DTYPE),
+        np.frombuffer(row.scores, dtype=SCORE_DTYPE),
+    )
+
+
+def tag_pairs(db: Session, scope=None) -> tuple[np.ndarray, np.ndarray]:
+    # joined to tag so links left behind by deleted tags do not count
+    statement = sa.select(models.ExerciseTag.exercise_id, models.ExerciseTag.tag_id).join(
+        models.Tag, models.Tag.tag_id == models.ExerciseTag.tag_id
+    )
+    if scope is not None:
+        statement = statement.where(models.ExerciseTag.exercise_id.in_(scope))
+    pairs = np.array(db.execute(statement).all(), dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def compute_similarity(db: Session, exercise_ids=None) -> int:
+    """
+    recomputes the stored neighbours of the given exercises, or of all exercises
+    for None, and returns the number of rows written. Exercises left without
+    neighbours (no shared tags, or deleted) lose their row.
+    """
+    scope = None
+    if exercise_ids is not None:
+        targets = np.array(sorted(set(exercise_ids)), dtype=np.int64)
+        # only the exercises sharing a tag with the targets can be their neighbours
+        scope = sa.select(models.ExerciseTag.exercise_id).where(
+            models.ExerciseTag.tag_id.in_(
+                sa.select(models.ExerciseTag.tag_id).where(
+                    models.ExerciseTag.exercise_id.in_(targets.tolist())
+                )
+            )
+        )
+    pair_exercises, pair_tags = tag_pairs(db, scope)
+    if exercise_ids is None:
+        targets = np.unique(pair_exercises)
+
+    rated = sa.select(
+        models.Exercise.exercise_id, models.Exercise.rating_sum, models.Exercise.rating_count
+    ).where(models.Exercise.rating_count > 0)
+    if scope is not None:
+        rated = rated.where(models.Exercise.exercise_id.in_(scope))
+    rated = np.array(db.execute(rated).all(), dtype=np.float64).reshape(-1, 3)
+    weights = dict(
+        zip(
+            rated[:, 0].astype(np.int64).tolist(),
+            rating_weights(rated[:, 1], rated[:, 2]).tolist(),
+        )
+    )
+
+    rows = []
+    for exercise_id, neighbours, scores in top_neighbours(
+        pair_exercises, pair_tags, weights, targets, SETTINGS.similar_exercises_k
+    ):
+        if len(neighbours) == 0:
+            continue
+        neighbour_ids, packed_scores = pack(neighbours, scores)
+        rows.append({"exercise_id": exercise_id, "neighbour_ids": neighbour_ids, "scores": packed_scores})
+
+    delete = sa.delete(models.ExerciseSimilarity)
+    if exercise_ids is not None:
+        delete = delete.where(models.ExerciseSimilarity.exercise_id.in_(targets.tolist()))
+    db.execute(delete)
+    if rows:
+        db.execute(sa.insert(models.ExerciseSimilarity), rows)
+    return len(rows)
+
+
+class SimilarityRefresher:
+    def __init__(self, refresh_seconds: float, rebuild_seconds: float, build_on_startup: bool = True):
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        # off in the workers of the launcher, which builds the table once before forking
+        self.build_on_startup = build_on_startup
+        self._dirty: set[int] = set()
+        self._rebuilt_at: float | None = None
+        self._rebuild_due_at: float | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def mark_dirty(self, exercise_ids):
+        with self._lock:
+            self._dirty.update(exercise_ids)
+
+    def built(self) -> bool:
+        with database.SessionLocal() as db:
+            return db.scalar(sa.select(models.ExerciseSimilarity.exercise_id).limit(1)) is not None
+
+    def rebuild_due(self) -> bool:
+        if self._rebuild_due_at is None:
+            # only an empty table is built at startup, and only when no launcher built
+            # it already; otherwise this worker's first rebuild falls at a random point
+            # of the interval, so the workers of a deployment do not all rebuild at once
+            build_now = self.build_on_startup and not self.built()
+            delay = 0 if build_now else random.uniform(0, self.rebuild_seconds)
+            self._rebuild_due_at = time.monotonic() + delay
+        return time.monotonic() >= self._rebuild_due_at
+
+    def run_once(self, rebuild: bool | None = None) -> int:
+        """
+        recomputes the rows of the exercises marked since the last run, or all of
+        them when a rebuild is due
+        """
+        if rebuild is None:
+            rebuild = self.rebuild_due()
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not rebuild and not dirty:
+            return 0
+        with database.SessionLocal() as db:
+            try:
+                written = compute_similarity(db, None if rebuild else dirty)
+                db.commit()
+            except Exception as e:
+                logger.error(f"Error computing exercise similarity: {e}")
+                db.rollback()
+                self.mark_dirty(dirty)
+                raise e
+        if rebuild:
+            self._rebuilt_at = time.monotonic()
+            self._rebuild_due_at = self._rebuilt_at + self.rebuild_seconds
+        logger.debug(f"Computed similar exercises for {written} exercises")
+        return written
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                # logged by run_once, the marks are kept for the next round
+                pass
+            if self._stop.wait(self.refresh_seconds):
+                return
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="similarity-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "pending": len(self._dirty),
+            "seconds_since_rebuild": (
+                None if self._rebuilt_at is None else time.monotonic() - self._rebuilt_at
+            ),
+        }
+
+
+similarity_refresher = SimilarityRefresher(
+    refresh_seconds=SETTINGS.similarity_refresh_seconds,
+    rebuild_seconds=SETTINGS.similarity_rebuild_seconds,
+    build_on_startup=SETTINGS.similarity_build_on_startup,
+)
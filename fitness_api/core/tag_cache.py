@@ -0,0 +1,84 @@
+"""
+in-process tag name -> tag_id cache
+
+Tags are created far more often than they are renamed or deleted, so resolving a
+name to its id is served from memory once it has been seen. Ids a transaction
+looked up or inserted reach the cache through ``put_on_commit`` only once it
+commits, so a rollback never leaves behind the id of a tag that does not exist.
+update_tag and delete_tag drop the affected names; a stale id left by another
+worker surfaces as an IntegrityError, after which the writers clear the cache
+(and create_exercise retries).
+"""
+import threading
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from fitness_api.settings import SETTINGS
+
+_PENDING = "tag_cache_put"
+
+
+class TagCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._ids: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, names) -> dict[str, int]:
+        found = {}
+        with self._lock:
+            for name in names:
+                tag_id = self._ids.get(name)
+                if tag_id is not None:
+                    self._ids.move_to_end(name)
+                    found[name] = tag_id
+        return found
+
+    def put_many(self, tag_ids: dict[str, int]):
+        with self._lock:
+            self._ids.update(tag_ids)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def invalidate(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._ids.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+tag_cache = TagCache(max_entries=SETTINGS.tag_cache_max_entries)
+
+
+def put_on_commit(db: Session, tag_ids: dict[str, int]):
+    """
+    caches ``tag_ids`` once the transaction of ``db`` commits; a rollback forgets
+    them together with the tags the transaction inserted
+    """
+    db.info.setdefault(_PENDING, {}).update(tag_ids)
+
+
+def put_read(db: Session, tag_ids: dict[str, int]):
+    """
+    caches ``tag_ids`` read by ``db`` at once, except the ones its transaction is
+    already holding back for put_on_commit
+    """
+    pending = db.info.get(_PENDING, {})
+    tag_cache.put_many({name: tag_id for name, tag_id in tag_ids.items() if name not in pending})
+
+
+@sa.event.listens_for(Session, "after_commit")
+def _put_committed(session):
+    tag_ids = session.info.pop(_PENDING, None)
+    if tag_ids:
+        tag_cache.put_many(tag_ids)
+
+
+@sa.event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(_PENDING, None)
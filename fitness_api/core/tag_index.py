@@ -0,0 +1,298 @@
+"""
+in-process tag -> exercise bitmap index
+
+Every tag maps to a compressed bitmap of the ids of the exercises carrying it, next
+to one bitmap of all exercise ids. A tag filter such as "legs AND no-equipment AND
+NOT barbell" becomes a couple of bitmap intersections and differences, and only
+the page of exercises it selects is read from the database. Like the friend graph,
+the index is built with one query the first time it is needed, kept current by the
+exercise and tag writers in db_functions and rebuilt once it is older than
+``tag_index_reload_seconds`` so other workers' writes show up.
+"""
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from fitness_api.settings import SETTINGS
+
+from . import models
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_BYTES = CHUNK_SIZE // 8
+# a chunk with more ids than this is smaller as a 65536-bit bitmap (8 KiB) than as
+# an array of 16-bit values
+ARRAY_MAX = 4096
+
+
+def _flags(bits: int) -> np.ndarray:
+    return np.unpackbits(
+        np.frombuffer(bits.to_bytes(CHUNK_BYTES, "little"), dtype=np.uint8), bitorder="little"
+    ).view(bool)
+
+
+def _to_bits(container) -> int:
+    if isinstance(container, int):
+        return container
+    flags = np.zeros(CHUNK_SIZE, dtype=np.uint8)
+    flags[container] = 1
+    return int.from_bytes(np.packbits(flags, bitorder="little").tobytes(), "little")
+
+
+def _lows(container) -> np.ndarray:
+    if isinstance(container, int):
+        return np.flatnonzero(_flags(container)).astype(np.uint16)
+    return container
+
+
+def _container(lows):
+    """
+    the cheaper container for a chunk: a sorted uint16 array of the low halves
+    while sparse, an int bitmap once dense, None when empty
+    """
+    if isinstance(lows, int):
+        if lows.bit_count() > ARRAY_MAX:
+            return lows
+        lows = _lows(lows)
+    if len(lows) == 0:
+        return None
+    if len(lows) > ARRAY_MAX:
+        return _to_bits(lows)
+    return lows
+
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _container(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return _container(a[_flags(b)[a]])
+    return _container(np.intersect1d(a, b, assume_unique=True))
+
+
+def _or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        return _container(_to_bits(a) | _to_bits(b))
+    return _container(np.union1d(a, b))
+
+
+def _sub(a, b):
+    if isinstance(b, int):
+        if isinstance(a, int):
+            return _container(a & ~b)
+        return _container(a[~_flags(b)[a]])
+    if isinstance(a, int):
+        return _container(a & ~_to_bits(b))
+    return _container(np.setdiff1d(a, b, assume_unique=True))
+
+
+class ExerciseBitmap:
+    """
+    a set of exercise ids compressed in the style of roaring bitmaps: ids are split
+    into 65536-wide chunks by their high bits and each chunk keeps the low 16 bits
+    as an array or a bitmap, whichever is smaller. Instances are never modified,
+    the operators return new ones sharing the untouched chunks.
+    """
+
+    __slots__ = ("_chunks",)
+
+    def __init__(self, chunks: dict | None = None):
+        self._chunks = chunks or {}
+
+    @classmethod
+    def from_ids(cls, ids) -> "ExerciseBitmap":
+        ids = np.unique(np.fromiter(ids, dtype=np.int64))
+        highs, starts = np.unique(ids >> CHUNK_BITS, return_index=True)
+        lows = np.split((ids & (CHUNK_SIZE - 1)).astype(np.uint16), starts[1:])
+        return cls(
+            {int(high): _container(chunk) for high, chunk in zip(highs, lows)}
+        )
+
+    def __and__(self, other: "ExerciseBitmap") -> "ExerciseBitmap":
+        chunks = {}
+        for high in self._chunks.keys() & other._chunks.keys():
+            container = _and(self._chunks[high], other._chunks[high])
+            if container is not None:
+                chunks[high] = container
+        return ExerciseBitmap(chunks)
+
+    def __or__(self, other: "ExerciseBitmap") -> "ExerciseBitmap":
+        chunks = dict(self._chunks)
+        for high, container in other._chunks.items():
+            chunks[high] = _or(chunks[high], container) if high in chunks else container
+        return ExerciseBitmap(chunks)
+
+    def __sub__(self, other: "ExerciseBitmap") -> "ExerciseBitmap":
+        chunks = dict(self._chunks)
+        for high in self._chunks.keys() & other._chunks.keys():
+            container = _sub(chunks[high], other._chunks[high])
+            if container is None:
+                del chunks[high]
+            else:
+                chunks[high] = container
+        return ExerciseBitmap(chunks)
+
+    def __len__(self) -> int:
+        return sum(
+            c.bit_count() if isinstance(c, int) else len(c) for c in self._chunks.values()
+        )
+
+    def __iter__(self):
+        return self.ids_after(-1)
+
+    def __contains__(self, exercise_id: int) -> bool:
+        container = self._chunks.get(exercise_id >> CHUNK_BITS)
+        low = exercise_id & (CHUNK_SIZE - 1)
+        if container is None:
+            return False
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        i = np.searchsorted(container, low)
+        return i < len(container) and container[i] == low
+
+    def ids_after(self, after: int):
+        """
+        the ids greater than ``after`` in ascending order, produced lazily so a page
+        only costs as much as the ids it takes
+        """
+        first = max(after + 1, 0)
+        for high in sorted(h for h in self._chunks if h >= first >> CHUNK_BITS):
+            base = high << CHUNK_BITS
+            container = self._chunks[high]
+            if high == first >> CHUNK_BITS:
+                start = first - base
+                if isinstance(container, int):
+                    container = container >> start << start
+                else:
+                    container = container[np.searchsorted(container, start):]
+            yield from (base + _lows(container).astype(np.int64)).tolist()
+
+    def size_in_bytes(self) -> int:
+        return sum(
+            CHUNK_BYTES if isinstance(c, int) else c.nbytes
+            for c in self._chunks.values()
+        )
+
+
+EMPTY = ExerciseBitmap()
+
+
+def _apply_write(tags: dict[int, ExerciseBitmap], exercises: ExerciseBitmap, exercise_id: int | None,
+                 tag_ids, exists: bool) -> ExerciseBitmap:
+    """
+    applies one write to ``tags`` and returns the new set of all exercises: the tags
+    of an exercise, or with ``exercise_id`` None the removal of the tags ``tag_ids``
+    """
+    if exercise_id is None:
+        for tag_id in tag_ids:
+            tags.pop(tag_id, None)
+        return exercises
+    exercise = ExerciseBitmap.from_ids([exercise_id])
+    tag_ids = set(tag_ids)
+    for tag_id, bitmap in list(tags.items()):
+        if tag_id not in tag_ids and exercise_id in bitmap:
+            tags[tag_id] = bitmap - exercise
+    for tag_id in tag_ids:
+        tags[tag_id] = tags.get(tag_id, EMPTY) | exercise
+    return exercises | exercise if exists else exercises - exercise
+
+
+class TagIndex:
+    def __init__(self, reload_seconds: float):
+        self.reload_seconds = reload_seconds
+        self._tags: dict[int, ExerciseBitmap] | None = None
+        self._exercises = EMPTY
+        self._loaded_at = 0.0
+        # the writes recorded while each running load reads, replayed before it is kept
+        self._loads: list[list[tuple]] = []
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self, db: Session):
+        if self._tags is not None and time.monotonic() - self._loaded_at < self.reload_seconds:
+            return
+        writes = []
+        with self._lock:
+            self._loads.append(writes)
+        try:
+            exercise_ids = db.scalars(sa.select(models.Exercise.exercise_id)).all()
+            tagged = defaultdict(list)
+            for tag_id, exercise_id in db.execute(
+                sa.select(models.ExerciseTag.tag_id, models.ExerciseTag.exercise_id)
+            ):
+                tagged[tag_id].append(exercise_id)
+        except BaseException:
+            with self._lock:
+                self._loads.remove(writes)
+            raise
+        tags = {tag_id: ExerciseBitmap.from_ids(ids) for tag_id, ids in tagged.items()}
+        exercises = ExerciseBitmap.from_ids(exercise_ids)
+        with self._lock:
+            self._loads.remove(writes)
+            # the queries may have run before these commits, they set states so replaying is harmless
+            for write in writes:
+                exercises = _apply_write(tags, exercises, *write)
+            self._tags = tags
+            self._exercises = exercises
+            self._loaded_at = time.monotonic()
+
+    def _write(self, exercise_id: int | None, tag_ids, exists: bool):
+        tag_ids = tuple(tag_ids)
+        with self._lock:
+            for writes in self._loads:
+                writes.append((exercise_id, tag_ids, exists))
+            if self._tags is not None:
+                self._exercises = _apply_write(self._tags, self._exercises, exercise_id, tag_ids, exists)
+
+    def set_exercise_tags(self, exercise_id: int, tag_ids):
+        """
+        records the tags of an exercise after they were written. Bitmaps are
+        replaced rather than modified so readers never see one mid-update.
+        """
+        self._write(exercise_id, tag_ids, exists=True)
+
+    def remove_exercise(self, exercise_id: int):
+        self._write(exercise_id, (), exists=False)
+
+    def remove_tag(self, tag_id: int):
+        self._write(None, [tag_id], exists=False)
+
+    def matching(self, all_of=(), any_of=(), none_of=()) -> ExerciseBitmap:
+        """
+        the exercises carrying every tag id in ``all_of``, at least one of
+        ``any_of`` (when given) and none of ``none_of``
+        """
+        tags = self._tags or {}
+        result = self._exercises
+        # intersect the rarest tags first so the intermediate results stay small
+        for bitmap in sorted((tags.get(tag_id, EMPTY) for tag_id in all_of), key=len):
+            result = result & bitmap
+        if any_of:
+            union = EMPTY
+            for tag_id in any_of:
+                union = union | tags.get(tag_id, EMPTY)
+            result = result & union
+        for tag_id in none_of:
+            result = result - tags.get(tag_id, EMPTY)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._tags = None
+            self._exercises = EMPTY
+
+    def stats(self) -> dict:
+        tags = self._tags or {}
+        return {
+            "loaded": self._tags is not None,
+            "exercises": len(self._exercises),
+            "tags": len(tags),
+            "bytes": sum(bitmap.size_in_bytes() for bitmap in tags.values()),
+        }
+
+
+tag_index = TagIndex(reload_seconds=SETTINGS.tag_index_reload_seconds)
@@ -0,0 +1,120 @@
+"""
+in-process cache of verified access tokens
+
+Maps a raw bearer token to its decoded claims and a slim snapshot of the user it
+belongs to, so authenticated requests skip the JWT verification and the full user
+lookup. Entries never outlive the token's own ``exp``. Writes in this process drop
+a user's entries directly; writes made by other workers only move the user's
+``version``, so every hit is checked against it with ``is_current`` before use.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fitness_api.settings import SETTINGS
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    user_id: int
+    email: str
+    account_type: str
+    disabled: bool
+    version: int
+
+    @classmethod
+    def from_user(cls, user) -> "UserSnapshot":
+        return cls(
+            user_id=user.user_id,
+            email=user.email,
+            account_type=user.account_type,
+            disabled=bool(user.disabled),
+            version=user.version,
+        )
+
+
+@dataclass(frozen=True)
+class CachedToken:
+    claims: dict
+    user: UserSnapshot
+    expires_at: float
+
+
+class TokenCache:
+    def __init__(self, max_entries: int, max_ttl: float):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries: OrderedDict[str, CachedToken] = OrderedDict()
+        self._tokens_by_user: dict[int, set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, token: str) -> CachedToken | None:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.time():
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry
+
+    def put(self, token: str, claims: dict, user: UserSnapshot):
+        expires_at = min(float(claims["exp"]), time.time() + self.max_ttl)
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = CachedToken(claims, user, expires_at)
+            self._tokens_by_user.setdefault(user.user_id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def is_current(self, entry: CachedToken, version: int | None) -> bool:
+        """False, and the user's entries dropped, if the user has moved past the cached version or is gone"""
+        if version == entry.user.version:
+            return True
+        with self._lock:
+            self.stale += 1
+        self.invalidate_user(entry.user.user_id)
+        return False
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in self._tokens_by_user.pop(user_id, set()):
+                self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry.user.user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry.user.user_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+            }
+
+
+token_cache = TokenCache(
+    max_entries=SETTINGS.token_cache_max_entries,
+    max_ttl=SETTINGS.token_cache_ttl_seconds,
+)
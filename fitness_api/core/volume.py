@@ -0,0 +1,83 @@
+"""
+training volume aggregation
+
+An exercise-session is one exercise of a workout on one date of that workout.
+Rather than fetching every exercise-session, the exercises and the workout dates
+of a user are fetched as two column sets: the exercises are summed per workout
+with ``bincount`` and each workout date then picks up its workout's totals by
+index, after which one more ``bincount`` per metric sums the dates per period.
+"""
+import numpy as np
+
+from .schemas import VolumePeriod
+
+# 1970-01-01, day 0 of datetime64[D], was a Thursday
+_MONDAY_OFFSET = 3
+
+
+def bucket_starts(days: np.ndarray, period: VolumePeriod) -> np.ndarray:
+    """
+    first day of the day / ISO week / month each datetime64[D] value falls in
+    """
+    if period == VolumePeriod.WEEK:
+        weekday = (days.astype(np.int64) + _MONDAY_OFFSET) % 7
+        return days - weekday.astype("timedelta64[D]")
+    if period == VolumePeriod.MONTH:
+        return days.astype("datetime64[M]").astype("datetime64[D]")
+    return days
+
+
+def workout_totals(
+    workout_ids: np.ndarray,
+    sets: np.ndarray,
+    repetitions: np.ndarray,
+    weights: np.ndarray,
+    durations: np.ndarray,
+    rpes: np.ndarray,
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    per workout (in the order of the returned sorted ids): the number of exercises,
+    tonnage (sets x reps x weight), total time (sets x duration) and RPE-weighted
+    load (tonnage x RPE / 10). Missing weights and RPEs are NaN and count as 0.
+    """
+    ids, workout = np.unique(workout_ids, return_inverse=True)
+    tonnage = sets * repetitions * np.nan_to_num(weights)
+    return ids, {
+        "sessions": np.bincount(workout, minlength=len(ids)),
+        "tonnage": np.bincount(workout, weights=tonnage, minlength=len(ids)),
+        "total_time": np.bincount(workout, weights=sets * durations, minlength=len(ids)),
+        "rpe_load": np.bincount(
+            workout, weights=tonnage * np.nan_to_num(rpes) / 10, minlength=len(ids)
+        ),
+    }
+
+
+def aggregate_volume(
+    workout_ids: np.ndarray,
+    totals: dict[str, np.ndarray],
+    date_workout_ids: np.ndarray,
+    days: np.ndarray,
+    period: VolumePeriod,
+) -> list[dict]:
+    """
+    sums the workout totals of every workout date into its period
+    """
+    if len(workout_ids) == 0 or len(days) == 0:
+        return []
+    position = np.searchsorted(workout_ids, date_workout_ids)
+    position = np.minimum(position, len(workout_ids) - 1)
+    # dates of workouts without exercises add nothing
+    has_exercises = workout_ids[position] == date_workout_ids
+    position, days = position[has_exercises], days[has_exercises]
+    if len(days) == 0:
+        return []
+    starts, bucket = np.unique(bucket_starts(days, period), return_inverse=True)
+    metrics = {
+        name: np.bincount(bucket, weights=values[position], minlength=len(starts))
+        for name, values in totals.items()
+    }
+    metrics["sessions"] = metrics["sessions"].astype(np.int64)
+    return [
+        {"start": start, **{name: values[i].item() for name, values in metrics.items()}}
+        for i, start in enumerate(starts.tolist())
+    ]
@@ -0,0 +1,170 @@
+import hashlib
+
+from fastapi import HTTPException, Query, Response
+
+from fitness_api.core import db_functions
+from fitness_api.core.response_cache import response_cache, to_json
+from fitness_api.settings import SETTINGS
+
+
+def expand_query(allowed: tuple[str, ...]):
+    """
+    dependency parsing the ?expand= parameter of a read route into an expand tree
+    """
+    description = (
+        "Comma separated relationships to include: "
+        f"{', '.join(allowed)}. Leave out for all of them, 'none' for none."
+    )
+
+    def dependency(expand: str | None = Query(None, description=description)) -> dict:
+        try:
+            return db_functions.parse_expand(expand, allowed)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return dependency
+
+
+def page_params(
+    cursor: str | None = Query(None, description="next_cursor of the previous page"),
+    limit: int | None = Query(None, ge=1, description="Page size, capped at the configured maximum"),
+) -> dict:
+    if cursor is not None:
+        try:
+            db_functions.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return {"cursor": cursor, "limit": limit}
+
+
+def ids_query(
+    ids: str = Query(..., description=f"Comma separated ids, at most {SETTINGS.max_batch_ids}"),
+) -> list[int]:
+    """dependency parsing the ?ids= of a multi-get route, without duplicates, in the order given"""
+    try:
+        parsed = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma separated integers")
+    if not parsed:
+        raise HTTPException(status_code=400, detail="No ids given")
+    if len(parsed) > SETTINGS.max_batch_ids:
+        raise HTTPException(status_code=413, detail=f"At most {SETTINGS.max_batch_ids} ids per request")
+    return parsed
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    whether an If-None-Match header names ``etag``, comparing weakly as GET
+    revalidation does
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def version_etag(kind: str, entity_id: int, version: int, variant: str = "") -> str:
+    """
+    the strong ETag of one version of an entity; ``variant`` (the expand_key of the
+    ?expand= tree) tells apart the bodies a version can be rendered as
+    """
+    tag = f"{kind}-{entity_id}-v{version}"
+    if variant:
+        tag += "." + hashlib.blake2b(variant.encode(), digest_size=4).hexdigest()
+    return f'"{tag}"'
+
+
+def precondition_failed() -> HTTPException:
+    return HTTPException(status_code=412, detail="Precondition failed, the resource has changed")
+
+
+def if_match_versions(if_match: str | None, kind: str, entity_id: int) -> list[int] | None:
+    """
+    the versions of the entity an If-Match header names in any variant, for the
+    write to claim atomically; None when the header is absent or *, 412 when it
+    names none of them. Weak tags never match a write
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    prefix = f"{kind}-{entity_id}-v"
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            continue
+        base = tag.strip('"').split(".")[0]
+        if base.startswith(prefix) and base[len(prefix):].isdigit():
+            versions.append(int(base[len(prefix):]))
+    if not versions:
+        raise precondition_failed()
+    return versions
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+def cached_json(key: str, model, build, exclude_unset: bool = False) -> Response:
+    """
+    the body cached under ``key``, or the JSON of ``model`` for what ``build()``
+    returns, cached for the next request unless a write to the entity committed
+    meanwhile; exceptions from ``build`` are not cached
+    """
+    body = response_cache.get(key)
+    if body is None:
+        guard = response_cache.guard(key)
+        body = to_json(model, build(), exclude_unset)
+        response_cache.put(key, body, guard)
+    return Response(content=body, media_type="application/json")
+
+
+async def cached_json_async(key: str, model, build, exclude_unset: bool = False) -> Response:
+    body = response_cache.get(key)
+    if body is None:
+        guard = response_cache.guard(key)
+        body = to_json(model, await build(), exclude_unset)
+        response_cache.put(key, body, guard)
+    return Response(content=body, media_type="application/json")
+
+
+def split_versioned(value: bytes) -> tuple[str, bytes]:
+    etag, body = value.split(b"\n", 1)
+    return etag.decode(), body
+
+
+def versioned_json(
+    key: str, model, build, if_none_match: str | None, exclude_unset: bool = False
+) -> Response:
+    """
+    cached_json for a versioned entity, ``build()`` returning its ETag and data: the
+    body is cached with the ETag, so a hit answers both the GET and its
+    revalidation without a query, and a miss reads the version with the body
+    """
+    value = response_cache.get(key)
+    if value is not None:
+        etag, body = split_versioned(value)
+    else:
+        guard = response_cache.guard(key)
+        etag, data = build()
+        body = to_json(model, data, exclude_unset)
+        response_cache.put(key, etag.encode() + b"\n" + body, guard)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+async def versioned_json_async(
+    key: str, model, build, if_none_match: str | None, exclude_unset: bool = False
+) -> Response:
+    value = response_cache.get(key)
+    if value is not None:
+        etag, body = split_versioned(value)
+    else:
+        guard = response_cache.guard(key)
+        etag, data = await build()
+        body = to_json(model, data, exclude_unset)
+        response_cache.put(key, etag.encode() + b"\n" + body, guard)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
@@ -1,10 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from fitness_api.core import db_functions, schemas
+from fitness_api.core import async_db_functions, db_functions, models, schemas
+from fitness_api.core.response_cache import entity_key
+from fitness_api.routes.dependencies import cached_json, cached_json_async, expand_query, ids_query, page_params
+from fitness_api.settings import SETTINGS
 
 
 router = APIRouter()
+async_router = APIRouter()
+
+exercise_expand = expand_query(db_functions.EXERCISE_EXPANSIONS)
 
 
 @router.post("/exercise/", response_model=schemas.ExerciseRead)
@@ -12,12 +19,57 @@ def create_exercise(exercise: schemas.ExerciseCreate, db: Session = Depends(db_f
     return db_functions.create_exercise(db, exercise)
 
 
-@router.get("/exercise/{exercise_id}", response_model=schemas.ExerciseRead)
-def read_exercise(exercise_id: int, db: Session = Depends(db_functions.get_database)):
-    db_exercise = db_functions.get_exercise(db, exercise_id)
-    if db_exercise is None:
-        raise HTTPException(status_code=404, detail="Exercise not found")
-    return db_exercise
+@router.get("/exercises", response_model=schemas.Batch[schemas.ExerciseRead], response_model_exclude_unset=True)
+def read_exercises(ids: list[int] = Depends(ids_query), expand: dict = Depends(exercise_expand),
+                   db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_many(db, models.Exercise, ids, expand)
+
+
+@router.get("/exercises/top-rated", response_model=list[schemas.ExerciseRead])
+def read_top_rated_exercises(tag: str | None = None, min_ratings: int = Query(1, ge=1), limit: int | None = None,
+                             db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_top_rated_exercises(db, tag, min_ratings, limit)
+
+
+@router.get("/exercises/browse", response_model=schemas.Page[schemas.ExerciseRead])
+def browse_exercises(tags: list[str] = Query([]), any_tags: list[str] = Query([]),
+                     exclude_tags: list[str] = Query([]), page: dict = Depends(page_params),
+                     db: Session = Depends(db_functions.get_database)):
+    try:
+        return db_functions.get_exercises_by_tags(db, tags, any_tags, exclude_tags, **page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/exercises/search", response_model=schemas.Page[schemas.ExerciseRead])
+def search_exercises(q: str, tags: list[str] = Query([]), page: dict = Depends(page_params),
+                     db: Session = Depends(db_functions.get_database)):
+    try:
+        return db_functions.search_exercises(db, q, tags, **page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/exercise/{exercise_id}", response_model=schemas.ExerciseRead, response_model_exclude_unset=True)
+def read_exercise(exercise_id: int, expand: dict = Depends(exercise_expand),
+                  db: Session = Depends(db_functions.get_database)):
+    def build():
+        db_exercise = db_functions.get_exercise(
+            db, exercise_id, options=db_functions.expand_options(models.Exercise, expand)
+        )
+        if db_exercise is None:
+            raise HTTPException(status_code=404, detail="Exercise not found")
+        return db_functions.to_expanded_dict(db_exercise, expand)
+
+    return cached_json(
+        entity_key("exercise", exercise_id, expand), schemas.ExerciseRead, build, exclude_unset=True
+    )
+
+
+@router.get("/exercise/{exercise_id}/similar", response_model=list[schemas.SimilarExercise])
+def read_similar_exercises(exercise_id: int, limit: int = Query(10, ge=1, le=SETTINGS.similar_exercises_k),
+                           db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_similar_exercises(db, exercise_id, limit)
 
 
 @router.put("/exercise/{exercise_id}", response_model=schemas.ExerciseRead)
@@ -29,3 +81,75 @@ def update_exercise(exercise_id: int, exercise: schemas.ExerciseUpdate,
 @router.delete("/exercise/{exercise_id}", response_model=schemas.ExerciseRead)
 def delete_exercise(exercise_id: int, db: Session = Depends(db_functions.get_database)):
     return db_functions.delete_exercise(db, exercise_id)
+
+
+@async_router.post("/exercise/", response_model=schemas.ExerciseRead)
+async def create_exercise_async(exercise: schemas.ExerciseCreate,
+                                db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.create_exercise(db, exercise)
+
+
+@async_router.get("/exercises", response_model=schemas.Batch[schemas.ExerciseRead], response_model_exclude_unset=True)
+async def read_exercises_async(ids: list[int] = Depends(ids_query), expand: dict = Depends(exercise_expand),
+                               db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_many(db, models.Exercise, ids, expand)
+
+
+@async_router.get("/exercises/top-rated", response_model=list[schemas.ExerciseRead])
+async def read_top_rated_exercises_async(tag: str | None = None, min_ratings: int = Query(1, ge=1),
+                                         limit: int | None = None,
+                                         db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_top_rated_exercises(db, tag, min_ratings, limit)
+
+
+@async_router.get("/exercises/browse", response_model=schemas.Page[schemas.ExerciseRead])
+async def browse_exercises_async(tags: list[str] = Query([]), any_tags: list[str] = Query([]),
+                                 exclude_tags: list[str] = Query([]), page: dict = Depends(page_params),
+                                 db: AsyncSession = Depends(async_db_functions.get_database)):
+    try:
+        return await async_db_functions.get_exercises_by_tags(db, tags, any_tags, exclude_tags, **page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@async_router.get("/exercises/search", response_model=schemas.Page[schemas.ExerciseRead])
+async def search_exercises_async(q: str, tags: list[str] = Query([]), page: dict = Depends(page_params),
+                                 db: AsyncSession = Depends(async_db_functions.get_database)):
+    try:
+        return await async_db_functions.search_exercises(db, q, tags, **page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@async_router.get("/exercise/{exercise_id}", response_model=schemas.ExerciseRead, response_model_exclude_unset=True)
+async def read_exercise_async(exercise_id: int, expand: dict = Depends(exercise_expand),
+                              db: AsyncSession = Depends(async_db_functions.get_database)):
+    async def build():
+        db_exercise = await async_db_functions.get_exercise(
+            db, exercise_id, options=db_functions.expand_options(models.Exercise, expand)
+        )
+        if db_exercise is None:
+            raise HTTPException(status_code=404, detail="Exercise not found")
+        return db_functions.to_expanded_dict(db_exercise, expand)
+
+    return await cached_json_async(
+        entity_key("exercise", exercise_id, expand), schemas.ExerciseRead, build, exclude_unset=True
+    )
+
+
+@async_router.get("/exercise/{exercise_id}/similar", response_model=list[schemas.SimilarExercise])
+async def read_similar_exercises_async(exercise_id: int,
+                                       limit: int = Query(10, ge=1, le=SETTINGS.similar_exercises_k),
+                                       db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_similar_exercises(db, exercise_id, limit)
+
+
+@async_router.put("/exercise/{exercise_id}", response_model=schemas.ExerciseRead)
+async def update_exercise_async(exercise_id: int, exercise: schemas.ExerciseUpdate,
+                                db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.update_exercise(db, exercise_id, exercise)
+
+
+@async_router.delete("/exercise/{exercise_id}", response_model=schemas.ExerciseRead)
+async def delete_exercise_async(exercise_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.delete_exercise(db, exercise_id)
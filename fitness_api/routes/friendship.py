@@ -1,12 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
 
-from fitness_api.core import db_functions
-from fitness_api.core.schemas import FriendshipCreate, FriendshipInDB, FriendshipStatusCreate, FriendshipStatusInDB
+from fitness_api.core import async_db_functions, db_functions
+from fitness_api.core.schemas import (
+    Friend,
+    FriendSuggestion,
+    FriendshipCreate,
+    FriendshipInDB,
+    FriendshipStatusCreate,
+    FriendshipStatusInDB,
+    MutualFriends,
+    Page,
+    StatusEnum,
+)
+from fitness_api.core.lang_catalog import etag_of
+from fitness_api.core.response_cache import response_cache
+from fitness_api.routes.dependencies import (
+    cached_json,
+    cached_json_async,
+    etag_matches,
+    if_match_versions,
+    not_modified,
+    page_params,
+    precondition_failed,
+    version_etag,
+)
+from fitness_api.settings import SETTINGS
 
 
 router = APIRouter()
+async_router = APIRouter()
+
+
+def friendship_etag(friendship_id: int, version: int | None) -> str:
+    if version is None:
+        raise HTTPException(status_code=404, detail="Friendship not found")
+    return version_etag("friendship", friendship_id, version)
+
+
+def friendship_page_etag(user_id: int, page: dict, versions: list[tuple[int, int]]) -> str:
+    """
+    the ETag of a page of a user's friendships: the versions of its rows (and of
+    the row after it, which decides next_cursor), so any change to the page moves it
+    """
+    return etag_of(repr((user_id, page["cursor"], page["limit"], versions)).encode())
 
 
 # FriendshipStatus routes
@@ -22,9 +60,13 @@ def read_status(status_id: int, db: Session = Depends(db_functions.get_database)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Status not found")
     return status
 
-@router.get("/statuses/", response_model=List[FriendshipStatusInDB])
-def read_all_statuses(db: Session = Depends(db_functions.get_database)):
-    return db_functions.get_all_friendship_statuses(db)
+@router.get("/statuses/", response_model=Page[FriendshipStatusInDB])
+def read_all_statuses(page: dict = Depends(page_params), db: Session = Depends(db_functions.get_database)):
+    return cached_json(
+        response_cache.list_key("statuses", page["cursor"], page["limit"]),
+        Page[FriendshipStatusInDB],
+        lambda: db_functions.get_all_friendship_statuses(db, **page),
+    )
 
 @router.put("/status/{status_id}/", response_model=FriendshipStatusInDB)
 def update_status(status_id: int, status: FriendshipStatusCreate, db: Session = Depends(db_functions.get_database)):
@@ -53,21 +95,157 @@ def read_friendship(friendship_id: int, db: Session = Depends(db_functions.get_d
     return friendship
 
 @router.put("/friendship/{friendship_id}/", response_model=FriendshipInDB)
-def update_friendship_status(friendship_id: int, status_id: int, db: Session = Depends(db_functions.get_database)):
-    db_friendship = db_functions.update_friendships_status(db, friendship_id, status_id)
+def update_friendship_status(friendship_id: int, status_id: int, response: Response,
+                             if_match: str | None = Header(None), db: Session = Depends(db_functions.get_database)):
+    try:
+        db_friendship = db_functions.update_friendships_status(
+            db, friendship_id, status_id, if_match_versions(if_match, "friendship", friendship_id)
+        )
+    except db_functions.VersionConflict:
+        raise precondition_failed()
     if not db_friendship:
         raise HTTPException(status_code=404, detail="Friendship not found")
+    response.headers["ETag"] = friendship_etag(friendship_id, db_friendship.version)
     return db_friendship
 
-@router.get("/friendships/", response_model=List[FriendshipInDB])
-def read_all_friendships(db: Session = Depends(db_functions.get_database)):
-    return db_functions.get_all_friendships(db)
-
-@router.get("/friendships/user/{user_id}", response_model=List[FriendshipInDB])
-def read_all_friendships_for_user(user_id: int, db: Session = Depends(db_functions.get_database)):
-    return db_functions.get_all_friendships_for_user(db, user_id)
+@router.get("/friendships/", response_model=Page[FriendshipInDB])
+def read_all_friendships(page: dict = Depends(page_params), db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_all_friendships(db, **page)
+
+@router.get("/friendships/user/{user_id}", response_model=Page[FriendshipInDB])
+def read_all_friendships_for_user(user_id: int, response: Response, page: dict = Depends(page_params),
+                                  if_none_match: str | None = Header(None),
+                                  db: Session = Depends(db_functions.get_database)):
+    etag = friendship_page_etag(user_id, page, db_functions.get_friendship_page_versions(db, user_id, **page))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return db_functions.get_all_friendships_for_user(db, user_id, **page)
+
+@router.get("/friends/user/{user_id}", response_model=Page[Friend])
+def read_friends_for_user(user_id: int, status: StatusEnum | None = None, page: dict = Depends(page_params),
+                          db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_friends(db, user_id, status, **page)
+
+@router.get("/friends/user/{user_id}/suggestions", response_model=list[FriendSuggestion])
+def read_friend_suggestions(user_id: int, limit: int = Query(20, ge=1, le=SETTINGS.max_friend_suggestions),
+                            db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_friend_suggestions(db, user_id, limit)
+
+@router.get("/friends/user/{user_id}/mutual/{other_user_id}", response_model=MutualFriends)
+def read_mutual_friend_count(user_id: int, other_user_id: int, db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_mutual_friend_count(db, user_id, other_user_id)
 
 @router.delete("/friendship/{friendship_id}")
 def delete_friendship(friendship_id: int, db: Session = Depends(db_functions.get_database)):
-    db_functions.delete_friendship(db, friendship_id)
-    return {"status": "deleted"}
\ No newline at end of file
+    if db_functions.delete_friendship(db, friendship_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Friendship not found")
+    return {"status": "deleted"}
+
+
+# Async FriendshipStatus routes
+
+@async_router.post("/status/", response_model=FriendshipStatusInDB)
+async def create_status_async(status: FriendshipStatusCreate,
+                              db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.create_friendship_status(db, status)
+
+@async_router.get("/status/{status_id}", response_model=FriendshipStatusInDB)
+async def read_status_async(status_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    db_status = await async_db_functions.get_friendship_status(db, status_id)
+    if db_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Status not found")
+    return db_status
+
+@async_router.get("/statuses/", response_model=Page[FriendshipStatusInDB])
+async def read_all_statuses_async(page: dict = Depends(page_params),
+                                  db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await cached_json_async(
+        response_cache.list_key("statuses", page["cursor"], page["limit"]),
+        Page[FriendshipStatusInDB],
+        lambda: async_db_functions.get_all_friendship_statuses(db, **page),
+    )
+
+@async_router.put("/status/{status_id}/", response_model=FriendshipStatusInDB)
+async def update_status_async(status_id: int, status: FriendshipStatusCreate,
+                              db: AsyncSession = Depends(async_db_functions.get_database)):
+    db_status = await async_db_functions.update_friendship_status(db, status_id, status)
+    if not db_status:
+        raise HTTPException(status_code=404, detail="Status not found")
+    return db_status
+
+@async_router.delete("/status/{status_id}")
+async def delete_status_async(status_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    await async_db_functions.delete_friendship_status(db, status_id)
+    return {"status": "deleted"}
+
+
+# Async Friendship routes
+
+@async_router.post("/friendship/", response_model=FriendshipInDB)
+async def create_friendship_async(friendship: FriendshipCreate,
+                                  db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.create_friendship(db, friendship)
+
+@async_router.get("/friendship/{friendship_id}", response_model=FriendshipInDB)
+async def read_friendship_async(friendship_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    friendship = await async_db_functions.get_friendship(db, friendship_id)
+    if friendship is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Friendship not found")
+    return friendship
+
+@async_router.put("/friendship/{friendship_id}/", response_model=FriendshipInDB)
+async def update_friendship_status_async(friendship_id: int, status_id: int, response: Response,
+                                         if_match: str | None = Header(None),
+                                         db: AsyncSession = Depends(async_db_functions.get_database)):
+    try:
+        db_friendship = await async_db_functions.update_friendships_status(
+            db, friendship_id, status_id, if_match_versions(if_match, "friendship", friendship_id)
+        )
+    except db_functions.VersionConflict:
+        raise precondition_failed()
+    if not db_friendship:
+        raise HTTPException(status_code=404, detail="Friendship not found")
+    # the session keeps the version from before the write
+    version = await async_db_functions.get_friendship_version(db, friendship_id)
+    response.headers["ETag"] = friendship_etag(friendship_id, version)
+    return db_friendship
+
+@async_router.get("/friendships/", response_model=Page[FriendshipInDB])
+async def read_all_friendships_async(page: dict = Depends(page_params),
+                                     db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_all_friendships(db, **page)
+
+@async_router.get("/friendships/user/{user_id}", response_model=Page[FriendshipInDB])
+async def read_all_friendships_for_user_async(user_id: int, response: Response, page: dict = Depends(page_params),
+                                              if_none_match: str | None = Header(None),
+                                              db: AsyncSession = Depends(async_db_functions.get_database)):
+    versions = await async_db_functions.get_friendship_page_versions(db, user_id, **page)
+    etag = friendship_page_etag(user_id, page, versions)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return await async_db_functions.get_all_friendships_for_user(db, user_id, **page)
+
+@async_router.get("/friends/user/{user_id}", response_model=Page[Friend])
+async def read_friends_for_user_async(user_id: int, status: StatusEnum | None = None,
+                                      page: dict = Depends(page_params),
+                                      db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_friends(db, user_id, status, **page)
+
+@async_router.get("/friends/user/{user_id}/suggestions", response_model=list[FriendSuggestion])
+async def read_friend_suggestions_async(user_id: int,
+                                        limit: int = Query(20, ge=1, le=SETTINGS.max_friend_suggestions),
+                                        db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_friend_suggestions(db, user_id, limit)
+
+@async_router.get("/friends/user/{user_id}/mutual/{other_user_id}", response_model=MutualFriends)
+async def read_mutual_friend_count_async(user_id: int, other_user_id: int,
+                                         db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_mutual_friend_count(db, user_id, other_user_id)
+
+@async_router.delete("/friendship/{friendship_id}")
+async def delete_friendship_async(friendship_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    if await async_db_functions.delete_friendship(db, friendship_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Friendship not found")
+    return {"status": "deleted"}
@@ -1,27 +1,73 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from fitness_api.core import db_functions, schemas
+from fitness_api.core import async_db_functions, db_functions, schemas
+from fitness_api.core.lang_catalog import CatalogSnapshot
+from fitness_api.routes.dependencies import etag_matches
 
 
 router = APIRouter()
+async_router = APIRouter()
+
+
+def catalog_response(catalog: CatalogSnapshot) -> schemas.LangCatalog:
+    return schemas.LangCatalog(version=catalog.version, locales=catalog.locales())
+
+
+def bundle_response(catalog: CatalogSnapshot, locale: str, if_none_match: str | None) -> Response:
+    bundle = catalog.bundle(locale)
+    if bundle is None:
+        raise HTTPException(status_code=404, detail="Locale not found")
+    # clients may keep the bundle but have to revalidate it, which costs a 304
+    headers = {"ETag": bundle.etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, bundle.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=bundle.body, media_type="application/json", headers=headers)
+
+
+def translation_response(catalog: CatalogSnapshot, locale: str, key: str) -> schemas.Translation:
+    try:
+        value = catalog.message(locale, key)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Translation not found")
+    return schemas.Translation(locale=locale, key=key, value=value)
+
+
+# the catalog routes come first so /lang/catalog is not taken for a lang_id
+
+
+@router.get("/lang/catalog", response_model=schemas.LangCatalog)
+def read_lang_catalog(db: Session = Depends(db_functions.get_database)):
+    return catalog_response(db_functions.get_lang_catalog(db))
+
+
+@router.get("/lang/catalog/{locale}", response_class=Response)
+def read_locale_bundle(locale: str, if_none_match: str | None = Header(None),
+                       db: Session = Depends(db_functions.get_database)):
+    return bundle_response(db_functions.get_lang_catalog(db), locale, if_none_match)
+
+
+@router.get("/lang/catalog/{locale}/{key}", response_model=schemas.Translation)
+def read_translation(locale: str, key: str, db: Session = Depends(db_functions.get_database)):
+    return translation_response(db_functions.get_lang_catalog(db), locale, key)
 
 
 @router.post("/lang/", response_model=schemas.LangRead)
-def create_exercise(lang: schemas.LangCreate, db: Session = Depends(db_functions.get_database)):
-    return db_functions.create_exercise(db, lang)
+def create_lang(lang: schemas.LangCreate, db: Session = Depends(db_functions.get_database)):
+    return db_functions.create_lang(db, lang)
 
 
 @router.get("/lang/{lang_id}", response_model=schemas.LangRead)
 def read_lang(lang_id: int, db: Session = Depends(db_functions.get_database)):
-    db_lang = db_functions.get_exercise(db, lang_id)
+    db_lang = db_functions.get_lang(db, lang_id)
     if db_lang is None:
-        raise HTTPException(status_code=404, detail="Exercise not found")
+        raise HTTPException(status_code=404, detail="Lang not found")
     return db_lang
 
 
 @router.put("/lang/{lang_id}", response_model=schemas.LangRead)
-def update_lang(lang_id: int, lang: schemas.LangUpdate, 
+def update_lang(lang_id: int, lang: schemas.LangUpdate,
                     db: Session = Depends(db_functions.get_database)):
     return db_functions.update_lang(db, lang_id, lang)
 
@@ -29,3 +75,44 @@ def update_lang(lang_id: int, lang: schemas.LangUpdate,
 @router.delete("/lang/{lang_id}", response_model=schemas.LangRead)
 def delete_lang(lang_id: int, db: Session = Depends(db_functions.get_database)):
     return db_functions.delete_lang(db, lang_id)
+
+
+@async_router.get("/lang/catalog", response_model=schemas.LangCatalog)
+async def read_lang_catalog_async(db: AsyncSession = Depends(async_db_functions.get_database)):
+    return catalog_response(await async_db_functions.get_lang_catalog(db))
+
+
+@async_router.get("/lang/catalog/{locale}", response_class=Response)
+async def read_locale_bundle_async(locale: str, if_none_match: str | None = Header(None),
+                                   db: AsyncSession = Depends(async_db_functions.get_database)):
+    return bundle_response(await async_db_functions.get_lang_catalog(db), locale, if_none_match)
+
+
+@async_router.get("/lang/catalog/{locale}/{key}", response_model=schemas.Translation)
+async def read_translation_async(locale: str, key: str,
+                                 db: AsyncSession = Depends(async_db_functions.get_database)):
+    return translation_response(await async_db_functions.get_lang_catalog(db), locale, key)
+
+
+@async_router.post("/lang/", response_model=schemas.LangRead)
+async def create_lang_async(lang: schemas.LangCreate, db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.create_lang(db, lang)
+
+
+@async_router.get("/lang/{lang_id}", response_model=schemas.LangRead)
+async def read_lang_async(lang_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    db_lang = await async_db_functions.get_lang(db, lang_id)
+    if db_lang is None:
+        raise HTTPException(status_code=404, detail="Lang not found")
+    return db_lang
+
+
+@async_router.put("/lang/{lang_id}", response_model=schemas.LangRead)
+async def update_lang_async(lang_id: int, lang: schemas.LangUpdate,
+                            db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.update_lang(db, lang_id, lang)
+
+
+@async_router.delete("/lang/{lang_id}", response_model=schemas.LangRead)
+async def delete_lang_async(lang_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.delete_lang(db, lang_id)
@@ -0,0 +1,56 @@
+import os
+
+from fastapi import APIRouter
+
+from fitness_api.core import database
+from fitness_api.core.auth_executor import auth_executor
+from fitness_api.core.friend_graph import friend_graph
+from fitness_api.core.lang_catalog import lang_catalog
+from fitness_api.core.response_cache import response_cache
+from fitness_api.core.similarity import similarity_refresher
+from fitness_api.core.tag_index import tag_index
+from fitness_api.core.token_cache import token_cache
+
+
+router = APIRouter()
+
+
+@router.get("/metrics/auth-executor")
+def read_auth_executor_metrics():
+    return auth_executor.stats()
+
+
+@router.get("/metrics/token-cache")
+def read_token_cache_metrics():
+    return token_cache.stats()
+
+
+@router.get("/metrics/friend-graph")
+def read_friend_graph_metrics():
+    return {"pid": os.getpid(), **friend_graph.stats()}
+
+
+@router.get("/metrics/tag-index")
+def read_tag_index_metrics():
+    return {"pid": os.getpid(), **tag_index.stats()}
+
+
+@router.get("/metrics/similarity")
+def read_similarity_metrics():
+    return {"pid": os.getpid(), **similarity_refresher.stats()}
+
+
+@router.get("/metrics/lang-catalog")
+def read_lang_catalog_metrics():
+    return {"pid": os.getpid(), **lang_catalog.stats()}
+
+
+@router.get("/metrics/response-cache")
+def read_response_cache_metrics():
+    return {"pid": os.getpid(), **response_cache.stats()}
+
+
+@router.get("/metrics/db-pool")
+def read_db_pool_metrics():
+    # pools are per worker process, the pid tells the workers' numbers apart
+    return {"pid": os.getpid(), "pools": database.get_pool_stats()}
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from fitness_api.core import db_functions, schemas
+from fitness_api.core import async_db_functions, db_functions, schemas
 
 
 router = APIRouter()
+async_router = APIRouter()
 
 
 @router.post("/rating/", response_model=schemas.Rating)
@@ -34,3 +36,37 @@ def update_rating(
 @router.delete("/rating/{rating_id}", response_model=schemas.Rating)
 def delete_rating(rating_id: int, db: Session = Depends(db_functions.get_database)):
     return db_functions.delete_rating(db, rating_id)
+
+
+@async_router.post("/rating/", response_model=schemas.Rating)
+async def create_rating_async(
+    rating: schemas.RatingCreate,
+    db: AsyncSession = Depends(async_db_functions.get_database),
+):
+    return await async_db_functions.create_rating(db, rating)
+
+
+@async_router.get("/rating/{rating_id}", response_model=schemas.Rating)
+async def read_rating_async(
+    rating_id: int, db: AsyncSession = Depends(async_db_functions.get_database)
+):
+    db_rating = await async_db_functions.get_rating(db, rating_id)
+    if db_rating is None:
+        raise HTTPException(status_code=404, detail="Rating not found")
+    return db_rating
+
+
+@async_router.put("/rating/{rating_id}", response_model=schemas.Rating)
+async def update_rating_async(
+    rating_id: int,
+    rating: schemas.RatingCreate,
+    db: AsyncSession = Depends(async_db_functions.get_database),
+):
+    return await async_db_functions.update_rating(db, rating_id, rating)
+
+
+@async_router.delete("/rating/{rating_id}", response_model=schemas.Rating)
+async def delete_rating_async(
+    rating_id: int, db: AsyncSession = Depends(async_db_functions.get_database)
+):
+    return await async_db_functions.delete_rating(db, rating_id)
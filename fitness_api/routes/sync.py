@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from fitness_api.core import async_db_functions, db_functions, schemas
+from fitness_api.core.token_cache import UserSnapshot
+from fitness_api.routes.user import get_current_active_user, get_current_active_user_async
+
+
+router = APIRouter()
+async_router = APIRouter()
+
+
+def sync_params(
+    since: str | None = Query(None, description="next_cursor of the previous sync, leave out for everything"),
+    limit: int | None = Query(None, ge=1, description="Changes per response, capped at the configured maximum"),
+) -> dict:
+    if since is not None:
+        try:
+            db_functions.decode_cursor(since)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return {"since": since, "limit": limit}
+
+
+@router.get("/sync", response_model=schemas.SyncChanges)
+def read_changes(params: dict = Depends(sync_params),
+                 current_user: UserSnapshot = Depends(get_current_active_user),
+                 db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_changes(db, current_user.user_id, **params)
+
+
+@async_router.get("/sync", response_model=schemas.SyncChanges)
+async def read_changes_async(params: dict = Depends(sync_params),
+                             current_user: UserSnapshot = Depends(get_current_active_user_async),
+                             db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_changes(db, current_user.user_id, **params)
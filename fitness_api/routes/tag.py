@@ -1,27 +1,35 @@
-from typing import List
-
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from fitness_api.core import db_functions, schemas
+from fitness_api.core import async_db_functions, db_functions, schemas
+from fitness_api.core.response_cache import entity_key, response_cache
+from fitness_api.routes.dependencies import cached_json, cached_json_async, page_params
 
 router = APIRouter()
+async_router = APIRouter()
 
 @router.post("/tag/", response_model=schemas.TagRead)
 def create_tag(tag: schemas.TagCreate, db: Session = Depends(db_functions.get_database)):
     return db_functions.create_tag(db, tag)
 
-@router.get("/tags/", response_model=List[schemas.TagRead])
-def read_tags(skip: int = 0, limit: int = 100, db: Session = Depends(db_functions.get_database)):
-    tags = db_functions.get_tags(db, skip=skip, limit=limit)
-    return tags
+@router.get("/tags/", response_model=schemas.Page[schemas.TagRead])
+def read_tags(page: dict = Depends(page_params), db: Session = Depends(db_functions.get_database)):
+    return cached_json(
+        response_cache.list_key("tags", page["cursor"], page["limit"]),
+        schemas.Page[schemas.TagRead],
+        lambda: db_functions.get_tags(db, **page),
+    )
 
 @router.get("/tag/{tag_id}/", response_model=schemas.TagRead)
 def read_tag(tag_id: int, db: Session = Depends(db_functions.get_database)):
-    db_tag = db_functions.get_tag(db, tag_id=tag_id)
-    if db_tag is None:
-        raise HTTPException(status_code=404, detail="Tag not found")
-    return db_tag
+    def build():
+        db_tag = db_functions.get_tag(db, tag_id=tag_id)
+        if db_tag is None:
+            raise HTTPException(status_code=404, detail="Tag not found")
+        return db_tag
+
+    return cached_json(entity_key("tag", tag_id), schemas.TagRead, build)
 
 @router.put("/tag/{tag_id}/", response_model=schemas.TagRead)
 def update_tag(tag_id: int, tag: schemas.TagUpdate, db: Session = Depends(db_functions.get_database)):
@@ -36,3 +44,42 @@ def delete_tag(tag_id: int, db: Session = Depends(db_functions.get_database)):
     if db_tag is None:
         raise HTTPException(status_code=404, detail="Tag not found")
     return db_tag
+
+
+@async_router.post("/tag/", response_model=schemas.TagRead)
+async def create_tag_async(tag: schemas.TagCreate, db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.create_tag(db, tag)
+
+@async_router.get("/tags/", response_model=schemas.Page[schemas.TagRead])
+async def read_tags_async(page: dict = Depends(page_params),
+                          db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await cached_json_async(
+        response_cache.list_key("tags", page["cursor"], page["limit"]),
+        schemas.Page[schemas.TagRead],
+        lambda: async_db_functions.get_tags(db, **page),
+    )
+
+@async_router.get("/tag/{tag_id}/", response_model=schemas.TagRead)
+async def read_tag_async(tag_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    async def build():
+        db_tag = await async_db_functions.get_tag(db, tag_id=tag_id)
+        if db_tag is None:
+            raise HTTPException(status_code=404, detail="Tag not found")
+        return db_tag
+
+    return await cached_json_async(entity_key("tag", tag_id), schemas.TagRead, build)
+
+@async_router.put("/tag/{tag_id}/", response_model=schemas.TagRead)
+async def update_tag_async(tag_id: int, tag: schemas.TagUpdate,
+                           db: AsyncSession = Depends(async_db_functions.get_database)):
+    db_tag = await async_db_functions.update_tag(db, tag_id, tag)
+    if db_tag is None:
+        raise HTTPException(status_code=404, detail="Tag not found")
+    return db_tag
+
+@async_router.delete("/tag/{tag_id}/", response_model=schemas.TagRead)
+async def delete_tag_async(tag_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    db_tag = await async_db_functions.delete_tag(db, tag_id)
+    if db_tag is None:
+        raise HTTPException(status_code=404, detail="Tag not found")
+    return db_tag
@@ -2,14 +2,17 @@ from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from fitness_api.core import db_functions, schemas
+from fitness_api.core import async_db_functions, db_functions, schemas
+from fitness_api.core.auth_executor import run_auth_task
 from fitness_api.settings import SETTINGS
 
 from datetime import timedelta
 
 router = APIRouter()
+async_router = APIRouter()
 
 
 @router.post("/token", response_model=schemas.Token)
@@ -17,7 +20,28 @@ async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     db: Annotated[Session, Depends(db_functions.get_database)],
 ):
-    user = db_functions.authenticate_user(db, form_data.username, form_data.password)
+    user = await run_auth_task(
+        db_functions.authenticate_user, db, form_data.username, form_data.password
+    )
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token_expires = timedelta(minutes=SETTINGS.access_token_expire_minutes)
+    access_token = db_functions.create_access_token(
+        data={"sub": user.email}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+@async_router.post("/token", response_model=schemas.Token)
+async def login_for_access_token_async(
+    form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    db: Annotated[AsyncSession, Depends(async_db_functions.get_database)],
+):
+    user = await async_db_functions.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,40 +1,81 @@
+from datetime import date
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from fitness_api.core import db_functions, schemas
+from fitness_api.core import async_db_functions, db_functions, models, schemas
+from fitness_api.core.auth_executor import run_auth_task
+from fitness_api.core.response_cache import expand_key
+from fitness_api.core.token_cache import UserSnapshot, token_cache
+from fitness_api.routes.dependencies import (
+    etag_matches,
+    expand_query,
+    ids_query,
+    if_match_versions,
+    not_modified,
+    precondition_failed,
+    version_etag,
+)
 from fitness_api.settings import SETTINGS
 
 router = APIRouter()
+async_router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-async def get_current_user(db: Annotated[Session, Depends(db_functions.get_database)], 
-                           token: Annotated[str, Depends(oauth2_scheme)]):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+user_expand = expand_query(db_functions.USER_EXPANSIONS)
+# the variant of a GET without ?expand=, which writes hand back so the client can revalidate with it
+user_default_variant = expand_key(db_functions.parse_expand(None, db_functions.USER_EXPANSIONS))
+
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+def user_etag(user_id: int, version: int | None, variant: str = "") -> str:
+    if version is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return version_etag("user", user_id, version, variant)
+
+
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SETTINGS.secret_key, algorithms=[SETTINGS.algorithm])
-        user_email: str = payload.get("sub")
-        if user_email is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(user_email=user_email)
     except JWTError:
         raise credentials_exception
-    user = db_functions.get_user(db, user_email=token_data.user_email)
+    if payload.get("sub") is None:
+        raise credentials_exception
+    return payload
+
+
+def cache_verified_token(token: str, payload: dict, user) -> UserSnapshot:
     if user is None:
         raise credentials_exception
-    return user
+    snapshot = UserSnapshot.from_user(user)
+    token_cache.put(token, payload, snapshot)
+    return snapshot
+
+
+async def get_current_user(db: Annotated[Session, Depends(db_functions.get_database)], 
+                           token: Annotated[str, Depends(oauth2_scheme)]):
+    cached = token_cache.get(token)
+    if cached is not None:
+        version = await run_auth_task(db_functions.get_user_version, db, cached.user.user_id)
+        if token_cache.is_current(cached, version):
+            return cached.user
+    payload = decode_token(token)
+    user = await run_auth_task(db_functions.get_user, db, user_email=payload["sub"], options=())
+    return cache_verified_token(token, payload, user)
 
 
 async def get_current_active_user(
-    current_user: Annotated[schemas.User, Depends(get_current_user)]
+    current_user: Annotated[UserSnapshot, Depends(get_current_user)]
 ):
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
@@ -42,26 +83,33 @@ async def get_current_active_user(
 
 
 @router.post("/user/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(db_functions.get_database)):
-    db_user = db_functions.get_user(db, user_email=user.email)
+async def create_user(user: schemas.UserCreate, db: Session = Depends(db_functions.get_database)):
+    db_user = await run_auth_task(db_functions.get_user, db, user_email=user.email, options=())
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return db_functions.create_user(db=db, user_data=user)
+    password_hash = await run_auth_task(db_functions.get_password_hash, user.password)
+    return await run_auth_task(db_functions.create_user, db=db, user_data=user, password_hash=password_hash)
 
 
 @router.put("/user/", response_model=schemas.User)
-def update_user(user: schemas.UserUpdate, 
-                current_user: schemas.User = Depends(get_current_active_user), 
+def update_user(user: schemas.UserUpdate, response: Response,
+                if_match: str | None = Header(None),
+                current_user: UserSnapshot = Depends(get_current_active_user), 
                 db: Session = Depends(db_functions.get_database)):
-    
-    db_user = db_functions.update_user(db, current_user.user_id, user)
+    try:
+        db_user = db_functions.update_user(
+            db, current_user.user_id, user, if_match_versions(if_match, "user", current_user.user_id)
+        )
+    except db_functions.VersionConflict:
+        raise precondition_failed()
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    response.headers["ETag"] = user_etag(db_user.user_id, db_user.version, user_default_variant)
     return db_user
 
 
 @router.delete("/user/", response_model=schemas.User)
-def delete_user(current_user: schemas.User = Depends(get_current_active_user),
+def delete_user(current_user: UserSnapshot = Depends(get_current_active_user),
                 db: Session = Depends(db_functions.get_database)):
     db_user = db_functions.delete_user(db, current_user.user_id)
     if db_user is None:
@@ -69,21 +117,60 @@ def delete_user(current_user: schemas.User = Depends(get_current_active_user),
     return db_user
 
 
-@router.get("/user/me", response_model=schemas.User)
-def read_user(current_user: schemas.User = Depends(get_current_active_user), 
+@router.get("/user/me", response_model=schemas.User, response_model_exclude_unset=True)
+def read_user(response: Response,
+              current_user: UserSnapshot = Depends(get_current_active_user), 
+              expand: dict = Depends(user_expand),
+              if_none_match: str | None = Header(None),
               db: Session = Depends(db_functions.get_database)):
-    db_user = db_functions.get_user(db, user_id=current_user.user_id)
+    # the version was read by the auth dependency before the body, so the body is never older than its ETag
+    etag = user_etag(current_user.user_id, current_user.version, expand_key(expand))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    db_user = db_functions.get_user(
+        db, user_id=current_user.user_id, options=db_functions.expand_options(models.User, expand)
+    )
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    response.headers["ETag"] = etag
+    return db_functions.to_expanded_dict(db_user, expand)
 
 
-@router.get("/user/{user_id}", response_model=schemas.User)
-def read_user_with_id(user_id: int, db: Session = Depends(db_functions.get_database)):
-    db_user = db_functions.get_user(db, user_id=user_id)
+@router.get("/user/me/stats/adherence", response_model=schemas.AdherenceStats)
+def read_adherence_stats(today: date | None = None,
+                         current_user: UserSnapshot = Depends(get_current_active_user),
+                         db: Session = Depends(db_functions.get_database)):
+    # today defaults to the server's date, clients in other time zones pass their own
+    return db_functions.get_adherence_stats(db, current_user.user_id, today)
+
+
+@router.get("/user/me/stats/volume", response_model=schemas.VolumeStats)
+def read_volume_stats(period: schemas.VolumePeriod = schemas.VolumePeriod.WEEK,
+                      since: date | None = None, until: date | None = None, completed_only: bool = True,
+                      current_user: UserSnapshot = Depends(get_current_active_user),
+                      db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_volume_stats(db, current_user.user_id, period, since, until, completed_only)
+
+
+@router.get("/user/me/records", response_model=list[schemas.PersonalRecords])
+def read_personal_records(current_user: UserSnapshot = Depends(get_current_active_user),
+                          db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_personal_records(db, current_user.user_id)
+
+
+@router.get("/user/{user_id}", response_model=schemas.User, response_model_exclude_unset=True)
+def read_user_with_id(user_id: int, expand: dict = Depends(user_expand),
+                      db: Session = Depends(db_functions.get_database)):
+    db_user = db_functions.get_user(db, user_id=user_id, options=db_functions.expand_options(models.User, expand))
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    return db_functions.to_expanded_dict(db_user, expand)
+
+
+@router.get("/users", response_model=schemas.Batch[schemas.User], response_model_exclude_unset=True)
+def read_users(ids: list[int] = Depends(ids_query), expand: dict = Depends(user_expand),
+               db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_many(db, models.User, ids, expand)
 
 
 @router.get("/users/fc/{friend_code}", response_model=int)
@@ -92,3 +179,127 @@ def get_user_id_from_friend_code(friend_code: str, db: Session = Depends(db_func
     if user_id is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user_id
+
+
+
+async def get_current_user_async(db: Annotated[AsyncSession, Depends(async_db_functions.get_database)],
+                                 token: Annotated[str, Depends(oauth2_scheme)]):
+    cached = token_cache.get(token)
+    if cached is not None:
+        version = await async_db_functions.get_user_version(db, cached.user.user_id)
+        if token_cache.is_current(cached, version):
+            return cached.user
+    payload = decode_token(token)
+    user = await async_db_functions.get_user(db, user_email=payload["sub"], options=())
+    return cache_verified_token(token, payload, user)
+
+
+async def get_current_active_user_async(
+    current_user: Annotated[UserSnapshot, Depends(get_current_user_async)]
+):
+    if current_user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return current_user
+
+
+@async_router.post("/user/", response_model=schemas.User)
+async def create_user_async(user: schemas.UserCreate, db: AsyncSession = Depends(async_db_functions.get_database)):
+    db_user = await async_db_functions.get_user(db, user_email=user.email, options=())
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return await async_db_functions.create_user(db=db, user_data=user)
+
+
+@async_router.put("/user/", response_model=schemas.User)
+async def update_user_async(user: schemas.UserUpdate, response: Response,
+                            if_match: str | None = Header(None),
+                            current_user: UserSnapshot = Depends(get_current_active_user_async),
+                            db: AsyncSession = Depends(async_db_functions.get_database)):
+    try:
+        db_user = await async_db_functions.update_user(
+            db, current_user.user_id, user, if_match_versions(if_match, "user", current_user.user_id)
+        )
+    except db_functions.VersionConflict:
+        raise precondition_failed()
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    # the session keeps the version from before the write
+    version = await async_db_functions.get_user_version(db, current_user.user_id)
+    response.headers["ETag"] = user_etag(current_user.user_id, version, user_default_variant)
+    return db_user
+
+
+@async_router.delete("/user/", response_model=schemas.User)
+async def delete_user_async(current_user: UserSnapshot = Depends(get_current_active_user_async),
+                            db: AsyncSession = Depends(async_db_functions.get_database)):
+    db_user = await async_db_functions.delete_user(db, current_user.user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+@async_router.get("/user/me", response_model=schemas.User, response_model_exclude_unset=True)
+async def read_user_async(response: Response,
+                          current_user: UserSnapshot = Depends(get_current_active_user_async),
+                          expand: dict = Depends(user_expand),
+                          if_none_match: str | None = Header(None),
+                          db: AsyncSession = Depends(async_db_functions.get_database)):
+    etag = user_etag(current_user.user_id, current_user.version, expand_key(expand))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    db_user = await async_db_functions.get_user(
+        db, user_id=current_user.user_id, options=db_functions.expand_options(models.User, expand)
+    )
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    response.headers["ETag"] = etag
+    return db_functions.to_expanded_dict(db_user, expand)
+
+
+@async_router.get("/user/me/stats/adherence", response_model=schemas.AdherenceStats)
+async def read_adherence_stats_async(today: date | None = None,
+                                     current_user: UserSnapshot = Depends(get_current_active_user_async),
+                                     db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_adherence_stats(db, current_user.user_id, today)
+
+
+@async_router.get("/user/me/stats/volume", response_model=schemas.VolumeStats)
+async def read_volume_stats_async(period: schemas.VolumePeriod = schemas.VolumePeriod.WEEK,
+                                  since: date | None = None, until: date | None = None, completed_only: bool = True,
+                                  current_user: UserSnapshot = Depends(get_current_active_user_async),
+                                  db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_volume_stats(
+        db, current_user.user_id, period, since, until, completed_only
+    )
+
+
+@async_router.get("/user/me/records", response_model=list[schemas.PersonalRecords])
+async def read_personal_records_async(current_user: UserSnapshot = Depends(get_current_active_user_async),
+                                      db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_personal_records(db, current_user.user_id)
+
+
+@async_router.get("/user/{user_id}", response_model=schemas.User, response_model_exclude_unset=True)
+async def read_user_with_id_async(user_id: int, expand: dict = Depends(user_expand),
+                                  db: AsyncSession = Depends(async_db_functions.get_database)):
+    db_user = await async_db_functions.get_user(
+        db, user_id=user_id, options=db_functions.expand_options(models.User, expand)
+    )
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_functions.to_expanded_dict(db_user, expand)
+
+
+@async_router.get("/users", response_model=schemas.Batch[schemas.User], response_model_exclude_unset=True)
+async def read_users_async(ids: list[int] = Depends(ids_query), expand: dict = Depends(user_expand),
+                           db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_many(db, models.User, ids, expand)
+
+
+@async_router.get("/users/fc/{friend_code}", response_model=int)
+async def get_user_id_from_friend_code_async(friend_code: str,
+                                             db: AsyncSession = Depends(async_db_functions.get_database)):
+    user_id = await async_db_functions.get_user_id_from_friend_code(db, friend_code)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_id
@@ -1,10 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from fitness_api.core import db_functions, schemas
+from fitness_api.core import async_db_functions, db_functions, models, schemas
+from fitness_api.core.response_cache import entity_key, expand_key
+from fitness_api.routes.dependencies import (
+    expand_query,
+    ids_query,
+    if_match_versions,
+    precondition_failed,
+    version_etag,
+    versioned_json,
+    versioned_json_async,
+)
+from fitness_api.settings import SETTINGS
 
 
 router = APIRouter()
+async_router = APIRouter()
+
+workout_expand = expand_query(db_functions.WORKOUT_EXPANSIONS)
+# the variant of a GET without ?expand=, which writes hand back so the client can revalidate with it
+workout_default_variant = expand_key(db_functions.parse_expand(None, db_functions.WORKOUT_EXPANSIONS))
+
+
+def workout_etag(workout_id: int, version: int | None, variant: str = "") -> str:
+    if version is None:
+        raise HTTPException(status_code=404, detail="Workout not found")
+    return version_etag("workout", workout_id, version, variant)
 
 
 @router.post("/workout/", response_model=schemas.Workout)
@@ -12,17 +37,50 @@ def create_workout(workout: schemas.WorkoutCreate, db: Session = Depends(db_func
     return db_functions.create_workout(db, workout)
 
 
-@router.get("/workout/{workout_id}", response_model=schemas.Workout)
-def read_workout(workout_id: int, db: Session = Depends(db_functions.get_database)):
-    db_workout = db_functions.get_workout(db, workout_id)
-    if db_workout is None:
-        raise HTTPException(status_code=404, detail="Workout not found")
-    return db_workout
+@router.post("/workouts/bulk", response_model=schemas.WorkoutBulkResult)
+def create_workouts_bulk(workouts: List[schemas.WorkoutBulkItem], db: Session = Depends(db_functions.get_database)):
+    if len(workouts) > SETTINGS.max_bulk_items:
+        raise HTTPException(status_code=413, detail=f"At most {SETTINGS.max_bulk_items} workouts per request")
+    return db_functions.create_workouts_bulk(db, workouts)
+
+
+@router.get("/workouts", response_model=schemas.Batch[schemas.Workout], response_model_exclude_unset=True)
+def read_workouts(ids: list[int] = Depends(ids_query), expand: dict = Depends(workout_expand),
+                  db: Session = Depends(db_functions.get_database)):
+    return db_functions.get_many(db, models.Workout, ids, expand)
+
+
+@router.get("/workout/{workout_id}", response_model=schemas.Workout, response_model_exclude_unset=True)
+def read_workout(workout_id: int, expand: dict = Depends(workout_expand),
+                 if_none_match: str | None = Header(None),
+                 db: Session = Depends(db_functions.get_database)):
+    def build():
+        db_workout = db_functions.get_workout(
+            db, workout_id, options=db_functions.expand_options(models.Workout, expand)
+        )
+        if db_workout is None:
+            raise HTTPException(status_code=404, detail="Workout not found")
+        etag = workout_etag(workout_id, db_workout.version, expand_key(expand))
+        return etag, db_functions.to_expanded_dict(db_workout, expand)
+
+    return versioned_json(
+        entity_key("workout", workout_id, expand), schemas.Workout, build, if_none_match, exclude_unset=True
+    )
 
 
 @router.put("/workout/{workout_id}", response_model=schemas.Workout)
-def update_workout(workout_id: int, workout: schemas.WorkoutUpdate, db: Session = Depends(db_functions.get_database)):
-    return db_functions.update_workout(db, workout_id, workout)
+def update_workout(workout_id: int, workout: schemas.WorkoutUpdate, response: Response,
+                   if_match: str | None = Header(None), db: Session = Depends(db_functions.get_database)):
+    try:
+        db_workout = db_functions.update_workout(
+            db, workout_id, workout, if_match_versions(if_match, "workout", workout_id)
+        )
+    except db_functions.VersionConflict:
+        raise precondition_failed()
+    response.headers["ETag"] = workout_etag(
+        workout_id, db_functions.get_workout_version(db, workout_id), workout_default_variant
+    )
+    return db_workout
 
 
 @router.delete("/workout/{workout_id}", response_model=schemas.Workout)
@@ -44,4 +102,73 @@ def update_workout_date(workout_date_id: int,
 
 @router.delete("/workout/date/{workout_date_id}")
 def delete_workout_date(workout_date_id: int, db: Session = Depends(db_functions.get_database)):
-    return db_functions.delete_workout_date(db, workout_date_id)
\ No newline at end of file
+    return db_functions.delete_workout_date(db, workout_date_id)
+
+
+@async_router.post("/workout/", response_model=schemas.Workout)
+async def create_workout_async(workout: schemas.WorkoutCreate,
+                               db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.create_workout(db, workout)
+
+
+@async_router.get("/workouts", response_model=schemas.Batch[schemas.Workout], response_model_exclude_unset=True)
+async def read_workouts_async(ids: list[int] = Depends(ids_query), expand: dict = Depends(workout_expand),
+                              db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.get_many(db, models.Workout, ids, expand)
+
+
+@async_router.get("/workout/{workout_id}", response_model=schemas.Workout, response_model_exclude_unset=True)
+async def read_workout_async(workout_id: int, expand: dict = Depends(workout_expand),
+                             if_none_match: str | None = Header(None),
+                             db: AsyncSession = Depends(async_db_functions.get_database)):
+    async def build():
+        db_workout = await async_db_functions.get_workout(
+            db, workout_id, options=db_functions.expand_options(models.Workout, expand)
+        )
+        if db_workout is None:
+            raise HTTPException(status_code=404, detail="Workout not found")
+        etag = workout_etag(workout_id, db_workout.version, expand_key(expand))
+        return etag, db_functions.to_expanded_dict(db_workout, expand)
+
+    return await versioned_json_async(
+        entity_key("workout", workout_id, expand), schemas.Workout, build, if_none_match, exclude_unset=True
+    )
+
+
+@async_router.put("/workout/{workout_id}", response_model=schemas.Workout)
+async def update_workout_async(workout_id: int, workout: schemas.WorkoutUpdate, response: Response,
+                               if_match: str | None = Header(None),
+                               db: AsyncSession = Depends(async_db_functions.get_database)):
+    try:
+        db_workout = await async_db_functions.update_workout(
+            db, workout_id, workout, if_match_versions(if_match, "workout", workout_id)
+        )
+    except db_functions.VersionConflict:
+        raise precondition_failed()
+    version = await async_db_functions.get_workout_version(db, workout_id)
+    response.headers["ETag"] = workout_etag(workout_id, version, workout_default_variant)
+    return db_workout
+
+
+@async_router.delete("/workout/{workout_id}", response_model=schemas.Workout)
+async def delete_workout_async(workout_id: int, db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.delete_workout(db, workout_id)
+
+
+@async_router.post("/workout/date/", response_model=schemas.WorkoutDate)
+async def create_workout_date_async(workout_date: schemas.WorkoutDateCreate,
+                                    db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.create_workout_date(db, workout_date)
+
+
+@async_router.put("/workout/date/{workout_date_id}", response_model=schemas.WorkoutDate)
+async def update_workout_date_async(workout_date_id: int,
+                                    workout_date: schemas.WorkoutDateUpdate,
+                                    db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.update_workout_date(db, workout_date_id, workout_date)
+
+
+@async_router.delete("/workout/date/{workout_date_id}")
+async def delete_workout_date_async(workout_date_id: int,
+                                    db: AsyncSession = Depends(async_db_functions.get_database)):
+    return await async_db_functions.delete_workout_date(db, workout_date_id)
@@ -0,0 +1,58 @@
+"""
+launch entry point for running the API with one or more worker processes
+
+The schema and the initial exercise similarity table are bootstrapped once in the
+supervising process and its engine is disposed before the workers start, so no
+connection crosses the process boundary and the workers skip ``create_all`` and
+the startup rebuild. Every worker builds its own engines, and on
+SIGINT/SIGTERM uvicorn lets in-flight requests finish before the shutdown hook
+drains the worker's pools.
+"""
+import os
+
+import uvicorn
+
+from fitness_api.settings import SETTINGS
+from fitness_api.core import database, db_functions
+from fitness_api.core import logging as _logging
+from fitness_api.core.logging import logger
+from fitness_api.core.similarity import similarity_refresher
+
+
+def bootstrap_database():
+    db_functions.create_database()
+    database.engine.dispose()
+    logger.info("Database schema bootstrapped")
+
+
+def build_similarity():
+    if not similarity_refresher.built():
+        similarity_refresher.run_once(rebuild=True)
+    database.engine.dispose()
+    logger.info("Exercise similarity table built")
+
+
+def main():
+    _logging.check_logging_level()
+    if SETTINGS.db_create_schema_on_startup:
+        bootstrap_database()
+    if SETTINGS.similarity_build_on_startup:
+        build_similarity()
+    # spawned workers read their settings from the environment again
+    os.environ["FITNESS_API_DB_CREATE_SCHEMA_ON_STARTUP"] = "false"
+    os.environ["FITNESS_API_SIMILARITY_BUILD_ON_STARTUP"] = "false"
+    SETTINGS.db_create_schema_on_startup = False
+    SETTINGS.similarity_build_on_startup = False
+    similarity_refresher.build_on_startup = False
+
+    logger.info(f"Starting {SETTINGS.workers} worker(s) on {SETTINGS.host}:{SETTINGS.port}")
+    uvicorn.run(
+        "main:app",
+        host=SETTINGS.host,
+        port=SETTINGS.port,
+        workers=SETTINGS.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
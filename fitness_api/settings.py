@@ -3,11 +3,44 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     db_connection_string: str = "sqlite:///./test.db"
+    db_async: bool = False
+    db_async_connection_string: str | None = None
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = False
+    db_create_schema_on_startup: bool = True
+    host: str = "0.0.0.0"
+    port: int = 8000
+    workers: int = 1
     debug_logging: bool = False
     cors_origins: list[str] = ["*"]
     secret_key: str = "secret"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    default_page_size: int = 50
+    max_page_size: int = 200
+    max_bulk_items: int = 500
+    max_batch_ids: int = 200
+    auth_executor_workers: int = 4
+    auth_executor_max_queue: int = 64
+    token_cache_max_entries: int = 10000
+    token_cache_ttl_seconds: int = 300
+    tag_cache_max_entries: int = 10000
+    friend_graph_reload_seconds: int = 300
+    max_friend_suggestions: int = 100
+    tag_index_reload_seconds: int = 300
+    similar_exercises_k: int = 20
+    similarity_refresh_seconds: int = 10
+    similarity_rebuild_seconds: int = 3600
+    similarity_build_on_startup: bool = True
+    lang_catalog_reload_seconds: int = 300
+    response_cache_backend: str = "local"
+    response_cache_url: str | None = None
+    response_cache_ttl_seconds: int = 60
+    response_cache_max_entries: int = 10000
+    response_cache_max_bytes: int = 64 * 1024 * 1024
 
     class Config:
         env_file = ".env"
@@ -1,10 +1,13 @@
 import fastapi as _fastapi
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 import fitness_api.settings as _settings
 from fitness_api.core import logging as _logging
-from fitness_api.core import db_functions
-from fitness_api.routes import token, user, friendship, exercise, workout, rating, tag, lang
+from fitness_api.core import database, db_functions
+from fitness_api.core.auth_executor import AuthExecutorSaturated
+from fitness_api.core.similarity import similarity_refresher
+from fitness_api.routes import token, user, friendship, exercise, workout, rating, tag, lang, metrics, sync
 
 
 _logging.check_logging_level()
@@ -19,19 +22,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-db_functions.create_database()
 
-app.include_router(token.router)
-app.include_router(user.router)
-app.include_router(friendship.router)
-app.include_router(exercise.router)
-app.include_router(workout.router)
-app.include_router(rating.router)
-app.include_router(tag.router)
-app.include_router(lang.router)
+@app.exception_handler(AuthExecutorSaturated)
+def auth_executor_saturated_handler(request: _fastapi.Request, exc: AuthExecutorSaturated):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
+@app.on_event("startup")
+def build_tag_index():
+    # each worker builds its own copy before serving rather than on the first browse
+    db_functions.load_tag_index()
+
+
+@app.on_event("startup")
+def start_similarity_refresher():
+    similarity_refresher.start()
+
+
+@app.on_event("shutdown")
+async def dispose_database_engines():
+    similarity_refresher.stop()
+    await database.dispose_engines()
+
+
+if _settings.SETTINGS.db_create_schema_on_startup:
+    db_functions.create_database()
+
+route_modules = [token, user, friendship, exercise, workout, rating, tag, lang, sync]
+
+# In async mode the async routers are registered first so they take precedence
+# over their sync counterparts; endpoints without an async port stay on the sync ones.
+if _settings.SETTINGS.db_async:
+    for module in route_modules:
+        app.include_router(module.async_router)
+
+for module in route_modules:
+    app.include_router(module.router)
+
+app.include_router(metrics.router)
 
 
 if __name__ == "__main__":
-    import uvicorn
+    from fitness_api import server
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    server.main()
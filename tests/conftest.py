@@ -0,0 +1,10 @@
+import pytest
+
+from fitness_api.core import db_functions
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    db_functions.create_database()
+    yield
+    db_functions.drop_database()
@@ -0,0 +1,194 @@
+import pytest
+import pytest_asyncio
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from fitness_api.core import async_db_functions, database, db_functions, models, schemas
+from fitness_api.core.lang_catalog import lang_catalog
+from fitness_api.core.tag_cache import tag_cache
+from fitness_api.core.tag_index import tag_index
+
+
+@pytest_asyncio.fixture
+async def async_db(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'async.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+    # the factory settings of database.AsyncSessionLocal, so tests see the same flushes
+    session_maker = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async with session_maker() as db:
+        yield db
+    await engine.dispose()
+    # tag ids cached from this throwaway database must not leak into other tests
+    tag_cache.clear()
+    tag_index.clear()
+    lang_catalog.clear()
+
+
+def test_get_async_database_url():
+    assert database.get_async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    assert (
+        database.get_async_database_url("postgresql+psycopg2://user:pw@host/db")
+        == "postgresql+asyncpg://user:pw@host/db"
+    )
+
+
+@pytest.mark.asyncio
+async def test_create_and_get_user_with_workouts(async_db):
+    user = await async_db_functions.create_user(
+        async_db,
+        schemas.UserCreate(
+            name="asyncuser",
+            email="async@example.com",
+            password="testpassword",
+            height=180,
+            weight=80,
+            gender="MALE",
+            birth_date=None,
+        ),
+    )
+    await async_db_functions.create_workout(
+        async_db,
+        schemas.WorkoutCreate(
+            name="legs", user_id=user.user_id, dates=[{"date": "2023-01-01", "completed": False}]
+        ),
+    )
+    await async_db_functions.create_exercise(
+        async_db,
+        schemas.ExerciseCreate(
+            name="squat", description=None, video_url=None, user_id=user.user_id, set=3,
+            repetition=5, duration=0, weight=100, rpe=8, workout_id=1, tags=["legs"],
+        ),
+    )
+
+    db_user = await async_db_functions.get_user(async_db, user_email="async@example.com")
+    data = schemas.User.model_validate(db_user)
+    assert data.workouts[0].name == "legs"
+    assert data.workouts[0].exercises[0].tags[0].name == "legs"
+    assert len(data.workouts[0].dates) == 1
+
+
+@pytest.mark.asyncio
+async def test_tag_ids_are_cached_only_once_committed(async_db):
+    await async_db.run_sync(db_functions.resolve_tags, ["fresh"])
+    await async_db.rollback()
+    assert tag_cache.get_many(["fresh"]) == {}
+
+    exercise = await async_db_functions.create_exercise(
+        async_db,
+        schemas.ExerciseCreate(
+            name="fresh press", description=None, video_url=None, user_id=None, set=3,
+            repetition=5, duration=0, weight=40, rpe=7, workout_id=None, tags=["fresh"],
+        ),
+    )
+    assert [tag.name for tag in exercise.tags] == ["fresh"]
+    assert tag_cache.get_many(["fresh"]) == {"fresh": exercise.tags[0].tag_id}
+
+
+@pytest.mark.asyncio
+async def test_lang_writes_refresh_the_catalog(async_db):
+    lang = await async_db_functions.create_lang(async_db, schemas.LangCreate(tr_TR={"hello": "Merhaba"}))
+    catalog = await async_db_functions.get_lang_catalog(async_db)
+    assert catalog.message("tr_TR", "hello") == "Merhaba"
+
+    await async_db_functions.update_lang(async_db, lang.lang_id, schemas.LangUpdate(en={"hello": "Hello"}))
+    catalog = await async_db_functions.get_lang_catalog(async_db)
+    assert catalog.locales().keys() == {"en", "tr_TR"}
+    assert schemas.LangRead.model_validate(await async_db_functions.get_lang(async_db, lang.lang_id)).model_dump() == {
+        "lang_id": lang.lang_id, "en": {"hello": "Hello"}, "tr_TR": {"hello": "Merhaba"},
+    }
+
+
+@pytest.mark.asyncio
+async def test_workout_writes_move_the_workout_and_owner_versions(async_db):
+    first = await async_db_functions.create_user(
+        async_db,
+        schemas.UserCreate(
+            name="first", email="first@example.com", password="pw", height=170, weight=70, gender="OTHER",
+            birth_date=None,
+        ),
+    )
+    second = await async_db_functions.create_user(
+        async_db,
+        schemas.UserCreate(
+            name="second", email="second@example.com", password="pw", height=170, weight=70, gender="OTHER",
+            birth_date=None,
+        ),
+    )
+    workout = await async_db_functions.create_workout(
+        async_db, schemas.WorkoutCreate(name="moved", user_id=first.user_id, dates=None)
+    )
+    assert await async_db_functions.get_workout_version(async_db, workout.workout_id) == 1
+    assert await async_db_functions.get_user_version(async_db, first.user_id) == 2
+
+    # handing the workout over moves both owners
+    await async_db_functions.update_workout(
+        async_db, workout.workout_id, schemas.WorkoutUpdate(name=None, user_id=second.user_id)
+    )
+    assert await async_db_functions.get_workout_version(async_db, workout.workout_id) == 2
+    assert await async_db_functions.get_user_version(async_db, first.user_id) == 3
+    assert await async_db_functions.get_user_version(async_db, second.user_id) == 2
+
+    # a writer still holding version 1 is refused inside its own write
+    workout_id = workout.workout_id
+    with pytest.raises(db_functions.VersionConflict):
+        await async_db_functions.update_workout(
+            async_db, workout_id, schemas.WorkoutUpdate(name="stale", user_id=None), versions=[1]
+        )
+    assert await async_db_functions.get_workout_version(async_db, workout_id) == 2
+
+
+@pytest.mark.asyncio
+async def test_workout_writes_are_logged_for_sync(async_db):
+    user = await async_db_functions.create_user(
+        async_db,
+        schemas.UserCreate(
+            name="sync", email="sync@example.com", password="pw", height=170, weight=70, gender="OTHER",
+            birth_date=None,
+        ),
+    )
+    workout = await async_db_functions.create_workout(
+        async_db,
+        schemas.WorkoutCreate(name="synced", user_id=user.user_id, dates=[{"date": "2023-01-01", "completed": False}]),
+    )
+    changes = await async_db_functions.get_changes(async_db, user.user_id)
+    assert [w.workout_id for w in changes["workouts"]] == [workout.workout_id]
+    date_id = changes["workout_dates"][0].id
+
+    await async_db_functions.delete_workout_date(async_db, date_id)
+    later = await async_db_functions.get_changes(async_db, user.user_id, since=changes["next_cursor"])
+    assert later["deleted"] == [{"kind": schemas.ChangeKind.WORKOUT_DATE, "id": date_id}]
+    assert later["workouts"] == []
+
+
+@pytest.mark.asyncio
+async def test_changes_renumbered_at_commit_follow_the_cursor(async_db):
+    user = await async_db_functions.create_user(
+        async_db,
+        schemas.UserCreate(
+            name="late", email="late@example.com", password="pw", height=170, weight=70, gender="OTHER",
+            birth_date=None,
+        ),
+    )
+    late = await async_db_functions.create_workout(
+        async_db, schemas.WorkoutCreate(name="committed late", user_id=user.user_id, dates=None)
+    )
+    late_id = late.workout_id
+    await async_db_functions.create_workout(
+        async_db, schemas.WorkoutCreate(name="committed first", user_id=user.user_id, dates=None)
+    )
+    assert "change_log_seqs" not in async_db.sync_session.info
+    changes = await async_db_functions.get_changes(async_db, user.user_id)
+
+    # the seqs a transaction drew early are replaced by ones after every committed entry
+    seqs = (
+        await async_db.scalars(
+            sa.select(models.ChangeLog.seq).where(
+                models.ChangeLog.kind == schemas.ChangeKind.WORKOUT.value, models.ChangeLog.entity_id == late_id
+            )
+        )
+    ).all()
+    await async_db.run_sync(db_functions.renumber_changes, seqs)
+    await async_db.commit()
+    later = await async_db_functions.get_changes(async_db, user.user_id, since=changes["next_cursor"])
+    assert [w.workout_id for w in later["workouts"]] == [late_id]
@@ -0,0 +1,476 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+import numpy as np
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from fitness_api.core import database, models, similarity
+from fitness_api.core.adherence import AdherenceCalendar
+from fitness_api.core.auth_executor import AuthExecutorSaturated, BoundedExecutor
+from fitness_api.core.friend_graph import FriendGraph
+from fitness_api.core.lang_catalog import LangCatalog
+from fitness_api.core.pool_metrics import InstrumentedQueuePool, instrument_engine
+from fitness_api.core.response_cache import (
+    LocalCacheBackend,
+    MemoryClient,
+    ResponseCache,
+    SharedCacheBackend,
+    expand_keys,
+)
+from fitness_api.core.schemas import VolumePeriod
+from fitness_api.core.search import PostgresSearchIndex, SqliteSearchIndex, search_terms
+from fitness_api.core.similarity import top_neighbours
+from fitness_api.core.tag_index import ExerciseBitmap, TagIndex
+from fitness_api.core.token_cache import TokenCache, UserSnapshot
+from fitness_api.core.volume import aggregate_volume, workout_totals
+
+
+def test_bounded_executor_rejects_when_queue_is_full():
+    executor = BoundedExecutor(max_workers=1, max_queue=1, name="test")
+    release = threading.Event()
+
+    async def run():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(executor.run(lambda: None))
+        await asyncio.sleep(0)
+        with pytest.raises(AuthExecutorSaturated):
+            await executor.run(lambda: None)
+        assert executor.stats()["queued"] == 1
+        release.set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(run())
+    stats = executor.stats()
+    assert stats["completed"] == 2
+    assert stats["rejected"] == 1
+    assert stats["peak_queue_depth"] == 1
+    executor.shutdown()
+
+
+def test_bounded_executor_frees_the_queue_slot_of_a_cancelled_task():
+    executor = BoundedExecutor(max_workers=1, max_queue=1, name="test")
+    release = threading.Event()
+
+    async def run():
+        first = asyncio.ensure_future(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        waiting = asyncio.ensure_future(executor.run(lambda: None))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert executor.stats()["queued"] == 0
+        # the slot is free again for the next request
+        second = asyncio.ensure_future(executor.run(lambda: None))
+        release.set()
+        await asyncio.gather(first, second)
+
+    try:
+        asyncio.run(run())
+    finally:
+        release.set()
+        executor.shutdown()
+    stats = executor.stats()
+    assert stats["queued"] == 0
+    assert stats["completed"] == 2
+
+
+def test_token_cache_is_bounded_by_exp_and_invalidated_per_user():
+    cache = TokenCache(max_entries=2, max_ttl=300)
+    user = UserSnapshot(user_id=1, email="a@example.com", account_type="USER", disabled=False, version=1)
+    cache.put("expired", {"sub": user.email, "exp": time.time() - 1}, user)
+    cache.put("valid", {"sub": user.email, "exp": time.time() + 60}, user)
+
+    assert cache.get("expired") is None
+    assert cache.get("valid").user == user
+
+    cache.invalidate_user(1)
+    assert cache.get("valid") is None
+
+
+def test_token_cache_entries_are_dropped_once_the_user_moves_on_elsewhere():
+    # two workers hold the same token, the user is disabled through the first one
+    first, second = TokenCache(max_entries=10, max_ttl=300), TokenCache(max_entries=10, max_ttl=300)
+    user = UserSnapshot(user_id=1, email="a@example.com", account_type="USER", disabled=False, version=1)
+    for cache in (first, second):
+        cache.put("token", {"sub": user.email, "exp": time.time() + 60}, user)
+    first.invalidate_user(1)
+
+    entry = second.get("token")
+    assert second.is_current(entry, 1)
+    assert not second.is_current(entry, 2)
+    assert second.get("token") is None
+    assert second.stats()["stale"] == 1
+
+
+def test_pool_metrics_track_checkouts_and_waits(tmp_path):
+    engine = sa.create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=1
+    )
+    metrics = instrument_engine(engine)
+    with engine.connect(), engine.connect():
+        stats = metrics.snapshot(engine.pool)
+        assert stats["in_use"] == 2
+        assert stats["overflow"] == 1
+    stats = metrics.snapshot(engine.pool)
+    assert stats["checkouts"] == 2
+    assert stats["overflow_connects"] == 1
+    assert stats["checkout_wait_ms"]["count"] == 2
+    assert stats["idle"] == 1
+
+
+def test_forked_worker_gets_its_own_engine():
+    parent_engine = database.engine
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        same = database.engine is parent_engine or database.engine.pool is parent_engine.pool
+        os.write(write_fd, b"same" if same else b"new")
+        os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 8) == b"new"
+    assert database.engine is parent_engine
+
+
+def test_create_all_backfills_friendship_edges(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'edges.db'}")
+    database.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.insert(models.FriendshipStatus), [{"status_id": 1, "name": "ACCEPTED"}])
+        conn.execute(
+            sa.insert(models.User),
+            [
+                {"user_id": user_id, "name": f"user {user_id}", "email": f"user{user_id}@example.com",
+                 "height": 180, "weight": 80, "gender": "OTHER", "friend_code": f"code{user_id}",
+                 "password_hash": "x", "account_type": "USER"}
+                for user_id in (1, 2, 3)
+            ],
+        )
+        # friendships written before friendship_edge existed
+        conn.execute(
+            sa.insert(models.Friendship),
+            [{"friendship_id": 1, "user_id": 1, "friend_id": 2, "status_id": 1},
+             {"friendship_id": 2, "user_id": 3, "friend_id": 1, "status_id": 1}],
+        )
+    database.Base.metadata.create_all(engine)
+    database.Base.metadata.create_all(engine)
+    with engine.connect() as conn:
+        edges = conn.execute(
+            sa.select(
+                models.FriendshipEdge.user_id, models.FriendshipEdge.friend_id, models.FriendshipEdge.friendship_id
+            ).order_by(models.FriendshipEdge.user_id, models.FriendshipEdge.friend_id)
+        ).all()
+    engine.dispose()
+    assert edges == [(1, 2, 1), (1, 3, 2), (2, 1, 1), (3, 1, 2)]
+
+
+def test_create_all_adds_columns_missing_from_existing_tables(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'columns.db'}")
+    database.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            sa.insert(models.User),
+            [{"user_id": 1, "name": "user 1", "email": "user1@example.com", "height": 180, "weight": 80,
+              "gender": "OTHER", "friend_code": "code1", "password_hash": "x", "account_type": "USER"}],
+        )
+        conn.execute(
+            sa.insert(models.Exercise),
+            [{"exercise_id": exercise_id, "name": f"exercise {exercise_id}", "user_id": 1,
+              "set": 3, "repetition": 10, "duration": 60}
+             for exercise_id in (1, 2)],
+        )
+        conn.execute(
+            sa.insert(models.Rating),
+            [{"rating": value, "user_id": 1, "exercise_id": 1} for value in (2, 5)],
+        )
+        # back to the tables as they were before versions and rating aggregates existed
+        conn.exec_driver_sql("DROP INDEX ix_exercise_rating_mean_exercise_id")
+        for table, column in (("user", "version"), ("workout", "version"), ("friendship", "version"),
+                              ("exercise", "rating_count"), ("exercise", "rating_sum"), ("exercise", "rating_mean")):
+            conn.exec_driver_sql(f'ALTER TABLE "{table}" DROP COLUMN {column}')
+    database.Base.metadata.create_all(engine)
+    database.Base.metadata.create_all(engine)
+
+    inspector = sa.inspect(engine)
+    assert "version" in {column["name"] for column in inspector.get_columns("friendship")}
+    assert "ix_exercise_rating_mean_exercise_id" in {index["name"] for index in inspector.get_indexes("exercise")}
+    with engine.connect() as conn:
+        assert conn.scalar(sa.select(models.User.version)) == 1
+        aggregates = conn.execute(
+            sa.select(models.Exercise.rating_count, models.Exercise.rating_sum, models.Exercise.rating_mean)
+            .order_by(models.Exercise.exercise_id)
+        ).all()
+    engine.dispose()
+    assert aggregates == [(2, 7, 3.5), (0, 0, None)]
+
+
+def test_lang_catalog_snapshots_outlive_writes_and_racing_loads_are_dropped(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'lang.db'}")
+    database.Base.metadata.create_all(engine)
+    catalog = LangCatalog(reload_seconds=300)
+    with Session(engine) as db:
+        db.add(models.Lang(bundles=[models.LangBundle(locale="de_DE", messages={"hello": "Hallo"})]))
+        db.commit()
+        snapshot = catalog.ensure_loaded(db)
+        catalog.invalidate()
+        # a request holding the snapshot keeps serving it while the catalog reloads
+        assert snapshot.message("de_DE", "hello") == "Hallo"
+        assert catalog.stats()["loaded"] and catalog.stats()["stale"]
+
+        # a write landing while a load runs: the load serves its caller but is not kept
+        scalars = db.scalars
+
+        def racing_scalars(*args, **kwargs):
+            result = scalars(*args, **kwargs)
+            catalog.invalidate()
+            return result
+
+        db.scalars = racing_scalars
+        assert catalog.ensure_loaded(db).bundle("de_DE") is not None
+        assert catalog.stats()["stale"]
+        db.scalars = scalars
+        reloaded = catalog.ensure_loaded(db)
+        assert not catalog.stats()["stale"]
+        assert catalog.ensure_loaded(db) is reloaded
+    engine.dispose()
+
+
+def test_search_indexes_match_only_the_last_term_as_a_prefix():
+    terms = search_terms("Zercher squ")
+    sqlite_match = SqliteSearchIndex().match(terms).compile()
+    postgres_query = PostgresSearchIndex()._query(terms).compile(dialect=postgresql.dialect())
+    assert '"zercher" "squ"*' in sqlite_match.params.values()
+    assert "zercher & squ:*" in postgres_query.params.values()
+
+
+def test_friend_graph_suggests_friends_of_friends_by_mutual_count():
+    graph = FriendGraph(reload_seconds=300)
+    graph._adjacency = {}
+    for user_id, friend_id in ((1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (2, 3)):
+        graph.set_friendship(user_id, friend_id, accepted=True)
+
+    assert list(graph.friends(3)) == [1, 2, 4, 5]
+    assert graph.mutual_friends(1, 4) == [2, 3]
+    assert graph.suggestions(1, limit=10) == [(4, 2), (5, 1)]
+
+    graph.set_friendship(3, 1, accepted=False)
+    assert list(graph.friends(1)) == [2]
+    assert graph.suggestions(1, limit=10) == [(3, 1), (4, 1)]
+
+
+class RacingRows(list):
+    def all(self):
+        return list(self)
+
+
+class RacingDatabase:
+    """hands out the given query results in order, running ``write`` as each query is answered"""
+
+    def __init__(self, results, write):
+        self.results = list(results)
+        self.write = write
+
+    def execute(self, statement):
+        self.write()
+        return RacingRows(self.results.pop(0))
+
+    scalars = execute
+
+
+def test_friend_graph_load_keeps_writes_made_while_it_reads():
+    graph = FriendGraph(reload_seconds=300)
+    # the load reads 1-2 as friends while that friendship is being ended and 1-3 made
+    racing = RacingDatabase(
+        [[(1, 2), (2, 1)]], lambda: (graph.set_friendship(1, 2, accepted=False), graph.set_friendship(1, 3, True))
+    )
+    graph.ensure_loaded(racing)
+    assert list(graph.friends(1)) == [3] and list(graph.friends(2)) == []
+    graph.set_friendship(3, 2, accepted=True)
+    assert list(graph.friends(3)) == [1, 2]
+
+
+def test_exercise_bitmap_matches_set_operations_across_container_kinds():
+    rng = np.random.default_rng(0)
+    # dense chunks become bitmaps, sparse ones arrays; the ids span several chunks
+    dense = set(range(0, 70_000, 2))
+    sparse = set(rng.choice(300_000, 3_000, replace=False).tolist())
+    mixed = set(rng.choice(140_000, 20_000, replace=False).tolist())
+    for a, b in ((dense, sparse), (sparse, mixed), (dense, mixed)):
+        bitmap_a, bitmap_b = ExerciseBitmap.from_ids(a), ExerciseBitmap.from_ids(b)
+        assert list(bitmap_a & bitmap_b) == sorted(a & b)
+        assert list(bitmap_a | bitmap_b) == sorted(a | b)
+        assert list(bitmap_a - bitmap_b) == sorted(a - b)
+    bitmap = ExerciseBitmap.from_ids(dense)
+    assert bitmap.size_in_bytes() < len(dense) * 2
+    assert list(islice(bitmap.ids_after(65_535), 3)) == [65_536, 65_538, 65_540]
+
+
+def test_tag_index_resolves_and_or_not_filters():
+    index = TagIndex(reload_seconds=300)
+    index._tags = {}
+    legs, bodyweight, barbell = 1, 2, 3
+    for exercise_id, tag_ids in (
+        (1, [legs, barbell]), (2, [legs, bodyweight]), (3, [bodyweight]), (4, [legs]), (5, []),
+    ):
+        index.set_exercise_tags(exercise_id, tag_ids)
+
+    assert list(index.matching([legs], none_of=[barbell])) == [2, 4]
+    assert list(index.matching(any_of=[bodyweight, barbell])) == [1, 2, 3]
+    assert list(index.matching(none_of=[legs])) == [3, 5]
+
+    index.set_exercise_tags(4, [bodyweight])
+    index.remove_exercise(2)
+    index.remove_tag(barbell)
+    assert list(index.matching([bodyweight])) == [3, 4]
+    assert list(index.matching(any_of=[legs, barbell])) == [1]
+    assert index.stats()["exercises"] == 4
+
+
+def test_tag_index_load_keeps_writes_made_while_it_reads():
+    index = TagIndex(reload_seconds=300)
+    legs, barbell = 1, 2
+    writes = iter([
+        lambda: index.set_exercise_tags(3, [legs]),
+        lambda: (index.remove_exercise(1), index.remove_tag(barbell)),
+    ])
+    racing = RacingDatabase([[1, 2], [(legs, 1), (barbell, 1), (legs, 2)]], lambda: next(writes)())
+    index.ensure_loaded(racing)
+    assert list(index.matching([legs])) == [2, 3]
+    assert list(index.matching(any_of=[barbell])) == []
+    assert index.stats()["exercises"] == 2
+
+
+def test_top_neighbours_rank_by_tag_cosine_times_rating_weight():
+    tags = {10: [1, 2], 11: [1, 2], 12: [1, 2, 3], 13: [3], 14: [4]}
+    pairs = np.array([(e, t) for e, ts in tags.items() for t in ts])
+    neighbours = {
+        exercise_id: (ids.tolist(), [round(score, 3) for score in scores.tolist()])
+        for exercise_id, ids, scores in top_neighbours(
+            pairs[:, 0], pairs[:, 1], {12: 0.5}, np.array([10, 13, 14, 99]), k=2
+        )
+    }
+    # 11 shares both tags (cosine 1), 12 shares two of three (0.816) but is rated low
+    assert neighbours[10] == ([11, 12], [1.0, 0.408])
+    assert neighbours[13] == ([12], [0.289])
+    assert neighbours[14] == ([], [])
+    assert 99 not in neighbours
+
+
+def test_top_neighbours_do_not_depend_on_the_block_bound(monkeypatch):
+    rng = np.random.default_rng(7)
+    pairs = np.unique(np.stack([rng.integers(1, 60, 400), rng.integers(1, 25, 400)], axis=1), axis=0)
+    weights = {exercise_id: float(rng.uniform(0.5, 1.5)) for exercise_id in range(1, 60, 3)}
+    targets = np.arange(1, 60)
+
+    def neighbours():
+        return {
+            exercise_id: (ids.tolist(), scores.tolist())
+            for exercise_id, ids, scores in top_neighbours(pairs[:, 0], pairs[:, 1], weights, targets, k=5)
+        }
+
+    expected = neighbours()
+    # blocks of one exercise against chunks of a few exercises at a time
+    monkeypatch.setattr(similarity, "MAX_BLOCK_CELLS", 40)
+    assert neighbours() == expected
+
+
+def test_adherence_calendar_streaks_and_weekly_rate():
+    today = date(2024, 3, 10)
+    calendar = AdherenceCalendar(start=today)
+    for days_ago in (0, 1, 2, 5, 6, 7, 8, 20):
+        calendar.set_day(today - timedelta(days=days_ago), scheduled=True, completed=days_ago != 0)
+    calendar.set_day(today - timedelta(days=3), scheduled=True, completed=False)
+
+    stats = calendar.stats(today)
+    assert calendar.start == today - timedelta(days=20)
+    # today is scheduled but not done yet, the streak through yesterday still counts
+    assert stats["current_streak"] == 2
+    assert stats["longest_streak"] == 4
+    assert (stats["scheduled_this_week"], stats["completed_this_week"]) == (6, 4)
+    assert stats["weekly_completion_rate"] == 4 / 6
+
+    calendar.set_day(today - timedelta(days=1), scheduled=False, completed=False)
+    assert calendar.stats(today)["current_streak"] == 0
+    assert AdherenceCalendar.from_bytes(AdherenceCalendar.to_bytes(calendar.completed)) == calendar.completed
+
+
+def test_volume_is_summed_per_workout_and_bucketed_by_iso_week_and_month():
+    workout_ids, totals = workout_totals(
+        workout_ids=np.array([7, 3, 7]),
+        sets=np.array([3.0, 3.0, 2.0]),
+        repetitions=np.array([10.0, 5.0, 5.0]),
+        weights=np.array([100.0, np.nan, 50.0]),
+        durations=np.array([0.0, 60.0, 0.0]),
+        rpes=np.array([8.0, 9.0, np.nan]),
+    )
+    assert workout_ids.tolist() == [3, 7]
+    assert totals["tonnage"].tolist() == [0, 3500]
+
+    # workout 5 has no exercises and adds nothing
+    date_workout_ids = np.array([7, 3, 7, 5])
+    days = np.array(["2024-01-28", "2024-01-29", "2024-02-04", "2024-02-05"], dtype="datetime64[D]")
+    weeks = aggregate_volume(workout_ids, totals, date_workout_ids, days, VolumePeriod.WEEK)
+    assert weeks == [
+        {"start": date(2024, 1, 22), "sessions": 2, "tonnage": 3500, "total_time": 0, "rpe_load": 2400},
+        {"start": date(2024, 1, 29), "sessions": 3, "tonnage": 3500, "total_time": 180, "rpe_load": 2400},
+    ]
+    months = aggregate_volume(workout_ids, totals, date_workout_ids, days, VolumePeriod.MONTH)
+    assert [(bucket["start"], bucket["sessions"]) for bucket in months] == [
+        (date(2024, 1, 1), 3), (date(2024, 2, 1), 2),
+    ]
+
+
+def test_local_response_cache_evicts_by_entries_bytes_and_ttl():
+    backend = LocalCacheBackend(max_entries=3, max_bytes=10)
+    backend.set("a", b"1234", ttl=60)
+    backend.set("b", b"1234", ttl=60)
+    backend.get("a")
+    # over 10 bytes, so the least recently used entry goes
+    backend.set("c", b"1234", ttl=60)
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == (b"1234", None, b"1234")
+    assert backend.stats() == {"backend": "local", "entries": 2, "bytes": 8}
+    backend.set("d", b"x", ttl=0)
+    assert backend.get("d") is None
+
+
+def test_shared_response_cache_forgets_keys_and_list_pages():
+    cache = ResponseCache(SharedCacheBackend(MemoryClient()), ttl_seconds=60)
+    page = cache.list_key("tags", None, 50)
+    assert cache.list_key("tags", None, 50) == page
+    cache.put(page, b"[]", cache.guard(page))
+    cache.put("tag:1:", b"{}", cache.guard("tag:1:"))
+    assert cache.get(page) == b"[]"
+
+    cache.forget(["tag:1:"], ["tags"])
+    assert cache.get("tag:1:") is None
+    assert cache.list_key("tags", None, 50) != page
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_response_cache_drops_bodies_built_across_a_write():
+    for backend in (LocalCacheBackend(max_entries=10, max_bytes=1000), SharedCacheBackend(MemoryClient())):
+        cache = ResponseCache(backend, ttl_seconds=60)
+        # the read misses and starts building, a write commits and forgets the entity, the read stores
+        guard = cache.guard("workout:1:dates")
+        cache.forget(["workout:1:", "workout:1:dates"])
+        cache.put("workout:1:dates", b"stale", guard)
+        assert cache.get("workout:1:dates") is None
+        assert cache.stats()["raced"] == 1
+
+        cache.put("workout:1:dates", b"fresh", cache.guard("workout:1:dates"))
+        assert cache.get("workout:1:dates") == b"fresh"
+
+
+def test_expand_keys_cover_every_expand_tree():
+    assert expand_keys(("exercises", "exercises.tags", "dates")) == [
+        "", "dates", "dates,exercises", "dates,exercises,exercises.tags", "exercises", "exercises,exercises.tags",
+    ]
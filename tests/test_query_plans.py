@@ -0,0 +1,179 @@
+"""
+EXPLAIN QUERY PLAN checks for the lookups every request depends on
+
+Each case runs a db_functions call against a throwaway SQLite database, captures
+the SELECT/UPDATE/DELETE statements it issues (including relationship loads) and
+fails if SQLite plans a full scan of a table for any of them.
+"""
+import re
+from contextlib import contextmanager
+from datetime import date
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from fitness_api.core import database, db_functions, models, schemas
+from fitness_api.core.similarity import compute_similarity
+from fitness_api.core.tag_cache import tag_cache
+from fitness_api.core.tag_index import tag_index
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    database.Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed(session)
+        # built once per process rather than per request, so its full read is not a lookup
+        tag_index.ensure_loaded(session)
+        yield session
+    engine.dispose()
+    tag_cache.clear()
+    tag_index.clear()
+
+
+def seed(db: Session):
+    db.add(models.FriendshipStatus(status_id=1, name="ACCEPTED"))
+    for user_id in (1, 2, 3):
+        db.add(
+            models.User(
+                user_id=user_id, name=f"user {user_id}", email=f"user{user_id}@example.com",
+                height=180, weight=80, gender="OTHER", friend_code=f"code{user_id}",
+                password_hash="x", account_type="USER",
+            )
+        )
+    for user_id, friend_id in ((1, 2), (3, 1)):
+        db.add(
+            models.Friendship(
+                user_id=user_id, friend_id=friend_id, status_id=1,
+                edges=db_functions.friendship_edges(user_id, friend_id),
+            )
+        )
+    db.add(models.Workout(workout_id=1, name="workout", user_id=1))
+    db.add(models.WorkoutDate(workout_id=1, date=date(2023, 1, 1)))
+    db.add(
+        models.Exercise(
+            exercise_id=1, name="squat", user_id=1, set=3, repetition=5, duration=0, workout_id=1
+        )
+    )
+    db.add(models.Exercise(exercise_id=2, name="lunge", set=3, repetition=8, duration=0))
+    db.add(models.Tag(tag_id=1, name="legs"))
+    db.add(models.ExerciseTag(exercise_id=1, tag_id=1))
+    db.add(models.ExerciseTag(exercise_id=2, tag_id=1))
+    db.add(models.Rating(rating=4, user_id=2, exercise_id=1))
+    db.commit()
+    db.expunge_all()
+
+
+@contextmanager
+def captured_statements(db: Session):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.append((statement, parameters))
+
+    engine = db.get_bind()
+    sa.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def full_scans(db: Session, statements) -> list[str]:
+    scans = []
+    for statement, parameters in statements:
+        plan = db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        for row in plan:
+            detail = row[-1]
+            # "SCAN t USING INDEX ..." walks an index in order, "SCAN t" reads every row;
+            # "SCAN CONSTANT ROW" is the list of an IN (VALUES ...), not a table, and
+            # "SCAN t VIRTUAL TABLE INDEX n:<constraints>" is an FTS5 lookup (M for a
+            # full-text match, = for a rowid) rather than a walk over every document
+            if (
+                detail.startswith("SCAN ")
+                and "USING" not in detail
+                and detail != "SCAN CONSTANT ROW"
+                and not re.search(r"VIRTUAL TABLE INDEX \d+:\S", detail)
+            ):
+                scans.append(f"{detail}\n    in: {statement}")
+    return scans
+
+
+HOT_LOOKUPS = {
+    "get_user_by_email": lambda db: db_functions.get_user(db, user_email="user1@example.com"),
+    "get_user_by_id": lambda db: db_functions.get_user(db, user_id=1),
+    "get_user_id_from_friend_code": lambda db: db_functions.get_user_id_from_friend_code(db, "code2"),
+    "get_friendship": lambda db: db_functions.get_friendship(db, 1),
+    "get_all_friendships_for_user": lambda db: db_functions.get_all_friendships_for_user(db, 1),
+    "get_all_friendships_for_user_next_page": lambda db: db_functions.get_all_friendships_for_user(
+        db, 1, cursor=db_functions.encode_cursor(1)
+    ),
+    "get_friendship_page_versions": lambda db: db_functions.get_friendship_page_versions(
+        db, 1, cursor=db_functions.encode_cursor(1)
+    ),
+    "get_friends": lambda db: db_functions.get_friends(db, 1),
+    "get_friends_next_page": lambda db: db_functions.get_friends(
+        db, 1, schemas.StatusEnum.ACCEPTED, cursor=db_functions.encode_cursor(1)
+    ),
+    "get_workout": lambda db: db_functions.get_workout(db, 1),
+    "get_many_workouts": lambda db: db_functions.get_many(
+        db, models.Workout, [1, 2], db_functions.parse_expand(None, db_functions.WORKOUT_EXPANSIONS)
+    ),
+    "get_workout_version": lambda db: db_functions.get_workout_version(db, 1),
+    "update_workout": lambda db: db_functions.update_workout(
+        db, 1, schemas.WorkoutUpdate(name="renamed", user_id=None)
+    ),
+    "get_adherence_stats": lambda db: db_functions.get_adherence_stats(db, 1),
+    "refresh_adherence_days": lambda db: (
+        db_functions.get_adherence_stats(db, 1),
+        db_functions.refresh_adherence_days(db, 1, [date(2023, 1, 1)]),
+    ),
+    "get_volume_stats": lambda db: db_functions.get_volume_stats(db, 1, since=date(2023, 1, 1)),
+    "get_exercise": lambda db: db_functions.get_exercise(db, 1),
+    "get_top_rated_exercises": lambda db: db_functions.get_top_rated_exercises(db, limit=10),
+    "get_top_rated_exercises_for_tag": lambda db: db_functions.get_top_rated_exercises(db, "legs", limit=10),
+    "create_rating": lambda db: db_functions.create_rating(
+        db, schemas.RatingCreate(rating=5, user_id=3, exercise_id=1)
+    ),
+    "get_personal_records": lambda db: db_functions.get_personal_records(db, 1),
+    "retire_personal_record": lambda db: (
+        db_functions.record_personal_bests(db, [db_functions.get_exercise(db, 1)]),
+        db_functions.retire_personal_record(db, 1, (1, "squat", 0.0)),
+    ),
+    "search_exercises": lambda db: db_functions.search_exercises(db, "squ", ["legs"]),
+    "search_exercises_next_page": lambda db: db_functions.search_exercises(
+        db, "squat", cursor=db_functions.search_cursor(-1.0, 1)
+    ),
+    "index_exercises": lambda db: db_functions.index_exercises(db, [1]),
+    "get_exercises_by_tags": lambda db: db_functions.get_exercises_by_tags(
+        db, ["legs"], exclude_tags=["barbell"], cursor=db_functions.encode_cursor(0)
+    ),
+    "get_similar_exercises": lambda db: (
+        compute_similarity(db, [1]),
+        db_functions.get_similar_exercises(db, 1, limit=10),
+    ),
+    "record_exercise_changes": lambda db: db_functions.record_changes(db, schemas.ChangeKind.EXERCISE, [1]),
+    "record_friendship_changes": lambda db: db_functions.record_changes(
+        db, schemas.ChangeKind.FRIENDSHIP, [1], deleted=True
+    ),
+    "get_changes": lambda db: (
+        db_functions.record_workout_changes(db, [1]),
+        db_functions.get_changes(db, 1, since=db_functions.encode_cursor(0)),
+    ),
+    "get_rating": lambda db: db_functions.get_rating(db, 1),
+    "get_tag": lambda db: db_functions.get_tag(db, 1),
+    "get_tags_next_page": lambda db: db_functions.get_tags(db, cursor=db_functions.encode_cursor(0)),
+    "resolve_tags": lambda db: db_functions.resolve_tags(db, ["legs", "push"]),
+    "replace_exercise_tags": lambda db: db_functions.set_exercise_tags(db, 1, [1], replace=True),
+}
+
+
+@pytest.mark.parametrize("lookup", HOT_LOOKUPS.values(), ids=HOT_LOOKUPS.keys())
+def test_hot_lookup_does_not_scan_tables(db, lookup):
+    with captured_statements(db) as statements:
+        lookup(db)
+    assert statements
+    assert full_scans(db, statements) == []
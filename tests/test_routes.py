@@ -1,9 +1,15 @@
+from contextlib import contextmanager
+
+import sqlalchemy as sa
 from fastapi.testclient import TestClient
 import fastapi as _fastapi
 from fastapi.middleware.cors import CORSMiddleware
 
 import fitness_api.settings as _settings
-from fitness_api.routes import token, user, friendship, exercise, workout, rating, tag
+from fitness_api.core import database, models
+from fitness_api.core.response_cache import response_cache
+from fitness_api.core.similarity import SimilarityRefresher, similarity_refresher
+from fitness_api.routes import token, user, friendship, exercise, workout, rating, tag, lang, sync
 
 app = _fastapi.FastAPI(docs_url="/", redoc_url="/redoc")
 
@@ -22,6 +28,8 @@ app.include_router(exercise.router)
 app.include_router(workout.router)
 app.include_router(rating.router)
 app.include_router(tag.router)
+app.include_router(lang.router)
+app.include_router(sync.router)
 
 client = TestClient(app)
 
@@ -51,3 +59,802 @@ def test_read_user_with_id():
     assert response.status_code == 200
     data = response.json()
     assert data["user_id"] == 1
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sa.event.listen(database.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(database.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def create_user_with_workouts(email: str, workout_count: int) -> int:
+    user_id = client.post(
+        "/user/",
+        json={
+            "name": "budgetuser",
+            "email": email,
+            "password": "testpassword",
+            "height": 180,
+            "weight": 80,
+            "gender": "MALE",
+            "birth_date": "1990-01-01",
+        },
+    ).json()["user_id"]
+    for i in range(workout_count):
+        workout_id = client.post(
+            "/workout/",
+            json={"name": f"workout {i}", "user_id": user_id, "dates": [{"date": "2023-01-01", "completed": False}]},
+        ).json()["workout_id"]
+        for j in range(2):
+            client.post(
+                "/exercise/",
+                json={
+                    "name": f"exercise {j}", "description": None, "video_url": None, "user_id": user_id,
+                    "set": 3, "repetition": 10, "duration": 0, "weight": 50, "rpe": 7,
+                    "workout_id": workout_id, "tags": [f"tag {j}", "shared"],
+                },
+            )
+    return user_id
+
+
+def test_user_read_query_budget_does_not_grow_with_workouts():
+    small_user = create_user_with_workouts("budget1@example.com", 1)
+    large_user = create_user_with_workouts("budget5@example.com", 5)
+
+    with count_queries() as small_queries:
+        response = client.get(f"/user/{small_user}")
+    assert len(response.json()["workouts"]) == 1
+
+    with count_queries() as large_queries:
+        response = client.get(f"/user/{large_user}")
+    workouts = response.json()["workouts"]
+    assert len(workouts) == 5
+    assert all(len(workout["exercises"]) == 2 and len(workout["dates"]) == 1 for workout in workouts)
+
+    # user, workouts, exercises, tags and dates: one query each
+    assert len(large_queries) == len(small_queries) <= 5
+
+    with count_queries() as workout_queries:
+        response = client.get(f"/workout/{workouts[0]['workout_id']}")
+    assert len(response.json()["exercises"]) == 2
+    assert len(workout_queries) <= 4
+
+
+def test_read_user_profile_only_is_a_single_query():
+    user_id = create_user_with_workouts("shallow@example.com", 2)
+
+    with count_queries() as queries:
+        response = client.get(f"/user/{user_id}", params={"expand": "none"})
+    assert response.status_code == 200
+    assert "workouts" not in response.json()
+    assert len(queries) == 1
+
+    response = client.get(f"/user/{user_id}", params={"expand": "workouts.dates"})
+    workouts = response.json()["workouts"]
+    assert len(workouts) == 2
+    assert "dates" in workouts[0] and "exercises" not in workouts[0]
+
+    response = client.get(f"/user/{user_id}", params={"expand": "friends"})
+    assert response.status_code == 400
+
+
+def test_tags_are_served_in_keyset_pages():
+    for i in range(5):
+        client.post("/tag/", json={"name": f"paged tag {i}"})
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        page = client.get("/tags/", params=params).json()
+        assert len(page["items"]) <= 2
+        seen.extend(tag["tag_id"] for tag in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == sorted(seen)
+    assert len(seen) == len(set(seen))
+    assert {f"paged tag {i}" for i in range(5)} <= {
+        tag["name"] for tag in client.get("/tags/", params={"limit": 200}).json()["items"]
+    }
+    assert client.get("/tags/", params={"cursor": "not a cursor"}).status_code == 400
+
+
+def test_bulk_workout_creation_reports_rejected_items():
+    user_id = client.get("/user/1").json()["user_id"]
+    exercise = {
+        "name": "bulk squat", "description": None, "video_url": None, "user_id": user_id,
+        "set": 5, "repetition": 5, "duration": 0, "weight": 100, "rpe": 8, "workout_id": None,
+        "tags": ["legs", "bulk tag"],
+    }
+    response = client.post(
+        "/workouts/bulk",
+        json=[
+            {"name": "bulk a", "user_id": user_id, "dates": [{"date": "2023-02-01", "completed": True}],
+             "exercises": [exercise, exercise]},
+            {"name": "bulk bad", "user_id": 999999},
+            {"name": "bulk b", "user_id": user_id},
+            # values the columns cannot hold fail their item only
+            {"name": "x" * 51, "user_id": user_id},
+            {"name": "bulk c", "user_id": user_id, "exercises": [{**exercise, "set": 2**31}]},
+            {"name": "bulk d", "user_id": user_id, "exercises": [{**exercise, "tags": ["t" * 51]}]},
+        ],
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert [item["index"] for item in result["created"]] == [0, 2]
+    assert result["errors"] == [
+        {"index": 1, "detail": "User 999999 does not exist"},
+        {"index": 3, "detail": "Workout name is longer than 50 characters"},
+        {"index": 4, "detail": "Exercise 'bulk squat': set is out of range"},
+        {"index": 5, "detail": "Tag of exercise 'bulk squat': name is longer than 50 characters"},
+    ]
+    assert len(result["created"][0]["exercise_ids"]) == 2
+
+    workout = client.get(f"/workout/{result['created'][0]['workout_id']}").json()
+    assert workout["name"] == "bulk a"
+    assert workout["dates"][0]["completed"] is True
+    assert {tag["name"] for tag in workout["exercises"][0]["tags"]} == {"legs", "bulk tag"}
+
+
+def test_exercise_tags_are_resolved_in_a_fixed_number_of_queries():
+    exercise = {
+        "name": "tagged", "description": None, "video_url": None, "user_id": None,
+        "set": 1, "repetition": 1, "duration": 0, "weight": None, "rpe": None, "workout_id": None,
+        "tags": [f"resolve {i}" for i in range(8)],
+    }
+    with count_queries() as queries:
+        response = client.post("/exercise/", json=exercise)
+    assert response.status_code == 200
+    assert len(response.json()["tags"]) == 8
+    # tag upsert, tag lookup, exercise insert, exercise_tag insert, search document insert,
+    # change log insert, reload with tags
+    assert len(queries) <= 8
+
+    exercise_id = response.json()["exercise_id"]
+    response = client.put(f"/exercise/{exercise_id}", json={**exercise, "tags": ["resolve 0", "resolve new"]})
+    assert {tag["name"] for tag in response.json()["tags"]} == {"resolve 0", "resolve new"}
+
+
+def test_friend_list_is_one_joined_query_in_both_directions():
+    user_ids = [
+        client.post(
+            "/user/",
+            json={
+                "name": f"friend {i}", "email": f"friend{i}@example.com", "password": "testpassword",
+                "height": 170, "weight": 70, "gender": "OTHER", "birth_date": None,
+            },
+        ).json()["user_id"]
+        for i in range(3)
+    ]
+    status_id = client.post("/status/", json={"name": "ACCEPTED"}).json()["status_id"]
+    # user 0 asked user 1, user 2 asked user 0
+    for user_id, friend_id in ((user_ids[0], user_ids[1]), (user_ids[2], user_ids[0])):
+        response = client.post(
+            "/friendship/", json={"user_id": user_id, "friend_id": friend_id, "status_id": status_id}
+        )
+        assert response.status_code == 200
+        assert response.json()["user_id"] == user_id
+
+    with count_queries() as queries:
+        page = client.get(f"/friends/user/{user_ids[0]}").json()
+    assert len(queries) == 1
+    assert [friend["friend"]["user_id"] for friend in page["items"]] == user_ids[1:]
+    assert {friend["status"] for friend in page["items"]} == {"ACCEPTED"}
+    assert page["items"][0]["friend"]["name"] == "friend 1"
+
+    friendships = client.get(f"/friendships/user/{user_ids[0]}").json()["items"]
+    assert len(friendships) == 2
+    assert client.get(f"/friends/user/{user_ids[1]}").json()["items"][0]["friend"]["user_id"] == user_ids[0]
+    assert client.get(f"/friends/user/{user_ids[0]}", params={"status": "PENDING"}).json()["items"] == []
+
+
+def test_friend_suggestions_follow_friendship_writes():
+    a, b, c, d = [
+        client.post(
+            "/user/",
+            json={
+                "name": f"graph {i}", "email": f"graph{i}@example.com", "password": "testpassword",
+                "height": 170, "weight": 70, "gender": "OTHER", "birth_date": None,
+            },
+        ).json()["user_id"]
+        for i in range(4)
+    ]
+    accepted = client.post("/status/", json={"name": "ACCEPTED"}).json()["status_id"]
+    pending = client.post("/status/", json={"name": "PENDING"}).json()["status_id"]
+
+    def befriend(user_id, friend_id, status_id):
+        return client.post(
+            "/friendship/", json={"user_id": user_id, "friend_id": friend_id, "status_id": status_id}
+        ).json()["friendship_id"]
+
+    befriend(a, b, accepted)
+    b_c = befriend(b, c, accepted)
+    a_d = befriend(a, d, pending)
+    befriend(d, c, accepted)
+
+    suggestions = client.get(f"/friends/user/{a}/suggestions").json()
+    assert [(s["user"]["user_id"], s["mutual_friends"]) for s in suggestions] == [(c, 1)]
+
+    client.put(f"/friendship/{a_d}/", params={"status_id": accepted})
+    assert client.get(f"/friends/user/{a}/mutual/{c}").json()["count"] == 2
+
+    client.delete(f"/friendship/{b_c}")
+    assert client.delete(f"/friendship/{b_c}").status_code == 404
+    suggestions = client.get(f"/friends/user/{a}/suggestions").json()
+    assert [(s["user"]["user_id"], s["mutual_friends"]) for s in suggestions] == [(c, 1)]
+    assert client.get(f"/friends/user/{a}/suggestions", params={"limit": 0}).status_code == 422
+
+
+def test_rating_aggregates_follow_rating_writes_and_rank_exercises():
+    def create_exercise(name, tags):
+        return client.post(
+            "/exercise/",
+            json={
+                "name": name, "description": None, "video_url": None, "user_id": None,
+                "set": 1, "repetition": 1, "duration": 0, "weight": None, "rpe": None, "workout_id": None,
+                "tags": tags,
+            },
+        ).json()["exercise_id"]
+
+    ranked = create_exercise("ranked", ["top rated tag"])
+    other = create_exercise("other ranked", [])
+    first = client.post("/rating/", json={"rating": 4, "user_id": 1, "exercise_id": ranked}).json()["rating_id"]
+    second = client.post("/rating/", json={"rating": 2, "user_id": 1, "exercise_id": ranked}).json()["rating_id"]
+    client.post("/rating/", json={"rating": 3.5, "user_id": 1, "exercise_id": other})
+
+    exercise = client.get(f"/exercise/{ranked}").json()
+    assert (exercise["rating_count"], exercise["rating_sum"], exercise["rating_mean"]) == (2, 6, 3)
+
+    client.put(f"/rating/{second}", json={"rating": 5, "user_id": 1, "exercise_id": ranked})
+    assert client.get(f"/exercise/{ranked}").json()["rating_mean"] == 4.5
+    top = [e["exercise_id"] for e in client.get("/exercises/top-rated", params={"limit": 200}).json()]
+    assert top.index(ranked) < top.index(other)
+    assert [e["exercise_id"] for e in client.get("/exercises/top-rated", params={"tag": "top rated tag"}).json()] == [
+        ranked
+    ]
+
+    # moving a rating to another exercise updates both aggregates
+    client.put(f"/rating/{first}", json={"rating": 4, "user_id": 1, "exercise_id": other})
+    assert client.get(f"/exercise/{other}").json()["rating_mean"] == 3.75
+    client.delete(f"/rating/{second}")
+    exercise = client.get(f"/exercise/{ranked}").json()
+    assert (exercise["rating_count"], exercise["rating_sum"], exercise["rating_mean"]) == (0, 0, None)
+    assert ranked not in [e["exercise_id"] for e in client.get("/exercises/top-rated", params={"limit": 200}).json()]
+
+
+def create_logged_in_user(email: str) -> tuple[int, dict]:
+    user_id = client.post(
+        "/user/",
+        json={
+            "name": "stats user", "email": email, "password": "testpassword",
+            "height": 170, "weight": 70, "gender": "OTHER", "birth_date": None,
+        },
+    ).json()["user_id"]
+    token = client.post("/token", data={"username": email, "password": "testpassword"}).json()
+    return user_id, {"Authorization": f"Bearer {token['access_token']}"}
+
+
+def test_adherence_stats_follow_workout_date_writes():
+    user_id, headers = create_logged_in_user("streak@example.com")
+    workout_id = client.post(
+        "/workout/", json={"name": "streak workout", "user_id": user_id, "dates": None}
+    ).json()["workout_id"]
+    date_ids = [
+        client.post(
+            "/workout/date/", json={"workout_id": workout_id, "date": f"2024-03-0{day}", "completed": day != 6}
+        ).json()["id"]
+        for day in (1, 2, 3, 5, 6)
+    ]
+
+    def stats():
+        return client.get("/user/me/stats/adherence", params={"today": "2024-03-06"}, headers=headers).json()
+
+    # the first read builds the calendar, later reads use the incremental updates
+    assert stats() == {
+        "current_streak": 1, "longest_streak": 3, "week_start": "2024-02-29",
+        "scheduled_this_week": 5, "completed_this_week": 4, "weekly_completion_rate": 0.8,
+    }
+
+    client.put(f"/workout/date/{date_ids[4]}", json={"date": "2024-03-04", "completed": True})
+    assert (stats()["current_streak"], stats()["longest_streak"]) == (5, 5)
+
+    client.delete(f"/workout/date/{date_ids[1]}")
+    assert (stats()["current_streak"], stats()["longest_streak"], stats()["scheduled_this_week"]) == (3, 3, 4)
+    assert client.get("/user/me/stats/adherence").status_code == 401
+
+
+def test_volume_stats_are_bucketed_per_period():
+    user_id, headers = create_logged_in_user("volume@example.com")
+    workout = client.post(
+        "/workouts/bulk",
+        json=[
+            {
+                "name": "volume", "user_id": user_id,
+                "dates": [
+                    {"date": "2024-03-04", "completed": True},
+                    {"date": "2024-03-06", "completed": True},
+                    {"date": "2024-03-12", "completed": False},
+                ],
+                "exercises": [
+                    {"name": "press", "description": None, "video_url": None, "user_id": user_id, "set": 5,
+                     "repetition": 5, "duration": 0, "weight": 60, "rpe": 8, "workout_id": None},
+                    {"name": "plank", "description": None, "video_url": None, "user_id": user_id, "set": 3,
+                     "repetition": 1, "duration": 45, "weight": None, "rpe": None, "workout_id": None},
+                ],
+            }
+        ],
+    )
+    assert workout.status_code == 200 and workout.json()["errors"] == []
+
+    stats = client.get("/user/me/stats/volume", headers=headers).json()
+    assert stats["period"] == "week"
+    assert stats["buckets"] == [
+        {"start": "2024-03-04", "sessions": 4, "tonnage": 3000, "total_time": 270, "rpe_load": 2400}
+    ]
+
+    days = client.get(
+        "/user/me/stats/volume",
+        params={"period": "day", "completed_only": False, "since": "2024-03-05"},
+        headers=headers,
+    ).json()["buckets"]
+    assert [(day["start"], day["sessions"]) for day in days] == [("2024-03-06", 2), ("2024-03-12", 2)]
+
+
+def test_personal_records_follow_exercise_writes():
+    user_id, headers = create_logged_in_user("records@example.com")
+    workout_id = client.post(
+        "/workout/", json={"name": "records workout", "user_id": user_id, "dates": None}
+    ).json()["workout_id"]
+
+    def squat(repetition, weight):
+        return {"name": "squat", "description": None, "video_url": None, "user_id": user_id, "set": 3,
+                "repetition": repetition, "duration": 0, "weight": weight, "rpe": None, "workout_id": workout_id}
+
+    def add(repetition, weight):
+        return client.post("/exercise/", json=squat(repetition, weight)).json()["exercise_id"]
+
+    first, best, heavy = add(5, 100), add(8, 100), add(3, 120)
+
+    def records():
+        return client.get("/user/me/records", headers=headers).json()
+
+    assert records() == [
+        {
+            "exercise_name": "squat", "best_weight": 120, "estimated_1rm": 132,
+            "reps_by_weight": [
+                {"weight": 100, "repetition": 8, "exercise_id": best},
+                {"weight": 120, "repetition": 3, "exercise_id": heavy},
+            ],
+        }
+    ]
+
+    # retiring the record holder falls back to the next best set at that weight
+    client.delete(f"/exercise/{best}")
+    assert records()[0]["reps_by_weight"][0] == {"weight": 100, "repetition": 5, "exercise_id": first}
+
+    client.put(f"/exercise/{heavy}", json={**squat(3, 140), "tags": None})
+    assert [r["weight"] for r in records()[0]["reps_by_weight"]] == [100, 140]
+    assert client.get("/user/me/records").status_code == 401
+
+
+def test_exercise_search_is_ranked_filtered_and_paginated():
+    def add(name, description, tags):
+        return client.post(
+            "/exercise/",
+            json={"name": name, "description": description, "video_url": None, "user_id": None, "set": 3,
+                  "repetition": 5, "duration": 0, "weight": None, "rpe": None, "workout_id": None, "tags": tags},
+        ).json()["exercise_id"]
+
+    name_match = add("zercher squat", None, ["legs"])
+    description_match = add("good morning", "hinge, not a zercher squat", ["hamstrings"])
+    tag_match = add("carry", None, ["zercher"])
+
+    def search(**params):
+        return client.get("/exercises/search", params=params).json()
+
+    page = search(q="zerch", limit=2)
+    assert [e["exercise_id"] for e in page["items"]] == [name_match, tag_match]
+    rest = search(q="zerch", limit=2, cursor=page["next_cursor"])
+    assert [e["exercise_id"] for e in rest["items"]] == [description_match] and rest["next_cursor"] is None
+
+    assert [e["exercise_id"] for e in search(q="zercher squat", tags=["hamstrings"])["items"]] == [description_match]
+    # only the last word matches as a prefix
+    assert sorted(e["exercise_id"] for e in search(q="zercher squ")["items"]) == [name_match, description_match]
+    assert search(q="zerch squat")["items"] == []
+
+    # tag renames and exercise writes reach the index
+    tag_id = next(t["tag_id"] for t in client.get(f"/exercise/{tag_match}").json()["tags"])
+    client.put(f"/tag/{tag_id}/", json={"name": "loaded carry"})
+    assert [e["exercise_id"] for e in search(q="zercher")["items"]] == [name_match, description_match]
+    client.delete(f"/exercise/{name_match}")
+    assert [e["exercise_id"] for e in search(q="zercher")["items"]] == [description_match]
+    assert search(q="   ")["items"] == []
+    assert client.get("/exercises/search", params={"q": "x", "cursor": "bm90IGEgY3Vyc29y"}).status_code == 400
+
+
+def test_exercises_are_browsed_by_tag_filters():
+    def add(name, tags):
+        return client.post(
+            "/exercise/",
+            json={"name": name, "description": None, "video_url": None, "user_id": None, "set": 3,
+                  "repetition": 5, "duration": 0, "weight": None, "rpe": None, "workout_id": None, "tags": tags},
+        ).json()["exercise_id"]
+
+    def browse(**params):
+        return client.get("/exercises/browse", params=params).json()
+
+    # the first browse loads the index, later writes update it in place
+    browse(tags=["browse legs"])
+    back_squat = add("back squat", ["browse legs", "browse barbell"])
+    pistol = add("pistol squat", ["browse legs", "browse no-equipment"])
+    lunge = add("lunge", ["browse legs", "browse no-equipment"])
+    push_up = add("push up", ["browse no-equipment"])
+
+    no_equipment_legs = browse(tags=["browse legs", "browse no-equipment"], exclude_tags=["browse barbell"], limit=1)
+    assert [e["exercise_id"] for e in no_equipment_legs["items"]] == [pistol]
+    rest = browse(tags=["browse legs", "browse no-equipment"], cursor=no_equipment_legs["next_cursor"])
+    assert [e["exercise_id"] for e in rest["items"]] == [lunge] and rest["next_cursor"] is None
+    assert [e["exercise_id"] for e in browse(any_tags=["browse barbell", "browse no-equipment"])["items"]] == [
+        back_squat, pistol, lunge, push_up
+    ]
+
+    client.put(f"/exercise/{lunge}", json={
+        "name": "lunge", "description": None, "video_url": None, "user_id": None, "set": 3, "repetition": 5,
+        "duration": 0, "weight": None, "rpe": None, "workout_id": None, "tags": ["browse barbell"],
+    })
+    client.delete(f"/exercise/{pistol}")
+    assert [e["exercise_id"] for e in browse(tags=["browse legs"])["items"]] == [back_squat]
+    assert [e["exercise_id"] for e in browse(tags=["browse barbell"])["items"]] == [back_squat, lunge]
+    assert browse(tags=["no such tag"])["items"] == []
+
+
+def test_similar_exercises_are_served_from_precomputed_neighbours():
+    def add(name, tags):
+        return client.post(
+            "/exercise/",
+            json={"name": name, "description": None, "video_url": None, "user_id": None, "set": 3,
+                  "repetition": 5, "duration": 0, "weight": None, "rpe": None, "workout_id": None, "tags": tags},
+        ).json()["exercise_id"]
+
+    squat = add("similar squat", ["similar legs", "similar barbell"])
+    deadlift = add("similar deadlift", ["similar legs", "similar barbell", "similar back"])
+    lunge = add("similar lunge", ["similar legs"])
+    row = add("similar row", ["similar back"])
+    similarity_refresher.run_once(rebuild=True)
+
+    def similar(exercise_id):
+        return [
+            (s["exercise"]["exercise_id"], round(s["similarity"], 3))
+            for s in client.get(f"/exercise/{exercise_id}/similar").json()
+        ]
+
+    assert similar(squat) == [(deadlift, 0.816), (lunge, 0.707)]
+
+    # a well rated exercise moves up among similar ones
+    user_id, _ = create_logged_in_user("similar@example.com")
+    for _ in range(3):
+        client.post("/rating/", json={"rating": 5, "user_id": user_id, "exercise_id": lunge})
+    similarity_refresher.run_once(rebuild=True)
+    assert [exercise_id for exercise_id, _ in similar(squat)] == [lunge, deadlift]
+
+    # tag writes mark the exercise, the next refresh recomputes only its row
+    client.put(f"/exercise/{row}", json={
+        "name": "similar row", "description": None, "video_url": None, "user_id": None, "set": 3, "repetition": 5,
+        "duration": 0, "weight": None, "rpe": None, "workout_id": None, "tags": ["similar back", "similar barbell"],
+    })
+    assert similarity_refresher.run_once() == 1
+    assert similar(row)[0] == (deadlift, 0.816)
+    client.delete(f"/exercise/{deadlift}")
+    assert [exercise_id for exercise_id, _ in similar(row)] == [squat]
+    assert similar(deadlift) == []
+
+    # a worker starting on the filled table does not rebuild it right away
+    assert not SimilarityRefresher(refresh_seconds=10, rebuild_seconds=3600).rebuild_due()
+    # nor does a launcher's worker on an empty one, the launcher built it before forking
+    launched = SimilarityRefresher(refresh_seconds=10, rebuild_seconds=3600, build_on_startup=False)
+    launched.built = lambda: False
+    assert not launched.rebuild_due()
+
+
+def test_lang_catalog_serves_merged_locale_bundles_with_etags():
+    created = client.post(
+        "/lang/", json={"ru_RU": {"home": {"title": "Главная"}}, "de_DE": {"home": {"title": "Start"}}}
+    )
+    assert created.status_code == 200
+    lang_id = created.json()["lang_id"]
+    assert client.get(f"/lang/{lang_id}").json() == {
+        "lang_id": lang_id, "de_DE": {"home": {"title": "Start"}}, "ru_RU": {"home": {"title": "Главная"}},
+    }
+    assert client.post("/lang/", json={"DE": {}}).status_code == 422
+    assert client.post("/lang/", json={}).status_code == 422
+    # a later row overrides the keys it has and keeps the others
+    client.post("/lang/", json={"de_DE": {"home": {"subtitle": "Willkommen"}}})
+
+    catalog = client.get("/lang/catalog").json()
+    assert {"de_DE", "ru_RU"} <= catalog["locales"].keys()
+    bundle = client.get("/lang/catalog/de_DE")
+    assert bundle.status_code == 200
+    assert bundle.json()["home"] == {"title": "Start", "subtitle": "Willkommen"}
+    etag = bundle.headers["etag"]
+    assert etag == catalog["locales"]["de_DE"]
+    assert client.get("/lang/catalog/de_DE", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    assert client.get("/lang/catalog/de_DE/home.title").json() == {
+        "locale": "de_DE", "key": "home.title", "value": "Start",
+    }
+    assert client.get("/lang/catalog/de_DE/home.missing").status_code == 404
+    assert client.get("/lang/catalog/xx_XX").status_code == 404
+
+    # writes invalidate the catalog, so the old ETag no longer matches
+    client.put(f"/lang/{lang_id}", json={"de_DE": {"home": {"title": "Startseite"}}, "ru_RU": None})
+    changed = client.get("/lang/catalog/de_DE", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["home"]["title"] == "Startseite"
+    assert client.get("/lang/catalog/ru_RU/home.title").json()["value"] == "Главная"
+    assert client.get("/lang/catalog").json()["version"] != catalog["version"]
+    client.delete(f"/lang/{lang_id}")
+    assert client.get("/lang/catalog/de_DE").json()["home"] == {"subtitle": "Willkommen"}
+
+
+def test_entity_reads_are_cached_until_written():
+    user_id = create_user_with_workouts("cached@example.com", 1)
+    workout = client.get(f"/user/{user_id}").json()["workouts"][0]
+    exercise_id = workout["exercises"][0]["exercise_id"]
+
+    first = client.get(f"/workout/{workout['workout_id']}")
+    hits = response_cache.stats()["hits"]
+    with count_queries() as queries:
+        second = client.get(f"/workout/{workout['workout_id']}")
+    assert queries == []
+    assert second.content == first.content
+    assert response_cache.stats()["hits"] == hits + 1
+    assert client.get(f"/workout/{workout['workout_id']}?expand=dates").json().keys() == {
+        "workout_id", "name", "user_id", "dates",
+    }
+
+    # an exercise write drops the exercise and the workout embedding it, every expand variant
+    client.get(f"/exercise/{exercise_id}")
+    client.put(f"/exercise/{exercise_id}", json={
+        "name": "renamed exercise", "description": None, "video_url": None, "user_id": user_id, "set": 3,
+        "repetition": 10, "duration": 0, "weight": 50, "rpe": 7, "workout_id": workout["workout_id"], "tags": None,
+    })
+    assert client.get(f"/exercise/{exercise_id}").json()["name"] == "renamed exercise"
+    names = [e["name"] for e in client.get(f"/workout/{workout['workout_id']}").json()["exercises"]]
+    assert "renamed exercise" in names
+
+    # renaming a tag reaches the exercises carrying it, the tag itself and the tag list
+    tag = client.get(f"/exercise/{exercise_id}").json()["tags"][0]
+    client.get(f"/tag/{tag['tag_id']}/")
+    tags = client.get("/tags/", params={"limit": 200}).json()["items"]
+    client.put(f"/tag/{tag['tag_id']}/", json={"name": "cached renamed tag"})
+    assert client.get(f"/tag/{tag['tag_id']}/").json()["name"] == "cached renamed tag"
+    assert "cached renamed tag" in [t["name"] for t in client.get(f"/exercise/{exercise_id}").json()["tags"]]
+    renamed = client.get("/tags/", params={"limit": 200}).json()["items"]
+    assert len(renamed) == len(tags) and "cached renamed tag" in [t["name"] for t in renamed]
+
+    statuses = client.get("/statuses/").json()["items"]
+    client.post("/status/", json={"name": "PENDING"})
+    assert len(client.get("/statuses/").json()["items"]) == len(statuses) + 1
+    assert client.get("/exercise/999999").status_code == 404
+
+
+def test_user_disabled_by_another_worker_is_refused_despite_cached_token():
+    user_id, headers = create_logged_in_user("other-worker@example.com")
+    assert client.get("/user/me", headers=headers).status_code == 200
+
+    # a write from another worker bumps the version but never reaches this worker's token cache
+    with database.engine.begin() as connection:
+        connection.execute(
+            sa.update(models.User).where(models.User.user_id == user_id)
+            .values(disabled=True, version=models.User.version + 1)
+        )
+    assert client.get("/user/me", headers=headers).status_code == 400
+
+    with database.engine.begin() as connection:
+        connection.execute(sa.delete(models.User).where(models.User.user_id == user_id))
+    assert client.get("/user/me", headers=headers).status_code == 401
+
+
+def test_conditional_requests_follow_entity_versions():
+    user_id, headers = create_logged_in_user("etag@example.com")
+    workout_id = client.post(
+        "/workout/", json={"name": "etag workout", "user_id": user_id, "dates": None}
+    ).json()["workout_id"]
+
+    workout = client.get(f"/workout/{workout_id}")
+    etag = workout.headers["ETag"]
+    with count_queries() as queries:
+        revalidated = client.get(f"/workout/{workout_id}", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.headers["ETag"] == etag
+    assert queries == []
+    assert client.get(f"/workout/{workout_id}?expand=dates").headers["ETag"] != etag
+
+    me = client.get("/user/me", headers=headers)
+    user_etag = me.headers["ETag"]
+    with count_queries() as queries:
+        revalidated = client.get("/user/me", headers={**headers, "If-None-Match": user_etag})
+    assert revalidated.status_code == 304
+    assert len(queries) == 1
+
+    # a date written under the workout moves the workout and its owner
+    client.post("/workout/date/", json={"workout_id": workout_id, "date": "2024-05-01", "completed": False})
+    assert client.get(f"/workout/{workout_id}", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/user/me", headers={**headers, "If-None-Match": user_etag}).status_code == 200
+
+    # writes against a stale version are refused, the current one is accepted
+    stale = client.put(f"/workout/{workout_id}", json={"name": "lost update", "user_id": None},
+                       headers={"If-Match": etag})
+    assert stale.status_code == 412
+    current = client.get(f"/workout/{workout_id}").headers["ETag"]
+    updated = client.put(f"/workout/{workout_id}", json={"name": "etag renamed", "user_id": None},
+                         headers={"If-Match": current})
+    assert updated.status_code == 200 and updated.headers["ETag"] not in (etag, current)
+    # the write returns the ETag of the default read, so the client can revalidate with it straight away
+    assert client.get(f"/workout/{workout_id}", headers={"If-None-Match": updated.headers["ETag"]}).status_code == 304
+
+    user_etag = client.get("/user/me", headers=headers).headers["ETag"]
+    renamed = client.put("/user/", json={"name": "etag renamed"}, headers={**headers, "If-Match": user_etag})
+    assert renamed.status_code == 200
+    assert client.get("/user/me", headers={**headers, "If-None-Match": renamed.headers["ETag"]}).status_code == 304
+    assert client.put("/user/", json={"name": "again"}, headers={**headers, "If-Match": user_etag}).status_code == 412
+
+    friend_id, _ = create_logged_in_user("etag-friend@example.com")
+    status_id = client.post("/status/", json={"name": "PENDING"}).json()["status_id"]
+    friendship_id = client.post(
+        "/friendship/", json={"user_id": user_id, "friend_id": friend_id, "status_id": status_id}
+    ).json()["friendship_id"]
+    page = client.get(f"/friendships/user/{user_id}")
+    page_etag = page.headers["ETag"]
+    assert client.get(f"/friendships/user/{user_id}", headers={"If-None-Match": page_etag}).status_code == 304
+    accepted = client.put(f"/friendship/{friendship_id}/", params={"status_id": status_id},
+                          headers={"If-Match": '"friendship-0-v1"'})
+    assert accepted.status_code == 412
+    accepted = client.put(f"/friendship/{friendship_id}/", params={"status_id": status_id},
+                          headers={"If-Match": f'"friendship-{friendship_id}-v1"'})
+    assert accepted.status_code == 200 and accepted.headers["ETag"] == f'"friendship-{friendship_id}-v2"'
+    assert client.get(f"/friendships/user/{user_id}", headers={"If-None-Match": page_etag}).status_code == 200
+
+
+def test_moving_a_workout_changes_both_owners_etags():
+    first_id, first_headers = create_logged_in_user("etag-first@example.com")
+    second_id, second_headers = create_logged_in_user("etag-second@example.com")
+    workout_id = client.post(
+        "/workout/", json={"name": "handed over", "user_id": first_id, "dates": None}
+    ).json()["workout_id"]
+    first_etag = client.get("/user/me", headers=first_headers).headers["ETag"]
+    second_etag = client.get("/user/me", headers=second_headers).headers["ETag"]
+    workout_etag = client.get(f"/workout/{workout_id}").headers["ETag"].split(".")[0] + '"'
+
+    moved = client.put(f"/workout/{workout_id}", json={"name": None, "user_id": second_id},
+                       headers={"If-Match": workout_etag})
+    assert moved.status_code == 200
+    assert client.get("/user/me", headers={**first_headers, "If-None-Match": first_etag}).status_code == 200
+    assert client.get("/user/me", headers={**second_headers, "If-None-Match": second_etag}).status_code == 200
+    # the version the move was made against is used up
+    again = client.put(f"/workout/{workout_id}", json={"name": None, "user_id": first_id},
+                       headers={"If-Match": workout_etag})
+    assert again.status_code == 412
+
+
+def test_sync_returns_only_changes_since_the_cursor():
+    user_id, headers = create_logged_in_user("sync@example.com")
+    friend_id, _ = create_logged_in_user("sync-friend@example.com")
+    workout_id = client.post(
+        "/workout/",
+        json={"name": "sync workout", "user_id": user_id, "dates": [{"date": "2024-06-01", "completed": False}]},
+    ).json()["workout_id"]
+    exercise = {
+        "name": "sync squat", "description": None, "video_url": None, "user_id": user_id, "set": 3,
+        "repetition": 5, "duration": 0, "weight": 60, "rpe": 7, "workout_id": workout_id, "tags": ["legs"],
+    }
+    exercise_id = client.post("/exercise/", json=exercise).json()["exercise_id"]
+
+    first = client.get("/sync", headers=headers).json()
+    assert [w["workout_id"] for w in first["workouts"]] == [workout_id]
+    assert [d["workout_id"] for d in first["workout_dates"]] == [workout_id]
+    assert [e["exercise_id"] for e in first["exercises"]] == [exercise_id]
+    assert first["deleted"] == [] and not first["has_more"]
+    cursor = first["next_cursor"]
+
+    nothing = client.get("/sync", params={"since": cursor}, headers=headers).json()
+    assert nothing["workouts"] == nothing["exercises"] == nothing["deleted"] == []
+    assert nothing["next_cursor"] == cursor
+
+    # changed rows come back once however often they were written, deleted ones as tombstones
+    for weight in (62, 64):
+        client.put(f"/exercise/{exercise_id}", json={**exercise, "weight": weight, "tags": None})
+    date_id = first["workout_dates"][0]["id"]
+    client.delete(f"/workout/date/{date_id}")
+    status_id = client.post("/status/", json={"name": "PENDING"}).json()["status_id"]
+    friendship_id = client.post(
+        "/friendship/", json={"user_id": friend_id, "friend_id": user_id, "status_id": status_id}
+    ).json()["friendship_id"]
+    with count_queries() as queries:
+        changes = client.get("/sync", params={"since": cursor}, headers=headers).json()
+    assert changes["workouts"] == []
+    assert [(e["exercise_id"], e["weight"]) for e in changes["exercises"]] == [(exercise_id, 64)]
+    assert changes["deleted"] == [{"kind": "workout_date", "id": date_id}]
+    assert [f["friendship_id"] for f in changes["friendships"]] == [friendship_id]
+    # the writes moved the user's version, so the cached token costs a version check and a user lookup,
+    # then the log page, exercises with their tags and friendships
+    assert len(queries) <= 6
+
+    # pages of changes follow the cursor
+    page = client.get("/sync", params={"limit": 1}, headers=headers).json()
+    assert page["has_more"]
+    rest = client.get("/sync", params={"since": page["next_cursor"]}, headers=headers).json()
+    assert len(rest["deleted"]) + sum(len(rest[field]) for field in (
+        "workouts", "workout_dates", "exercises", "ratings", "friendships"
+    )) == 3
+    assert client.get("/sync", params={"since": "not a cursor"}, headers=headers).status_code == 400
+
+
+def test_multi_get_keeps_the_order_asked_and_reports_missing_ids():
+    user_ids = [create_user_with_workouts(f"batch{i}@example.com", 2) for i in range(3)]
+    asked = [user_ids[2], 999999, user_ids[0]]
+
+    with count_queries() as queries:
+        response = client.get("/users", params={"ids": ",".join(map(str, asked + [user_ids[2]]))})
+    assert response.status_code == 200
+    batch = response.json()
+    assert [user["user_id"] for user in batch["items"]] == [user_ids[2], user_ids[0]]
+    assert batch["missing"] == [999999]
+    assert all(len(user["workouts"]) == 2 for user in batch["items"])
+    # users, workouts, exercises, tags and dates: one query each whatever the number of ids
+    assert len(queries) <= 5
+
+    workout_ids = [w["workout_id"] for user in batch["items"] for w in user["workouts"]]
+    workouts = client.get(
+        "/workouts", params={"ids": ",".join(map(str, reversed(workout_ids))), "expand": "dates"}
+    ).json()
+    assert [w["workout_id"] for w in workouts["items"]] == workout_ids[::-1]
+    assert all(w.keys() == {"workout_id", "name", "user_id", "dates"} for w in workouts["items"])
+
+    exercise_ids = [e["exercise_id"] for user in batch["items"] for w in user["workouts"] for e in w["exercises"]]
+    with count_queries() as queries:
+        exercises = client.get("/exercises", params={"ids": ",".join(map(str, exercise_ids))}).json()
+    assert [e["exercise_id"] for e in exercises["items"]] == exercise_ids and exercises["missing"] == []
+    assert len(queries) <= 2
+
+    assert client.get("/exercises", params={"ids": "1,x"}).status_code == 400
+    assert client.get("/exercises", params={"ids": ",".join(map(str, range(1000)))}).status_code == 413
+
+
+def test_sync_follows_workouts_and_ratings_moved_between_users():
+    first_id, first_headers = create_logged_in_user("sync-mover@example.com")
+    second_id, second_headers = create_logged_in_user("sync-receiver@example.com")
+    workout_id = client.post(
+        "/workout/", json={"name": "moved workout", "user_id": first_id, "dates": None}
+    ).json()["workout_id"]
+    exercise_id = client.post("/exercise/", json={
+        "name": "moved squat", "description": None, "video_url": None, "user_id": None, "set": 3,
+        "repetition": 5, "duration": 0, "weight": 60, "rpe": 7, "workout_id": workout_id, "tags": [],
+    }).json()["exercise_id"]
+    rating_id = client.post(
+        "/rating/", json={"rating": 4, "user_id": first_id, "exercise_id": exercise_id}
+    ).json()["rating_id"]
+    first_cursor = client.get("/sync", headers=first_headers).json()["next_cursor"]
+    second_cursor = client.get("/sync", headers=second_headers).json()["next_cursor"]
+
+    client.put(f"/workout/{workout_id}", json={"name": None, "user_id": second_id})
+    client.put(f"/rating/{rating_id}", json={"rating": 5, "user_id": second_id, "exercise_id": exercise_id})
+
+    lost = client.get("/sync", params={"since": first_cursor}, headers=first_headers).json()
+    assert {(d["kind"], d["id"]) for d in lost["deleted"]} >= {
+        ("workout", workout_id), ("exercise", exercise_id), ("rating", rating_id),
+    }
+    assert lost["workouts"] == lost["ratings"] == []
+    gained = client.get("/sync", params={"since": second_cursor}, headers=second_headers).json()
+    assert [w["workout_id"] for w in gained["workouts"]] == [workout_id]
+    assert [e["exercise_id"] for e in gained["exercises"]] == [exercise_id]
+    assert [(r["rating_id"], r["rating"]) for r in gained["ratings"]] == [(rating_id, 5)]
+    assert gained["deleted"] == []